@@ -1,5 +1,6 @@
 import { ModelTag, SystemPrompt, Usage } from '../types/Chat.ts';
 import {
+  getApiKey as getServerApiKey,
   getApiUrl,
   getDeepSeekApiKey,
   getOpenAIApiKey,
@@ -57,6 +58,12 @@ export const invokeOpenAIWithCallBack = async (
     options.headers['request_url' as keyof typeof options.headers] =
       proxyRequestUrl;
   }
+  if (isProxyRequest()) {
+    // the proxy authenticates with the server key, the upstream key is forwarded
+    options.headers.Authorization = 'Bearer ' + getServerApiKey();
+    options.headers['X-Upstream-Api-Key' as keyof typeof options.headers] =
+      getApiKey();
+  }
   if (isOpenRouter) {
     options.headers['HTTP-Referer' as keyof typeof options.headers] =
       GITHUB_LINK;
@@ -334,6 +341,15 @@ function getProxyRequestURL(): string {
   }
 }
 
+function isProxyRequest(): boolean {
+  if (getTextModel().modelTag === ModelTag.OpenAICompatible) {
+    return getOpenAIProxyEnabled();
+  }
+  return (
+    getOpenAIProxyEnabled() && !getTextModel().modelId.includes('deepseek')
+  );
+}
+
 function getApiURL(): string {
   if (getTextModel().modelTag === ModelTag.OpenAICompatible) {
     if (getOpenAIProxyEnabled()) {
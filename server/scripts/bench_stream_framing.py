@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+对比 converse 流的 JSON 与 MessagePack 帧编码
+
+用法：
+    python bench_stream_framing.py                 # 使用合成的长推理流
+    python bench_stream_framing.py recorded.txt    # 使用录制的 /api/converse/v3 输出
+
+录制方式：
+    curl -N "${API_URL}/api/converse/v3" ... > recorded.txt
+
+输出每种编码的总字节数、帧数、编码耗时与客户端解析耗时
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bedrock_integration.framing import pack_frame, unpack_frames  # noqa: E402
+from bedrock_integration.projection import LeanProjection, dumps  # noqa: E402
+
+
+def load_recorded(path):
+    with open(path, encoding="utf-8") as f:
+        chunks = f.read().split("\n\n")
+    return [json.loads(chunk) for chunk in chunks if chunk.strip().startswith("{")]
+
+
+def synthetic_stream(reasoning_deltas=4000, text_deltas=2000):
+    random.seed(0)
+    words = ["the", "model", "stream", "token", "latency", "mobile", "network", "reasoning",
+             "because", "therefore", "请", "思考", "答案", "，", "。"]
+    events = [{"messageStart": {"role": "assistant"}}]
+    for _ in range(reasoning_deltas):
+        text = " ".join(random.choice(words) for _ in range(random.randint(1, 3)))
+        events.append({"contentBlockDelta": {"delta": {"reasoningContent": {"text": text}},
+                                             "contentBlockIndex": 0}})
+    events.append({"contentBlockStop": {"contentBlockIndex": 0}})
+    for _ in range(text_deltas):
+        text = " ".join(random.choice(words) for _ in range(random.randint(1, 3)))
+        events.append({"contentBlockDelta": {"delta": {"text": text}, "contentBlockIndex": 1}})
+    events.append({"contentBlockStop": {"contentBlockIndex": 1}})
+    events.append({"messageStop": {"stopReason": "end_turn"}})
+    events.append({"metadata": {
+        "usage": {"inputTokens": 1200, "outputTokens": 9000, "totalTokens": 10200},
+        "metrics": {"latencyMs": 61234}
+    }})
+    return events
+
+
+def lean_frames(events):
+    projection = LeanProjection()
+    frames = []
+    for event in events:
+        frames.extend(projection.project(event))
+    return frames + projection.finish()
+
+
+def bench(name, frames, encode, decode):
+    start = time.perf_counter()
+    payload = encode(frames)
+    encode_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    decoded = decode(payload)
+    decode_ms = (time.perf_counter() - start) * 1000
+    assert len(decoded) == len(frames), name
+    print(f"{name:<22}{len(frames):>8}{len(payload):>12}{encode_ms:>12.2f}{decode_ms:>12.2f}")
+    return len(payload)
+
+
+def json_v3_encode(frames):
+    return "".join(json.dumps(frame) + "\n\n" for frame in frames).encode("utf-8")
+
+
+def json_v3_decode(payload):
+    return [json.loads(chunk) for chunk in payload.decode("utf-8").split("\n\n") if chunk]
+
+
+def json_lines_encode(frames):
+    return b"".join(dumps(frame) + b"\n" for frame in frames)
+
+
+def json_lines_decode(payload):
+    return [json.loads(line) for line in payload.split(b"\n") if line]
+
+
+def msgpack_encode(frames):
+    return b"".join(pack_frame(frame) for frame in frames)
+
+
+def main():
+    events = load_recorded(sys.argv[1]) if len(sys.argv) > 1 else synthetic_stream()
+    lean = lean_frames(events)
+
+    print(f"{'encoding':<22}{'frames':>8}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    baseline = bench("json raw (v3)", events, json_v3_encode, json_v3_decode)
+    results = {
+        "msgpack raw": bench("msgpack raw", events, msgpack_encode, unpack_frames),
+        "json lean": bench("json lean", lean, json_lines_encode, json_lines_decode),
+        "msgpack lean": bench("msgpack lean", lean, msgpack_encode, unpack_frames),
+    }
+    print()
+    for name, size in results.items():
+        print(f"{name:<22}{size / baseline:>8.1%} of json raw (v3)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+本地模拟 Bedrock Runtime 端点，按凭证限流，用于测试凭证池、准入控制与故障转移
+
+用法：
+    python fake_bedrock.py --port 8010 --rpm 20 --delay 0.05
+
+支持：
+    POST /model/{modelId}/converse-stream   返回 AWS event stream 格式的流式事件
+    POST /model/{modelId}/converse          返回完整回复
+    POST /model/{modelId}/invoke            返回一张 1x1 的图片（images 字段）
+
+限流：按请求签名中的 Access Key ID 计数，每个 Access Key 每分钟最多 --rpm 个请求，
+     超出时返回 429 ThrottlingException
+配合 BEDROCK_CREDENTIAL_POOL 使用：
+    [{"name": "a", "accessKeyId": "key-a", "secretAccessKey": "x", "endpointUrl": "http://127.0.0.1:8010"},
+     {"name": "b", "accessKeyId": "key-b", "secretAccessKey": "x", "endpointUrl": "http://127.0.0.1:8010"}]
+"""
+import argparse
+import binascii
+import json
+import re
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+# 1x1 PNG
+_IMAGE = ("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==")
+_CREDENTIAL = re.compile(r"Credential=([^/]+)/")
+
+
+def encode_header(name: str, value: str) -> bytes:
+    name_bytes = name.encode("utf-8")
+    value_bytes = value.encode("utf-8")
+    # 类型 7：字符串
+    return struct.pack(">B", len(name_bytes)) + name_bytes + struct.pack(">BH", 7, len(value_bytes)) + value_bytes
+
+
+def encode_event(event_type: str, payload: dict) -> bytes:
+    """编码一条 AWS event stream 消息"""
+    headers = (encode_header(":event-type", event_type)
+               + encode_header(":content-type", "application/json")
+               + encode_header(":message-type", "event"))
+    body = json.dumps(payload).encode("utf-8")
+    total = 12 + len(headers) + len(body) + 4
+    prelude = struct.pack(">II", total, len(headers))
+    prelude += struct.pack(">I", binascii.crc32(prelude))
+    message = prelude + headers + body
+    return message + struct.pack(">I", binascii.crc32(message))
+
+
+class RateLimiter:
+    """每个 Access Key 的滑动窗口计数"""
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self.calls = defaultdict(deque)
+        self.lock = threading.Lock()
+
+    def allow(self, key: str) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            calls = self.calls[key]
+            while calls and now - calls[0] > 60:
+                calls.popleft()
+            if self.rpm and len(calls) >= self.rpm:
+                return False
+            calls.append(now)
+            return True
+
+
+class FakeBedrockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    limiter: RateLimiter = None
+    delay = 0.05
+    stats = defaultdict(lambda: {"ok": 0, "throttled": 0})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        match = re.match(r"^/model/([^/]+)/(converse-stream|converse|invoke)$", self.path)
+        if not match:
+            return self.send_json(404, {"message": f"Unknown path {self.path}"}, "ResourceNotFoundException")
+        model_id, operation = unquote(match.group(1)), match.group(2)
+        credential = _CREDENTIAL.search(self.headers.get("Authorization", ""))
+        key = credential.group(1) if credential else "anonymous"
+        if not self.limiter.allow(key):
+            self.stats[key]["throttled"] += 1
+            return self.send_json(429, {"message": "Too many requests, please wait before trying again."},
+                                  "ThrottlingException")
+        self.stats[key]["ok"] += 1
+        text = f"Hello from {model_id} via {key}."
+        if operation == "converse-stream":
+            self.send_stream(text)
+        elif operation == "converse":
+            self.send_json(200, {
+                "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+                "stopReason": "end_turn",
+                "usage": {"inputTokens": len(body) // 4, "outputTokens": len(text) // 4,
+                          "totalTokens": (len(body) + len(text)) // 4},
+                "metrics": {"latencyMs": int(self.delay * 1000)}
+            })
+        else:
+            time.sleep(self.delay)
+            self.send_json(200, {"images": [_IMAGE]})
+
+    def send_json(self, status: int, payload: dict, error_type: str = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if error_type:
+            self.send_header("x-amzn-ErrorType", error_type)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, text: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = text.split(" ")
+        events = [("messageStart", {"role": "assistant"})]
+        events += [("contentBlockDelta", {"delta": {"text": word + " "}, "contentBlockIndex": 0}) for word in words]
+        events += [
+            ("contentBlockStop", {"contentBlockIndex": 0}),
+            ("messageStop", {"stopReason": "end_turn"}),
+            ("metadata", {"usage": {"inputTokens": 10, "outputTokens": len(words), "totalTokens": 10 + len(words)},
+                          "metrics": {"latencyMs": int(self.delay * 1000 * len(words))}})
+        ]
+        try:
+            for event_type, payload in events:
+                time.sleep(self.delay)
+                chunk = encode_event(event_type, payload)
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self.send_json(200, dict(self.stats))
+        self.send_json(404, {"message": "Not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Bedrock Runtime endpoint")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--rpm", type=int, default=20, help="requests per minute per access key (0 = unlimited)")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds between stream events")
+    args = parser.parse_args()
+    FakeBedrockHandler.limiter = RateLimiter(args.rpm)
+    FakeBedrockHandler.delay = args.delay
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeBedrockHandler)
+    print(f"Fake Bedrock listening on http://127.0.0.1:{args.port} ({args.rpm} requests/min per access key)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
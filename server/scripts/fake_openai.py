@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+本地模拟 OpenAI 兼容的 chat completions 端点，用于测试 /api/openai 的上游分组、负载均衡与故障转移
+
+用法：
+    python fake_openai.py --port 8020 --ttfb 0.2 --delay 0.05
+    python fake_openai.py --port 8021 --ttfb 1.5                 # 慢端点
+    python fake_openai.py --port 8022 --fail-rate 0.5            # 一半请求返回 503
+
+支持：
+    POST /v1/chat/completions   以 SSE 流式返回回复，最后一个 chunk 带 usage，以 data: [DONE] 结束
+    GET  /stats                 请求计数
+
+配合 OPENAI_UPSTREAM_GROUPS 使用：
+    {"local": [{"name": "fast", "url": "http://127.0.0.1:8020/v1/chat/completions", "apiKey": "x"},
+               {"name": "slow", "url": "http://127.0.0.1:8021/v1/chat/completions", "apiKey": "x"}]}
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ttfb = 0.2
+    delay = 0.05
+    fail_rate = 0.0
+    stats = {"ok": 0, "failed": 0}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path != "/v1/chat/completions":
+            return self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+        if random.random() < self.fail_rate:
+            self.stats["failed"] += 1
+            return self.send_json(503, {"error": {"message": "Service unavailable"}})
+        self.stats["ok"] += 1
+        time.sleep(self.ttfb)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        model = body.get("model", "fake")
+        words = f"Hello from {model} on port {self.server.server_port}.".split(" ")
+        chunks = [{"model": model, "choices": [{"index": 0, "delta": {"content": word + " "}}]} for word in words]
+        chunks.append({"model": model, "choices": [],
+                       "usage": {"prompt_tokens": 10, "completion_tokens": len(words),
+                                 "total_tokens": 10 + len(words)}})
+        try:
+            for chunk in chunks:
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                time.sleep(self.delay)
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self.send_json(200, self.stats)
+        self.send_json(404, {"error": {"message": "Not found"}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible endpoint")
+    parser.add_argument("--port", type=int, default=8020)
+    parser.add_argument("--ttfb", type=float, default=0.2, help="seconds before the first byte")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds between stream chunks")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+    FakeOpenAIHandler.ttfb = args.ttfb
+    FakeOpenAIHandler.delay = args.delay
+    FakeOpenAIHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeOpenAIHandler)
+    print(f"Fake OpenAI listening on http://127.0.0.1:{args.port} (ttfb {args.ttfb}s, fail rate {args.fail_rate})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Amazon Bedrock Runtime Support"""
@@ -0,0 +1,315 @@
+"""
+自适应准入控制
+
+功能：按 (模型, 区域) 限制发往 Bedrock 的并发与 token 速率，突发流量在服务端排队，而不是变成大量限流错误
+原理（AIMD）：
+  - 每个 (模型, 区域) 开始时不限制并发与 token 速率，Bedrock 未限流时不排队
+  - 出现 ThrottlingException：并发上限设为当时进行中请求数的一半，token 速率设为最近一分钟用量的一半；
+    已有上限时两者减半（乘性减）；只有在上次减半之后准入的请求被限流才再次减半，同一波请求只减一次
+  - 请求成功且上限确实成为瓶颈（达到并发上限、token 桶耗尽或有请求在排队）时：
+    并发上限加 1/上限，token 速率加固定步长（加性增）；超过上界后取消该项限制
+  - token 桶按预估 token 扣减，请求结束后按实际用量修正，可短暂透支
+排队：按到达顺序等待，最多等待 ADMISSION_MAX_WAIT 秒；排队数超过 ADMISSION_MAX_QUEUE 时立即拒绝
+重试：首个事件之前被限流的请求在服务端重试（指数退避 + 随机抖动），不把限流错误直接返回给客户端；
+  重试用尽后抛出 AdmissionRejected，调用方据此返回 429 与 Retry-After
+配置：
+  - ADMISSION_MAX_CONCURRENCY：并发上限恢复到该值以上时取消并发限制（默认 256）
+  - ADMISSION_MAX_TOKENS_PER_MINUTE：token 速率恢复到该值以上时取消 token 限制（默认 2000000）
+  - ADMISSION_MAX_QUEUE：每个 (模型, 区域) 的最大排队数（默认 256）
+  - ADMISSION_MAX_WAIT：最长排队时间，秒（默认 30）
+  - ADMISSION_MAX_RETRIES：限流后的服务端重试次数（默认 2）
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = float(os.environ.get("ADMISSION_MAX_CONCURRENCY", "256"))
+MAX_TOKENS_PER_MINUTE = float(os.environ.get("ADMISSION_MAX_TOKENS_PER_MINUTE", "2000000"))
+MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "256"))
+MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "30"))
+MAX_RETRIES = int(os.environ.get("ADMISSION_MAX_RETRIES", "2"))
+
+_MIN_CONCURRENCY = 1.0
+_MIN_TOKENS_PER_MINUTE = 4000.0
+# 每次成功后 token 速率的增量
+_TOKEN_RATE_STEP = 4000.0
+# 限流时用于估算 token 速率的用量窗口，秒
+_USAGE_WINDOW = 60.0
+# 重试退避
+_BACKOFF_BASE = 0.5
+_BACKOFF_CAP = 8.0
+
+
+class AdmissionRejected(Exception):
+    """排队已满、等待超时或限流重试用尽"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_throttling_error(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code", "").lower() == "throttlingexception"
+    return False
+
+
+def backoff_delay(attempt: int) -> float:
+    """指数退避的完全随机抖动"""
+    return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+
+
+class Ticket:
+    """一次已准入的调用，结束时必须释放（可重复调用）"""
+
+    def __init__(self, limiter: "AdmissionLimiter", tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self, usage: Optional[dict] = None, throttled: bool = False):
+        if not self.released:
+            self.released = True
+            self.limiter.release(self, usage, throttled)
+
+
+class AdmissionLimiter:
+    """单个 (模型, 区域) 的并发上限与 token 桶"""
+
+    def __init__(self, key: Tuple[str, str]):
+        self.key = key
+        # None 表示不限制，首次被限流后才开始限制
+        self.limit: Optional[float] = None
+        self.tokens_per_minute: Optional[float] = None
+        self.level = 0.0
+        self.in_flight = 0
+        self._usage: deque = deque()  # 最近完成的 (时间, token 数)
+        self._refilled_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._waiters: deque = deque()
+        self._changed = asyncio.Event()
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.throttled = 0
+        self.retries = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+
+    async def acquire(self, tokens: int = 0, max_wait: float = MAX_WAIT) -> Ticket:
+        """排队等待准入，超时或排队已满时抛出 AdmissionRejected"""
+        self.reject_if_full()
+        me = object()
+        self._waiters.append(me)
+        self.max_queued = max(self.max_queued, len(self._waiters))
+        start = time.monotonic()
+        deadline = start + max_wait
+        try:
+            while not (self._waiters[0] is me and self._can_admit()):
+                now = time.monotonic()
+                if now >= deadline:
+                    self.timeouts += 1
+                    raise AdmissionRejected(f"Timed out waiting for capacity on {self._name()}",
+                                            self._retry_after())
+                changed = self._changed
+                timeout = deadline - now
+                if self._waiters[0] is me and self._below_limit():
+                    # 只缺 token：等到桶中重新有余量
+                    timeout = min(timeout, -self.level / (self.tokens_per_minute / 60) + 0.01)
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self.in_flight += 1
+            if self.tokens_per_minute is None:
+                tokens = 0
+            self.level -= tokens
+            self.admitted += 1
+            self.total_wait += time.monotonic() - start
+            return Ticket(self, tokens)
+        finally:
+            self._waiters.remove(me)
+            self._notify()
+
+    def reject_if_full(self):
+        if len(self._waiters) >= MAX_QUEUE:
+            self.rejected += 1
+            raise AdmissionRejected(f"Too many queued requests for {self._name()}", self._retry_after())
+
+    def release(self, ticket: Ticket, usage: Optional[dict], throttled: bool):
+        # 包括本次请求在内的进行中请求数
+        in_flight = self.in_flight
+        self.in_flight -= 1
+        now = time.monotonic()
+        if throttled:
+            self.throttled += 1
+            # 被限流的请求没有消耗配额，但桶中余量说明速率估计过高
+            if ticket.admitted_at >= self._decreased_at:
+                self._decreased_at = now
+                self.limit = max(_MIN_CONCURRENCY, (self.limit or in_flight) / 2)
+                rate = self.tokens_per_minute or self._recent_tokens(now)
+                if rate:
+                    if self.tokens_per_minute is None:
+                        self._refilled_at = now
+                    self.tokens_per_minute = max(_MIN_TOKENS_PER_MINUTE, rate / 2)
+                    self.level = min(self.level, 0.0)
+                logger.info(f"Throttled on {self._name()}, concurrency {self.limit:.1f}, "
+                            f"tokens/min {self.tokens_per_minute or 0:.0f}")
+        elif usage is not None:
+            actual = usage.get("inputTokens", 0) + usage.get("outputTokens", 0)
+            self._usage.append((now, actual))
+            if self.tokens_per_minute is not None:
+                self.level -= actual - ticket.tokens
+                # 只有 token 桶成为瓶颈时才提高速率
+                if self.level <= 0 or self._waiters:
+                    self.tokens_per_minute += _TOKEN_RATE_STEP
+                    if self.tokens_per_minute > MAX_TOKENS_PER_MINUTE:
+                        self.tokens_per_minute = None
+            # 只有并发达到上限时才提高上限
+            if self.limit is not None and (in_flight >= int(self.limit) or self._waiters):
+                self.limit += 1 / self.limit
+                if self.limit > MAX_CONCURRENCY:
+                    self.limit = None
+        self._notify()
+
+    def _below_limit(self) -> bool:
+        return self.limit is None or self.in_flight < int(self.limit)
+
+    def _can_admit(self) -> bool:
+        self._refill()
+        return self._below_limit() and (self.tokens_per_minute is None or self.level > 0)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.tokens_per_minute is not None:
+            self.level = min(self.tokens_per_minute,
+                             self.level + (now - self._refilled_at) * self.tokens_per_minute / 60)
+        self._refilled_at = now
+
+    def _recent_tokens(self, now: float) -> int:
+        """最近一分钟完成的请求用掉的 token 数"""
+        while self._usage and self._usage[0][0] < now - _USAGE_WINDOW:
+            self._usage.popleft()
+        return sum(tokens for _, tokens in self._usage)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _retry_after(self) -> float:
+        if self.tokens_per_minute is not None and self.level < 0:
+            return max(1.0, -self.level / (self.tokens_per_minute / 60))
+        return 1.0
+
+    def _name(self) -> str:
+        return "/".join(self.key)
+
+    def get_stats(self) -> Dict:
+        self._refill()
+        return {
+            "concurrency_limit": round(self.limit, 2) if self.limit is not None else None,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_queued": self.max_queued,
+            "tokens_per_minute": int(self.tokens_per_minute) if self.tokens_per_minute is not None else None,
+            "token_level": int(self.level) if self.tokens_per_minute is not None else None,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "avg_wait": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0
+        }
+
+
+class AdmissionController:
+    def __init__(self, max_retries: int = MAX_RETRIES):
+        self.max_retries = max_retries
+        self.limiters: Dict[Tuple[str, str], AdmissionLimiter] = {}
+
+    def limiter(self, model_id: str, region: str) -> AdmissionLimiter:
+        key = (model_id, region)
+        if key not in self.limiters:
+            self.limiters[key] = AdmissionLimiter(key)
+        return self.limiters[key]
+
+    def check(self, model_id: str, region: str):
+        """排队已满时立即拒绝（用于在返回流式响应前给出 429）"""
+        self.limiter(model_id, region).reject_if_full()
+
+    async def stream(
+        self,
+        model_id: str,
+        region: str,
+        tokens: int,
+        make_events: Callable[[], AsyncIterator[dict]]
+    ) -> AsyncIterator[dict]:
+        """准入后产出事件流；首个事件之前被限流时退避重试"""
+        limiter = self.limiter(model_id, region)
+        for attempt in range(self.max_retries + 1):
+            ticket = await limiter.acquire(tokens)
+            started = False
+            usage = None
+            try:
+                async with aclosing(make_events()) as events:
+                    async for event in events:
+                        started = True
+                        if "metadata" in event:
+                            usage = event["metadata"].get("usage")
+                        yield event
+                ticket.release(usage)
+                return
+            except Exception as error:
+                if not is_throttling_error(error):
+                    raise
+                ticket.release(throttled=True)
+                if started:
+                    raise
+                if attempt == self.max_retries:
+                    raise AdmissionRejected(f"Throttled on {limiter._name()} after {attempt} retries",
+                                            limiter._retry_after()) from error
+                limiter.retries += 1
+            finally:
+                ticket.release()
+            await asyncio.sleep(backoff_delay(attempt))
+
+    async def call(self, model_id: str, region: str, fn: Callable[[], Awaitable], tokens: int = 0):
+        """准入后执行一次调用；被限流时退避重试"""
+        limiter = self.limiter(model_id, region)
+        for attempt in range(self.max_retries + 1):
+            ticket = await limiter.acquire(tokens)
+            try:
+                result = await fn()
+                ticket.release({})
+                return result
+            except Exception as error:
+                if not is_throttling_error(error):
+                    raise
+                ticket.release(throttled=True)
+                if attempt == self.max_retries:
+                    raise
+                limiter.retries += 1
+            finally:
+                ticket.release()
+            await asyncio.sleep(backoff_delay(attempt))
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        limiters = {"/".join(key): limiter.get_stats() for key, limiter in self.limiters.items()}
+        return {
+            "queued": sum(stats["queued"] for stats in limiters.values()),
+            "in_flight": sum(stats["in_flight"] for stats in limiters.values()),
+            "limiters": limiters
+        }
+
+
+admission_controller = AdmissionController()
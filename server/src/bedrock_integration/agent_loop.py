@@ -0,0 +1,261 @@
+"""
+服务端工具循环（agent 模式）
+
+功能：模型请求工具时由服务端直接执行并继续对话，多步工具调用在一次客户端请求内完成，
+      省去客户端执行工具、再上传完整历史的往返
+流程：
+  1. 把允许的工具（web_fetch、mcp:*）作为 toolConfig 发给模型
+  2. 模型以 tool_use 结束时，通过 ToolManager 并行执行本步的所有工具调用
+  3. 把 assistant 消息与 toolResult 追加到对话，继续请求模型，直到不再调用工具或达到步数上限
+  4. 以未执行的工具调用结束的回合（达到步数上限等）不保存到服务端会话
+历史中的工具块：服务端会话保存了之前回合的 toolUse / toolResult，Bedrock 要求此时必须带 toolConfig；
+  本轮没有可用工具时，这些块被转换为文本（flatten_tool_blocks），不修改保存的历史
+流式输出：
+  - 各步的事件合并为一个 assistant 回合：只保留第一个 messageStart，内容块序号在各步间连续，
+    中间步骤的 messageStop / metadata 不输出，结束时输出最终 messageStop 和累计用量的 metadata
+  - 工具执行进度以 {"toolProgress": {"step", "toolUseId", "name", "status", "durationMs"}} 事件输出，
+    status 为 running / success / error
+工具名称：Bedrock 工具名只允许字母、数字、_ 和 -，mcp:server:tool 会转换为 mcp_server_tool
+配置：
+  - AGENT_MAX_STEPS：单个请求最多的模型调用次数（默认 8）
+  - AGENT_TOOL_TIMEOUT：单个工具的超时时间，秒（默认 60）
+  - AGENT_TOOL_RESULT_MAX_CHARS：工具结果的最大字符数，超出部分截断（默认 20000）
+"""
+import asyncio
+import fnmatch
+import json
+import logging
+import os
+import re
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from bedrock_integration.message_assembler import MessageAssembler
+
+logger = logging.getLogger(__name__)
+
+MAX_STEPS = int(os.environ.get("AGENT_MAX_STEPS", "8"))
+TOOL_TIMEOUT = float(os.environ.get("AGENT_TOOL_TIMEOUT", "60"))
+TOOL_RESULT_MAX_CHARS = int(os.environ.get("AGENT_TOOL_RESULT_MAX_CHARS", "20000"))
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_-]")
+_USAGE_KEYS = ("inputTokens", "outputTokens", "totalTokens", "cacheReadInputTokens", "cacheWriteInputTokens")
+
+
+def model_tool_name(name: str, taken: Dict[str, str]) -> str:
+    """把工具名转换为 Bedrock 允许的名称（唯一，最长 64 个字符）"""
+    base = _INVALID_NAME_CHARS.sub("_", name.replace(":", "_"))[:64]
+    candidate, suffix = base, 1
+    while candidate in taken:
+        suffix += 1
+        candidate = f"{base[:60]}_{suffix}"
+    return candidate
+
+
+def tool_result_content(result: Any) -> List[dict]:
+    text = result if isinstance(result, str) else json.dumps(result, ensure_ascii=False, default=str)
+    if len(text) > TOOL_RESULT_MAX_CHARS:
+        text = text[:TOOL_RESULT_MAX_CHARS] + "\n...[truncated]"
+    return [{"text": text}]
+
+
+def has_tool_blocks(messages: List[dict]) -> bool:
+    return any("toolUse" in block or "toolResult" in block
+               for message in messages for block in message.get("content", []))
+
+
+def _flatten_block(block: dict) -> List[dict]:
+    if "toolUse" in block:
+        tool_use = block["toolUse"]
+        arguments = json.dumps(tool_use.get("input") or {}, ensure_ascii=False, default=str)
+        return [{"text": f"[Tool call {tool_use['name']}: {arguments}]"}]
+    if "toolResult" in block:
+        tool_result = block["toolResult"]
+        parts, others = [], []
+        for item in tool_result.get("content", []):
+            if "text" in item:
+                parts.append(item["text"])
+            elif "json" in item:
+                parts.append(json.dumps(item["json"], ensure_ascii=False, default=str))
+            else:
+                others.append(item)
+        status = tool_result.get("status", "success")
+        return [{"text": f"[Tool result ({status}): {' '.join(parts)}]"}] + others
+    return [block]
+
+
+def flatten_tool_blocks(messages: List[dict]) -> List[dict]:
+    """把 toolUse / toolResult 块转换为文本，用于不带 toolConfig 的请求（只复制被改动的消息）"""
+    flattened = []
+    for message in messages:
+        content = message.get("content", [])
+        if any("toolUse" in block or "toolResult" in block for block in content):
+            message = {**message, "content": [part for block in content for part in _flatten_block(block)]}
+        flattened.append(message)
+    return flattened
+
+
+class AgentStats:
+    def __init__(self):
+        self.turns = 0
+        self.steps = 0
+        self.tool_calls = 0
+        self.tool_errors = 0
+        self.parallel_batches = 0
+        self.max_steps_reached = 0
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "turns": self.turns,
+            "steps": self.steps,
+            "tool_calls": self.tool_calls,
+            "tool_errors": self.tool_errors,
+            "parallel_batches": self.parallel_batches,
+            "max_steps_reached": self.max_steps_reached
+        }
+
+
+agent_stats = AgentStats()
+
+
+class AgentLoop:
+    def __init__(self, tool_manager, patterns: List[str], tool_config: Optional[dict] = None,
+                 max_steps: Optional[int] = None):
+        self.tool_manager = tool_manager
+        self.patterns = patterns
+        self.tool_config = tool_config or {}
+        self.max_steps = min(max_steps or MAX_STEPS, MAX_STEPS)
+        self.name_map: Dict[str, str] = {}   # {模型使用的名称: ToolManager 名称}
+        self.turn_messages: List[dict] = []  # 本回合新增的消息（assistant / toolResult / 最终 assistant）
+        self.complete = False
+
+    def prepare(self, command: dict):
+        """把允许的工具加入 converse 命令"""
+        tools = []
+        for spec in self.tool_manager.list_tool_specs():
+            if not any(fnmatch.fnmatchcase(spec["name"], pattern) for pattern in self.patterns):
+                continue
+            name = model_tool_name(spec["name"], self.name_map)
+            self.name_map[name] = spec["name"]
+            tools.append({"toolSpec": {
+                "name": name,
+                "description": spec["description"] or spec["name"],
+                "inputSchema": {"json": spec["inputSchema"]}
+            }})
+        if tools:
+            command["toolConfig"] = {"tools": tools}
+
+    async def run(self, command: dict, call_model: Callable[[dict], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+        """执行工具循环，产出合并后的事件流"""
+        agent_stats.turns += 1
+        usage: Dict[str, int] = {}
+        latency_ms = 0
+        index_offset = 0
+        for step in range(self.max_steps):
+            agent_stats.steps += 1
+            assembler = MessageAssembler()
+            held = []
+            async with aclosing(call_model(command)) as events:
+                async for event in events:
+                    assembler.feed(event)
+                    if "messageStart" in event:
+                        if step == 0:
+                            yield event
+                    elif "messageStop" in event:
+                        held.append(event)
+                    elif "metadata" in event:
+                        metadata = event["metadata"]
+                        for key in _USAGE_KEYS:
+                            if key in metadata.get("usage", {}):
+                                usage[key] = usage.get(key, 0) + metadata["usage"][key]
+                        latency_ms += metadata.get("metrics", {}).get("latencyMs", 0)
+                    else:
+                        yield self._offset(event, index_offset)
+
+            message = assembler.message()
+            tool_uses = [block["toolUse"] for block in message["content"] if "toolUse" in block]
+            if assembler.stop_reason != "tool_use" or not tool_uses or not self.name_map:
+                break
+            if step == self.max_steps - 1:
+                agent_stats.max_steps_reached += 1
+                break
+
+            results = []
+            async for item in self._execute_tools(step, tool_uses):
+                if "toolProgress" in item:
+                    yield item
+                else:
+                    results.append(item)
+            tool_message = {"role": "user", "content": results}
+            command["messages"] = command["messages"] + [message, tool_message]
+            self.turn_messages += [message, tool_message]
+            index_offset += max(assembler.blocks, default=-1) + 1
+
+        self.turn_messages.append(message)
+        # 达到步数上限或没有可执行的工具时，最后的消息仍带着未回复的 toolUse，
+        # 这样的回合保存到会话后，后续请求会因缺少 toolResult 被 Bedrock 拒绝
+        self.complete = assembler.complete and assembler.stop_reason != "tool_use"
+        for event in held:
+            yield event
+        yield {"metadata": {"usage": usage, "metrics": {"latencyMs": latency_ms}}}
+
+    @staticmethod
+    def _offset(event: dict, offset: int) -> dict:
+        if not offset:
+            return event
+        for key in ("contentBlockStart", "contentBlockDelta", "contentBlockStop"):
+            if key in event:
+                body = event[key]
+                return {key: {**body, "contentBlockIndex": body["contentBlockIndex"] + offset}}
+        return event
+
+    async def _execute_tools(self, step: int, tool_uses: List[dict]) -> AsyncIterator[dict]:
+        """并行执行工具，按完成顺序产出进度事件，最后按原顺序产出 toolResult 块"""
+        if len(tool_uses) > 1:
+            agent_stats.parallel_batches += 1
+        for tool_use in tool_uses:
+            yield self._progress(step, tool_use, "running")
+        tasks = [asyncio.ensure_future(self._execute(step, tool_use)) for tool_use in tool_uses]
+        results = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                block, progress = await next_done
+                results[block["toolResult"]["toolUseId"]] = block
+                yield progress
+        finally:
+            for task in tasks:
+                task.cancel()
+        for tool_use in tool_uses:
+            yield results[tool_use["toolUseId"]]
+
+    async def _execute(self, step: int, tool_use: dict) -> tuple[dict, dict]:
+        agent_stats.tool_calls += 1
+        start = time.time()
+        name = self.name_map.get(tool_use["name"])
+        try:
+            if name is None:
+                raise ValueError(f"Tool not found: {tool_use['name']}")
+            result = await asyncio.wait_for(
+                self.tool_manager.execute_tool(name, tool_use.get("input") or {}, self.tool_config),
+                TOOL_TIMEOUT
+            )
+            content, status = tool_result_content(result), "success"
+        except Exception as error:
+            logger.warning(f"Tool {tool_use['name']} failed: {error}")
+            agent_stats.tool_errors += 1
+            content, status = [{"text": f"Error: {error}"}], "error"
+        block = {"toolResult": {"toolUseId": tool_use["toolUseId"], "content": content, "status": status}}
+        progress = self._progress(step, tool_use, status, int((time.time() - start) * 1000))
+        return block, progress
+
+    def _progress(self, step: int, tool_use: dict, status: str, duration_ms: Optional[int] = None) -> dict:
+        progress = {
+            "step": step,
+            "toolUseId": tool_use["toolUseId"],
+            "name": self.name_map.get(tool_use["name"], tool_use["name"]),
+            "status": status
+        }
+        if duration_ms is not None:
+            progress["durationMs"] = duration_ms
+        return {"toolProgress": progress}
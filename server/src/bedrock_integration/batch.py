@@ -0,0 +1,99 @@
+"""
+批量 converse
+
+功能：一次请求提交多个互不相关的 converse 请求（会话标题、标签、翻译等后台任务），
+      并发执行，按完成顺序逐行返回结果，省去每个请求单独的 HTTP 往返
+策略：
+  - 每批最多 BATCH_MAX_CONCURRENCY 个请求同时执行，其余在批内排队；发往 Bedrock 的调用仍受准入控制限制
+  - 单项失败只影响该项，结果行带 error（被准入控制拒绝时另带 retryAfter），其余项继续
+  - 结果行：{"index", "id", "status": "ok" | "error", ..., "elapsedMs"}，最后一行为汇总 {"done": {...}}
+  - 客户端断开时取消所有未完成的项
+配置：
+  - BATCH_MAX_ITEMS：单批最多的请求数（默认 100）
+  - BATCH_MAX_CONCURRENCY：单批同时执行的请求数（默认 16）
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from bedrock_integration.admission import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "100"))
+MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "16"))
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.items = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.running = 0
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "running": self.running
+        }
+
+
+batch_stats = BatchStats()
+
+
+async def run_batch(
+    jobs: List[Tuple[Optional[str], Callable[[], Awaitable[dict]]]],
+    concurrency: int = MAX_CONCURRENCY
+) -> AsyncIterator[dict]:
+    """并发执行 (id, job) 列表，按完成顺序产出结果行，最后产出汇总"""
+    batch_stats.batches += 1
+    batch_stats.items += len(jobs)
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.monotonic()
+
+    async def run(index: int, item_id: Optional[str], job: Callable[[], Awaitable[dict]]) -> dict:
+        async with semaphore:
+            batch_stats.running += 1
+            item_start = time.monotonic()
+            line = {"index": index, "id": item_id}
+            try:
+                result = await job()
+                line.update(status="ok", **result)
+            except AdmissionRejected as error:
+                line.update(status="error", error=str(error), retryAfter=error.retry_after)
+            except Exception as error:
+                logger.warning(f"Batch item {index} failed: {error}")
+                line.update(status="error", error=str(error))
+            finally:
+                batch_stats.running -= 1
+            line["elapsedMs"] = int((time.monotonic() - item_start) * 1000)
+            return line
+
+    tasks = [asyncio.ensure_future(run(index, item_id, job)) for index, (item_id, job) in enumerate(jobs)]
+    failed = 0
+    completed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            completed += 1
+            if line["status"] == "error":
+                failed += 1
+                batch_stats.failed += 1
+            yield line
+    finally:
+        batch_stats.cancelled += len(tasks) - completed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    yield {"done": {
+        "total": len(jobs),
+        "succeeded": len(jobs) - failed,
+        "failed": failed,
+        "elapsedMs": int((time.monotonic() - start) * 1000)
+    }}
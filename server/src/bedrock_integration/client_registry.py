@@ -0,0 +1,240 @@
+"""
+AWS 客户端注册表
+
+功能：进程内复用 boto3 客户端，避免每个请求重复解析凭证、解析 endpoint 和 TLS 握手
+职责：
+  - 按 (服务, 区域, 凭证) 缓存 bedrock-runtime / bedrock / sts / ssm 客户端
+  - 统一连接池大小与 TCP keep-alive 配置
+  - 启动时为常用区域预热客户端
+  - LRU 淘汰，避免调用方自带的临时凭证无限增长
+  - 创建客户端需要数十毫秒：不持有全局锁创建（同一 Session 上的创建串行），
+    事件循环中使用 get_client_async，未命中时在线程池中创建
+配置：
+  - AWS_MAX_POOL_CONNECTIONS：每个客户端的连接池大小（默认 100）
+  - AWS_CLIENT_CACHE_SIZE：最多缓存的客户端数量（默认 64）
+  - AWS_CLIENT_MAX_ATTEMPTS：SDK 内部的最大尝试次数（默认 2）；限流由准入控制、凭证池与故障转移处理，
+    SDK 内部不宜长时间重试
+  - BEDROCK_WARMUP_REGIONS：启动时预热的区域，逗号分隔，如 us-west-2,us-east-1
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import (
+    AssumeRoleCredentialFetcher, CredentialProvider, DeferredRefreshableCredentials
+)
+from workload_pools import MAX_POOL_CONNECTIONS, run_in_pool
+
+logger = logging.getLogger(__name__)
+
+MAX_CLIENTS = int(os.environ.get("AWS_CLIENT_CACHE_SIZE", "64"))
+MAX_ATTEMPTS = int(os.environ.get("AWS_CLIENT_MAX_ATTEMPTS", "2"))
+WARMUP_REGIONS = [
+    region.strip()
+    for region in os.environ.get("BEDROCK_WARMUP_REGIONS", "").split(",")
+    if region.strip()
+]
+
+
+class ClientRegistry:
+    def __init__(self, max_pool_connections: int = MAX_POOL_CONNECTIONS, max_clients: int = MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
+            retries={"mode": "standard", "total_max_attempts": MAX_ATTEMPTS}
+        )
+        self._clients: OrderedDict = OrderedDict()
+        self._sessions: Dict[str, boto3.session.Session] = {}
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.hits = 0
+        self.evicted = 0
+
+    def get_client(
+        self,
+        service: str,
+        region: Optional[str] = None,
+        credentials: Optional[Dict[str, str]] = None,
+        endpoint_url: Optional[str] = None
+    ):
+        """
+        获取（或创建）客户端
+
+        credentials 使用 boto3 参数名：aws_access_key_id / aws_secret_access_key /
+        aws_session_token / profile_name；另外支持 role_arn（可选 external_id），
+        以默认凭证链（或 profile_name）为源自动 AssumeRole 并在过期前刷新；
+        为空时使用进程默认凭证链
+        """
+        credentials = {k: v for k, v in (credentials or {}).items() if v}
+        fingerprint = self._fingerprint(credentials)
+        key = (service, region, endpoint_url, fingerprint)
+        client = self._lookup(key)
+        if client is not None:
+            return client
+
+        # boto3 Session 不是线程安全的，同一 Session 上的创建串行；全局锁只保护缓存，不在创建期间持有
+        with self._session_lock(fingerprint):
+            client = self._lookup(key)
+            if client is not None:
+                return client
+            with self._lock:
+                session = self._sessions.get(fingerprint)
+            if session is None:
+                session = self._create_session(credentials)
+            client = session.client(
+                service,
+                region_name=region,
+                endpoint_url=endpoint_url,
+                config=self.config
+            )
+
+        with self._lock:
+            self._sessions[fingerprint] = session
+            self._clients[key] = client
+            self.created += 1
+            while len(self._clients) > self.max_clients:
+                # 被淘汰的客户端可能仍有进行中的请求，不主动关闭
+                self._clients.popitem(last=False)
+                self.evicted += 1
+            self._prune_sessions()
+        return client
+
+    def cached_client(
+        self,
+        service: str,
+        region: Optional[str] = None,
+        credentials: Optional[Dict[str, str]] = None,
+        endpoint_url: Optional[str] = None
+    ):
+        """只查缓存，未命中时返回 None"""
+        credentials = {k: v for k, v in (credentials or {}).items() if v}
+        return self._lookup((service, region, endpoint_url, self._fingerprint(credentials)))
+
+    def _lookup(self, key: tuple):
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+            return client
+
+    def _session_lock(self, fingerprint: str) -> threading.Lock:
+        with self._lock:
+            return self._session_locks.setdefault(fingerprint, threading.Lock())
+
+    def warm_up(self, regions: List[str]):
+        """为指定区域预先创建客户端并解析默认凭证"""
+        for region in regions:
+            try:
+                self.get_client("bedrock-runtime", region)
+                self.get_client("bedrock", region)
+                logger.info(f"Warmed up Bedrock clients for {region}")
+            except Exception as e:
+                logger.warning(f"Failed to warm up Bedrock clients for {region}: {e}")
+        try:
+            session = self._sessions.get(self._fingerprint({}))
+            if session is not None and session.get_credentials() is not None:
+                session.get_credentials().get_frozen_credentials()
+        except Exception as e:
+            logger.warning(f"Failed to resolve default credentials: {e}")
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        with self._lock:
+            by_service: Dict[str, int] = {}
+            for service, *_ in self._clients:
+                by_service[service] = by_service.get(service, 0) + 1
+            return {
+                "clients": len(self._clients),
+                "by_service": by_service,
+                "created": self.created,
+                "hits": self.hits,
+                "evicted": self.evicted,
+                "max_pool_connections": self.config.max_pool_connections
+            }
+
+    def _prune_sessions(self):
+        live = {key[3] for key in self._clients}
+        for fingerprint in list(self._sessions):
+            if fingerprint not in live and fingerprint != self._fingerprint({}):
+                del self._sessions[fingerprint]
+                self._session_locks.pop(fingerprint, None)
+
+    @staticmethod
+    def _create_session(credentials: Dict[str, str]) -> boto3.session.Session:
+        role_arn = credentials.get("role_arn")
+        if not role_arn:
+            return boto3.session.Session(**credentials)
+        source = boto3.session.Session(**{
+            k: v for k, v in credentials.items() if k not in ("role_arn", "external_id")
+        })
+        extra_args = {"RoleSessionName": "swift-chat"}
+        if credentials.get("external_id"):
+            extra_args["ExternalId"] = credentials["external_id"]
+        fetcher = AssumeRoleCredentialFetcher(
+            client_creator=source._session.create_client,
+            source_credentials=source.get_credentials(),
+            role_arn=role_arn,
+            extra_args=extra_args
+        )
+        core_session = botocore.session.Session()
+        core_session.get_component("credential_provider").insert_before(
+            "env", _AssumeRoleProvider(fetcher))
+        return boto3.session.Session(botocore_session=core_session, region_name=source.region_name)
+
+    @staticmethod
+    def _fingerprint(credentials: Dict[str, str]) -> str:
+        if not credentials:
+            return "default"
+        raw = "\0".join(credentials.get(k, "") for k in (
+            "aws_access_key_id", "aws_secret_access_key", "aws_session_token",
+            "profile_name", "role_arn", "external_id"
+        ))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class _AssumeRoleProvider(CredentialProvider):
+    """AssumeRole 得到的临时凭证，首次使用时获取，过期前自动刷新"""
+    METHOD = "assume-role-pool"
+
+    def __init__(self, fetcher: AssumeRoleCredentialFetcher):
+        super().__init__()
+        self._fetcher = fetcher
+
+    def load(self):
+        return DeferredRefreshableCredentials(
+            refresh_using=self._fetcher.fetch_credentials,
+            method=self.METHOD
+        )
+
+
+client_registry = ClientRegistry()
+
+
+def get_client(
+    service: str,
+    region: Optional[str] = None,
+    credentials: Optional[Dict[str, str]] = None,
+    endpoint_url: Optional[str] = None
+):
+    return client_registry.get_client(service, region, credentials, endpoint_url)
+
+
+async def get_client_async(
+    service: str,
+    region: Optional[str] = None,
+    credentials: Optional[Dict[str, str]] = None,
+    endpoint_url: Optional[str] = None
+):
+    """事件循环中获取客户端：命中缓存时直接返回，需要新建时在线程池中创建"""
+    client = client_registry.cached_client(service, region, credentials, endpoint_url)
+    if client is not None:
+        return client
+    return await run_in_pool("control", client_registry.get_client, service, region, credentials, endpoint_url)
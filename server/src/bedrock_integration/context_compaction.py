@@ -0,0 +1,371 @@
+"""
+上下文压缩
+
+功能：发送给 Bedrock 前限制历史的 token 数，长对话的首 token 延迟与输入成本保持有界
+预算：min(模型上下文窗口 - maxTokens, COMPACTION_MAX_INPUT_TOKENS)
+压缩步骤（仅在超出预算时执行，压缩到预算的 COMPACTION_TARGET_RATIO 以减少压缩频率）：
+  1. 去除过期媒体：最近 COMPACTION_KEEP_MEDIA_TURNS 轮用户消息之前的图片、文档、视频替换为占位文本
+  2. 丢弃最早的若干轮对话，只在不含 toolResult 的用户消息处切分，保证工具调用成对
+  3. COMPACTION_MODE=summarize 时，用低成本模型总结被丢弃的部分，并插入到保留的第一条用户消息前
+会话状态：每个会话记住切分位置与总结，后续轮次在预算内沿用，不重复总结，也保持 prompt 缓存前缀稳定；
+         总结增量生成（上一次总结 + 新丢弃的消息）
+         状态以切分点之前全部消息的哈希校验；没有会话 ID 时也以该哈希查找，开头相同的不同对话不会共用总结；
+         只在需要时计算哈希：有会话 ID 时只哈希切分点之前的消息，在预算内且没有保存的状态时不计算
+总结调用与普通请求一样经过凭证池与准入控制
+不修改传入的消息（可能是服务端保存的历史），只复制被改动的消息
+配置：
+  - COMPACTION_ENABLED：默认 false，开启后才压缩
+  - COMPACTION_MAX_INPUT_TOKENS：默认 100000
+  - COMPACTION_TARGET_RATIO：默认 0.75
+  - COMPACTION_KEEP_MEDIA_TURNS：默认 2
+  - COMPACTION_MODE：drop（默认）或 summarize
+  - COMPACTION_SUMMARY_MODEL：总结模型；未设置时按请求区域使用 Nova Micro 的跨区域推理配置
+    （us. / eu. / apac.），其他区域使用请求本身的模型
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from bedrock_integration.admission import admission_controller
+from bedrock_integration.credential_pool import credential_pool
+from bedrock_integration.token_estimator import (
+    MEDIA_BLOCKS, estimate_message_tokens, estimate_messages_tokens
+)
+from workload_pools import run_in_pool
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("COMPACTION_ENABLED", "false").lower() == "true"
+MAX_INPUT_TOKENS = int(os.environ.get("COMPACTION_MAX_INPUT_TOKENS", "100000"))
+TARGET_RATIO = float(os.environ.get("COMPACTION_TARGET_RATIO", "0.75"))
+KEEP_MEDIA_TURNS = int(os.environ.get("COMPACTION_KEEP_MEDIA_TURNS", "2"))
+MODE = os.environ.get("COMPACTION_MODE", "drop")
+SUMMARY_MODEL = os.environ.get("COMPACTION_SUMMARY_MODEL", "")
+
+# 保存的会话状态数量上限
+_STATE_SIZE = 1024
+# 总结输入中每条消息与总长度的字符上限
+_SUMMARY_MESSAGE_CHARS = 2000
+_SUMMARY_INPUT_CHARS = 24000
+
+# (模型 ID 片段, 上下文窗口 token 数)，更具体的片段在前
+_CONTEXT_WINDOWS = [
+    ("anthropic.claude", 200000),
+    ("amazon.nova-premier", 1000000),
+    ("amazon.nova-micro", 128000),
+    ("amazon.nova", 300000),
+    ("meta.llama3-8b", 8000),
+    ("meta.llama3-70b", 8000),
+    ("meta.llama", 128000),
+    ("deepseek", 128000),
+    ("mistral.mistral-large", 128000),
+    ("mistral.pixtral", 128000),
+    ("writer.palmyra", 128000),
+]
+_DEFAULT_CONTEXT_WINDOW = 32000
+
+# (区域前缀, 推理配置前缀)，Nova Micro 只通过这些跨区域推理配置提供
+_SUMMARY_PROFILES = [
+    ("us-gov-", None),
+    ("us-", "us."),
+    ("eu-", "eu."),
+    ("ap-", "apac."),
+]
+_SUMMARY_BASE_MODEL = "amazon.nova-micro-v1:0"
+
+_SUMMARY_PROMPT = (
+    "Summarize the earlier part of the conversation below so it can replace the original messages. "
+    "Keep facts, decisions, names, numbers, code identifiers and open questions. "
+    "Write in the same language as the conversation, at most 300 words, without any preamble."
+)
+
+
+def context_window(model_id: str) -> int:
+    for pattern, tokens in _CONTEXT_WINDOWS:
+        if pattern in model_id:
+            return tokens
+    return _DEFAULT_CONTEXT_WINDOW
+
+
+def summary_model(region: str, model_id: str) -> str:
+    """总结使用的模型：配置的模型，或请求区域可用的 Nova Micro 推理配置，否则为请求本身的模型"""
+    if SUMMARY_MODEL:
+        return SUMMARY_MODEL
+    for region_prefix, profile_prefix in _SUMMARY_PROFILES:
+        if region.startswith(region_prefix):
+            return profile_prefix + _SUMMARY_BASE_MODEL if profile_prefix else model_id
+    return model_id
+
+
+def input_budget(model_id: str, max_tokens: int) -> int:
+    """模型允许的输入 token 预算"""
+    return max(1024, min(context_window(model_id) - max_tokens, MAX_INPUT_TOKENS))
+
+
+def is_turn_start(message: dict) -> bool:
+    """可作为切分点的消息：用户消息，且不是对上一条工具调用的回复"""
+    return message.get("role") == "user" and not any(
+        "toolResult" in block for block in message.get("content", []))
+
+
+def strip_media(message: dict) -> tuple[dict, int]:
+    """用占位文本替换媒体块，返回 (新消息, 替换数量)"""
+    content = message.get("content", [])
+    stripped = 0
+    new_content = []
+    for block in content:
+        media = next((key for key in MEDIA_BLOCKS if key in block), None)
+        if media is not None:
+            new_content.append({"text": f"[{media} omitted]"})
+            stripped += 1
+        elif "toolResult" in block:
+            result = block["toolResult"]
+            items, count = strip_media({"content": result.get("content", [])})
+            if count:
+                block = {"toolResult": {**result, "content": items["content"]}}
+                stripped += count
+            new_content.append(block)
+        else:
+            new_content.append(block)
+    if not stripped:
+        return message, 0
+    return {**message, "content": new_content}, stripped
+
+
+def render_for_summary(messages: List[dict]) -> str:
+    """把消息转换为总结模型的输入文本"""
+    lines = []
+    for message in messages:
+        parts = []
+        for block in message.get("content", []):
+            if "text" in block:
+                parts.append(block["text"])
+            elif "toolUse" in block:
+                tool_use = block["toolUse"]
+                parts.append(f"[tool call {tool_use.get('name')}: "
+                             f"{json.dumps(tool_use.get('input', {}), ensure_ascii=False)}]")
+            elif "toolResult" in block:
+                texts = [item["text"] for item in block["toolResult"].get("content", []) if "text" in item]
+                parts.append(f"[tool result: {' '.join(texts)}]")
+            else:
+                media = next((key for key in MEDIA_BLOCKS if key in block), None)
+                if media is not None:
+                    parts.append(f"[{media}]")
+        text = " ".join(parts)[:_SUMMARY_MESSAGE_CHARS]
+        lines.append(f"{message.get('role', 'user').capitalize()}: {text}")
+    return "\n".join(lines)[-_SUMMARY_INPUT_CHARS:]
+
+
+def summarize(client, model_id: str, previous: Optional[str], messages: List[dict]) -> str:
+    """调用低成本模型总结被丢弃的消息（同步，在线程池中执行）"""
+    conversation = render_for_summary(messages)
+    if previous:
+        conversation = f"Summary of the part before:\n{previous}\n\n{conversation}"
+    response = client.converse(
+        modelId=model_id,
+        system=[{"text": _SUMMARY_PROMPT}],
+        messages=[{"role": "user", "content": [{"text": conversation}]}],
+        inferenceConfig={"maxTokens": 600, "temperature": 0}
+    )
+    blocks = response["output"]["message"]["content"]
+    return "".join(block.get("text", "") for block in blocks).strip()
+
+
+def _encode_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"blake2b": hashlib.blake2b(value, digest_size=16).hexdigest()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def prefix_digests(messages: List[dict], count: Optional[int] = None) -> List[str]:
+    """累积哈希，digests[i] 覆盖 messages[:i] 的全部内容，用于识别对话与校验保存的状态（只计算到 count）"""
+    digest = hashlib.sha256()
+    digests = [digest.hexdigest()]
+    for message in messages[:count]:
+        canonical = json.dumps(message, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+                               default=_encode_bytes)
+        digest.update(canonical.encode("utf-8") + b"\n")
+        digests.append(digest.hexdigest())
+    return digests
+
+
+class ContextCompactor:
+    def __init__(self, enabled: bool = ENABLED, mode: str = MODE):
+        self.enabled = enabled
+        self.mode = mode
+        self._states: OrderedDict = OrderedDict()  # {会话键: {cut, fingerprint, summary}}
+        self.checked = 0
+        self.compacted = 0
+        self.dropped_messages = 0
+        self.stripped_media = 0
+        self.summaries = 0
+        self.summary_reused = 0
+        self.summary_failures = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    async def compact(
+        self,
+        messages: List[dict],
+        model_id: str,
+        max_tokens: int,
+        region: str,
+        conversation_id: Optional[str] = None
+    ) -> List[dict]:
+        """返回不超过预算的消息列表（未超出时原样返回）"""
+        if not self.enabled or not messages:
+            return messages
+        self.checked += 1
+        budget = input_budget(model_id, max_tokens)
+        total = estimate_messages_tokens(messages)
+        if conversation_id:
+            state = self._states.get(conversation_id)
+            if total <= budget and state is None:
+                return messages
+            digests = None
+            state = self._check_state(state, messages)
+        else:
+            if total <= budget:
+                return messages
+            digests = prefix_digests(messages)
+            state = self._find_state(messages, digests)
+        if total <= budget and state is None:
+            return messages
+
+        target = int(budget * TARGET_RATIO)
+        compacted = self._strip_stale_media(messages)
+        tokens = [estimate_message_tokens(message) for message in compacted]
+
+        # 沿用上一轮的切分点，仍在预算内时不移动，保持前缀稳定
+        cut = state["cut"] if state is not None else 0
+        if sum(tokens[cut:]) > budget:
+            cut = self._find_cut(compacted, tokens, cut, target)
+
+        if cut == 0:
+            result = compacted
+        else:
+            result = compacted[cut:]
+            summary = await self._summary_for(state, messages, cut, region, model_id)
+            if summary:
+                first = result[0]
+                result[0] = {**first, "content": [
+                    {"text": f"[Summary of the earlier conversation]\n{summary}"}
+                ] + list(first.get("content", []))}
+            if digests:
+                fingerprint = digests[cut]
+            elif state is not None and state["cut"] == cut:
+                fingerprint = state["fingerprint"]
+            else:
+                fingerprint = prefix_digests(messages, cut)[-1]
+            self._save_state(conversation_id or "h:" + fingerprint, cut, fingerprint, summary)
+
+        after = estimate_messages_tokens(result)
+        if after < total:
+            self.compacted += 1
+            self.dropped_messages += cut
+            self.tokens_before += total
+            self.tokens_after += after
+        return result
+
+    def _strip_stale_media(self, messages: List[dict]) -> List[dict]:
+        turns = 0
+        keep_from = 0
+        for index in range(len(messages) - 1, -1, -1):
+            if is_turn_start(messages[index]):
+                turns += 1
+                if turns >= KEEP_MEDIA_TURNS:
+                    keep_from = index
+                    break
+        result = list(messages)
+        for index in range(keep_from):
+            result[index], count = strip_media(result[index])
+            self.stripped_media += count
+        return result
+
+    @staticmethod
+    def _find_cut(messages: List[dict], tokens: List[int], start: int, target: int) -> int:
+        """从 start 开始向后寻找第一个使剩余部分不超过 target 的切分点（至少保留最后一轮）"""
+        remaining = sum(tokens[start:])
+        last_turn = max((i for i, m in enumerate(messages) if is_turn_start(m)), default=0)
+        cut = start
+        for index in range(start, len(messages)):
+            if index > start and is_turn_start(messages[index]):
+                cut = index
+                if remaining <= target:
+                    break
+            if index >= last_turn:
+                break
+            remaining -= tokens[index]
+        return cut
+
+    async def _summary_for(self, state: Optional[dict], messages: List[dict],
+                           cut: int, region: str, model_id: str) -> Optional[str]:
+        if self.mode != "summarize":
+            return None
+        previous, summarized = None, 0
+        if state is not None and state.get("summary") and state["cut"] <= cut:
+            previous, summarized = state["summary"], state["cut"]
+            if summarized == cut:
+                self.summary_reused += 1
+                return previous
+        model = summary_model(region, model_id)
+
+        async def invoke():
+            async with credential_pool.lease(region) as lease:
+                return await run_in_pool("summary", summarize, await lease.client_async(), model,
+                                         previous, messages[summarized:cut])
+
+        try:
+            summary = await admission_controller.call(model, region, invoke)
+            self.summaries += 1
+            return summary
+        except Exception as error:
+            # 总结失败时退化为直接丢弃
+            logger.warning(f"Failed to summarize conversation history: {error}")
+            self.summary_failures += 1
+            return previous
+
+    @staticmethod
+    def _check_state(state: Optional[dict], messages: List[dict]) -> Optional[dict]:
+        """校验会话保存的状态，只哈希切分点之前的消息"""
+        if state is not None and (state["cut"] >= len(messages)
+                                  or prefix_digests(messages, state["cut"])[-1] != state["fingerprint"]):
+            # 会话已被重置或修改，保存的状态不再适用
+            return None
+        return state
+
+    def _find_state(self, messages: List[dict], digests: List[str]) -> Optional[dict]:
+        # 没有会话 ID 时，以切分点之前全部消息的哈希查找同一对话
+        for cut in range(len(messages) - 1, 0, -1):
+            state = self._states.get("h:" + digests[cut])
+            if state is not None and state["cut"] == cut:
+                return state
+        return None
+
+    def _save_state(self, key: str, cut: int, fingerprint: str, summary: Optional[str]):
+        self._states[key] = {"cut": cut, "fingerprint": fingerprint, "summary": summary}
+        self._states.move_to_end(key)
+        while len(self._states) > _STATE_SIZE:
+            self._states.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            "checked": self.checked,
+            "compacted": self.compacted,
+            "dropped_messages": self.dropped_messages,
+            "stripped_media": self.stripped_media,
+            "summaries": self.summaries,
+            "summary_reused": self.summary_reused,
+            "summary_failures": self.summary_failures,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "conversations": len(self._states)
+        }
+
+
+context_compactor = ContextCompactor()
@@ -0,0 +1,229 @@
+"""
+服务端会话存储
+
+功能：按会话 ID 保存已解码的 Bedrock messages，客户端每轮只需上传新增消息
+存储层级：
+  - 内存：LRU，按估算字节数限制容量
+  - 本地磁盘（可选）：追加写入的 pickle 日志，内存淘汰后仍可恢复
+协议：
+  - 请求携带 conversationId 与 historyLength（客户端认为服务端已有的消息数）
+  - historyLength 为 0 或未提供且服务端没有该会话：messages 视为完整历史
+  - historyLength 与服务端不一致：抛出 ConversationConflict，客户端应上传完整历史
+  - 流完整结束后，新增消息与 assistant 回复一起写入会话
+配置：
+  - CONVERSATION_STORE_MAX_BYTES：内存层容量（默认 128MB）
+  - CONVERSATION_STORE_TTL：会话空闲过期时间，秒（默认 3600）
+  - CONVERSATION_STORE_DIR：磁盘层目录，未设置时不启用
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from workload_pools import run_in_pool
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = int(os.environ.get("CONVERSATION_STORE_MAX_BYTES", str(128 * 1024 * 1024)))
+TTL = int(os.environ.get("CONVERSATION_STORE_TTL", "3600"))
+DISK_DIR = os.environ.get("CONVERSATION_STORE_DIR", "")
+
+_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+class ConversationConflict(Exception):
+    """客户端与服务端的会话历史不一致"""
+
+
+def estimate_size(value: Any) -> int:
+    """估算消息占用的字节数"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, list):
+        return sum(estimate_size(v) for v in value)
+    return 8
+
+
+class ConversationStore:
+    def __init__(self, max_bytes: int = MAX_BYTES, ttl: int = TTL, disk_dir: str = DISK_DIR):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries: OrderedDict = OrderedDict()  # {id: {messages, size, updated_at}}
+        self._size = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    async def prepare(
+        self,
+        conversation_id: str,
+        delta: List[dict],
+        history_length: Optional[int]
+    ) -> tuple[List[dict], int]:
+        """
+        合并历史与新增消息
+
+        Returns:
+            (完整 messages, 服务端已有的历史长度)；历史长度为 0 表示重建会话
+        """
+        self._validate_id(conversation_id)
+        if history_length == 0:
+            return list(delta), 0
+
+        history = await self.get(conversation_id)
+        if history is None:
+            if history_length:
+                raise ConversationConflict(f"Conversation {conversation_id} not found")
+            return list(delta), 0
+        if history_length is None:
+            # 不带 historyLength 的客户端可能每轮都发送完整历史，直接追加会重复历史
+            raise ConversationConflict(
+                f"Conversation {conversation_id} has {len(history)} messages, historyLength is required"
+            )
+        if history_length != len(history):
+            raise ConversationConflict(
+                f"Conversation {conversation_id} has {len(history)} messages, client expected {history_length}"
+            )
+        return history + delta, len(history)
+
+    async def commit(self, conversation_id: str, base_length: int, new_messages: List[dict]) -> bool:
+        """写入本轮消息；base_length 为 0 时替换整个会话"""
+        async with self._lock_for(conversation_id):
+            if base_length == 0:
+                self._put(conversation_id, list(new_messages))
+                if self.disk_dir:
+                    await run_in_pool("storage", self._write_disk, conversation_id, new_messages, "wb")
+                return True
+
+            history = await self.get(conversation_id)
+            if history is None or len(history) != base_length:
+                # 并发请求已修改该会话，放弃本次写入
+                logger.warning(f"Conversation {conversation_id} changed during generation, skip commit")
+                return False
+            self._put(conversation_id, history + new_messages)
+            if self.disk_dir:
+                await run_in_pool("storage", self._write_disk, conversation_id, new_messages, "ab")
+            return True
+
+    async def get(self, conversation_id: str) -> Optional[List[dict]]:
+        """读取会话历史（返回新列表，消息对象与存储共享，调用方不应修改）"""
+        entry = self._entries.get(conversation_id)
+        now = time.time()
+        if entry is not None:
+            if now - entry["updated_at"] <= self.ttl:
+                self._entries.move_to_end(conversation_id)
+                self.hits += 1
+                return list(entry["messages"])
+            self._remove(conversation_id)
+
+        if self.disk_dir:
+            messages = await run_in_pool("storage", self._read_disk, conversation_id)
+            if messages is not None:
+                self.disk_hits += 1
+                self._put(conversation_id, messages)
+                return list(messages)
+
+        self.misses += 1
+        return None
+
+    async def delete(self, conversation_id: str):
+        """删除会话"""
+        self._validate_id(conversation_id)
+        self._remove(conversation_id)
+        if self.disk_dir:
+            await run_in_pool("storage", self._delete_disk, conversation_id)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "conversations": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "disk_enabled": bool(self.disk_dir)
+        }
+
+    def _put(self, conversation_id: str, messages: List[dict]):
+        self._remove(conversation_id)
+        size = estimate_size(messages)
+        self._entries[conversation_id] = {
+            "messages": messages,
+            "size": size,
+            "updated_at": time.time()
+        }
+        self._size += size
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evicted += 1
+
+    def _remove(self, conversation_id: str):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self._size -= entry["size"]
+
+    def _lock_for(self, conversation_id: str) -> asyncio.Lock:
+        if conversation_id not in self._locks:
+            self._locks[conversation_id] = asyncio.Lock()
+        lock = self._locks[conversation_id]
+        if len(self._locks) > 10000:
+            # 清理未被持有的锁
+            for key in [k for k, v in self._locks.items() if not v.locked() and k != conversation_id]:
+                del self._locks[key]
+        return lock
+
+    def _disk_path(self, conversation_id: str) -> str:
+        name = hashlib.sha256(conversation_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{name}.pkl")
+
+    def _write_disk(self, conversation_id: str, messages: List[dict], mode: str):
+        with open(self._disk_path(conversation_id), mode) as f:
+            pickle.dump(messages, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _read_disk(self, conversation_id: str) -> Optional[List[dict]]:
+        path = self._disk_path(conversation_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            messages = []
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        messages.extend(pickle.load(f))
+                    except EOFError:
+                        break
+            return messages
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to read conversation {conversation_id} from disk: {e}")
+            return None
+
+    def _delete_disk(self, conversation_id: str):
+        try:
+            os.remove(self._disk_path(conversation_id))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _validate_id(conversation_id: str):
+        if not _ID_PATTERN.match(conversation_id):
+            raise ValueError("Invalid conversationId")
+
+
+conversation_store = ConversationStore()
@@ -0,0 +1,184 @@
+"""
+凭证池
+
+功能：把 Bedrock 调用分散到多组凭证（多个账号或角色），吞吐不再受单个账号的模型配额限制
+选择：
+  - 按 进行中请求数 / 权重 选择负载最低的凭证，权重表示该凭证相对的配额大小
+  - 出现 ThrottlingException 的凭证被暂时降级，连续被限流时降级时间加倍（最多 8 倍）；
+    同一请求的多次路由尝试只计一次限流，区域内只有一组凭证时不降级（没有可替换的凭证）
+  - 所有凭证都处于降级状态时，选择最早恢复的凭证
+配置：BEDROCK_CREDENTIAL_POOL，JSON 数组或 JSON 文件路径；未配置时只使用进程默认凭证
+    [
+      {"name": "account-a", "roleArn": "arn:aws:iam::111111111111:role/swift-chat", "externalId": "..."},
+      {"name": "account-b", "profile": "bedrock-b", "weight": 2},
+      {"name": "static", "accessKeyId": "...", "secretAccessKey": "...", "sessionToken": "..."},
+      {"name": "fake", "accessKeyId": "test", "secretAccessKey": "test",
+       "endpointUrl": "http://127.0.0.1:8010", "regions": ["us-east-1"]}
+    ]
+  - roleArn：以默认凭证（或 profile）为源 AssumeRole，临时凭证自动刷新
+  - endpointUrl：自定义 bedrock-runtime 端点，可指向本地模拟服务（见 scripts/fake_bedrock.py）
+  - regions：只在这些区域使用该凭证（可选）
+  - BEDROCK_CREDENTIAL_DEMOTE_SECONDS：降级时间，秒（默认 30）
+"""
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+from bedrock_integration.admission import is_throttling_error
+from bedrock_integration.client_registry import get_client, get_client_async
+
+logger = logging.getLogger(__name__)
+
+POOL_CONFIG = os.environ.get("BEDROCK_CREDENTIAL_POOL", "")
+DEMOTE_SECONDS = float(os.environ.get("BEDROCK_CREDENTIAL_DEMOTE_SECONDS", "30"))
+
+# 配置字段 -> client_registry 使用的 boto3 参数名
+_CREDENTIAL_FIELDS = {
+    "accessKeyId": "aws_access_key_id",
+    "secretAccessKey": "aws_secret_access_key",
+    "sessionToken": "aws_session_token",
+    "profile": "profile_name",
+    "roleArn": "role_arn",
+    "externalId": "external_id",
+}
+_MAX_DEMOTE_FACTOR = 8
+
+
+class CredentialSet:
+    def __init__(self, name: str, credentials: Optional[Dict[str, str]] = None,
+                 endpoint_url: Optional[str] = None, regions: Optional[List[str]] = None,
+                 weight: float = 1.0):
+        self.name = name
+        self.credentials = credentials or None
+        self.endpoint_url = endpoint_url
+        self.regions = regions
+        self.weight = weight
+        self.in_flight = 0
+        self.demoted_until = 0.0
+        self.consecutive_throttles = 0
+        self.calls = 0
+        self.throttled = 0
+
+    @classmethod
+    def from_config(cls, index: int, entry: dict) -> "CredentialSet":
+        credentials = {key: entry[field] for field, key in _CREDENTIAL_FIELDS.items() if entry.get(field)}
+        return cls(
+            name=entry.get("name") or f"credential-{index}",
+            credentials=credentials,
+            endpoint_url=entry.get("endpointUrl"),
+            regions=entry.get("regions"),
+            weight=float(entry.get("weight", 1))
+        )
+
+    def serves(self, region: str) -> bool:
+        return not self.regions or region in self.regions
+
+    def client(self, service: str, region: str):
+        return get_client(service, region, self.credentials, self.endpoint_url)
+
+    async def client_async(self, service: str, region: str):
+        return await get_client_async(service, region, self.credentials, self.endpoint_url)
+
+    def get_stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "demoted_for": round(max(0.0, self.demoted_until - time.monotonic()), 1),
+            "weight": self.weight
+        }
+
+
+class CredentialLease:
+    """一次调用占用的凭证，结束时释放；被限流时降级该凭证（可重复释放）"""
+
+    def __init__(self, pool: "CredentialPool", credential_set: CredentialSet, region: str):
+        self.pool = pool
+        self.credential_set = credential_set
+        self.region = region
+        self.released = False
+
+    def client(self, service: str = "bedrock-runtime"):
+        return self.credential_set.client(service, self.region)
+
+    async def client_async(self, service: str = "bedrock-runtime"):
+        """在事件循环中使用，需要新建客户端时不阻塞"""
+        return await self.credential_set.client_async(service, self.region)
+
+    def release(self, error: Optional[Exception] = None, count_throttle: bool = True):
+        """count_throttle=False：本请求已为该凭证计过一次限流"""
+        if not self.released:
+            self.released = True
+            throttled = error is not None and is_throttling_error(error)
+            self.pool.release(self.credential_set, self.region, throttled, count_throttle)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release(exc if isinstance(exc, Exception) else None)
+
+
+class CredentialPool:
+    def __init__(self, credential_sets: Optional[List[CredentialSet]] = None,
+                 demote_seconds: float = DEMOTE_SECONDS):
+        self.credential_sets = credential_sets or [CredentialSet("default")]
+        self.demote_seconds = demote_seconds
+
+    @classmethod
+    def from_config(cls, config: str = POOL_CONFIG) -> "CredentialPool":
+        if not config:
+            return cls()
+        try:
+            if config.lstrip().startswith("["):
+                entries = json.loads(config)
+            else:
+                with open(config, encoding="utf-8") as f:
+                    entries = json.load(f)
+            credential_sets = [CredentialSet.from_config(i, entry) for i, entry in enumerate(entries)]
+            logger.info(f"Loaded {len(credential_sets)} credential sets")
+            return cls(credential_sets)
+        except Exception as e:
+            logger.error(f"Invalid BEDROCK_CREDENTIAL_POOL, using default credentials: {e}")
+            return cls()
+
+    def candidates(self, region: str) -> List[CredentialSet]:
+        return [c for c in self.credential_sets if c.serves(region)] or self.credential_sets
+
+    def lease(self, region: str) -> CredentialLease:
+        """选择负载最低的可用凭证"""
+        candidates = self.candidates(region)
+        now = time.monotonic()
+        available = [c for c in candidates if c.demoted_until <= now]
+        if available:
+            chosen = min(available, key=lambda c: c.in_flight / c.weight)
+        else:
+            chosen = min(candidates, key=lambda c: c.demoted_until)
+        chosen.in_flight += 1
+        chosen.calls += 1
+        return CredentialLease(self, chosen, region)
+
+    def release(self, credential_set: CredentialSet, region: str, throttled: bool, count_throttle: bool = True):
+        credential_set.in_flight -= 1
+        if throttled:
+            if not count_throttle:
+                return
+            credential_set.throttled += 1
+            if len(self.candidates(region)) < 2:
+                # 没有其他凭证可选，降级不会改变选择
+                return
+            credential_set.consecutive_throttles += 1
+            factor = min(_MAX_DEMOTE_FACTOR, 2 ** (credential_set.consecutive_throttles - 1))
+            credential_set.demoted_until = time.monotonic() + self.demote_seconds * factor
+            logger.info(f"Credential set {credential_set.name} throttled, "
+                        f"demoted for {self.demote_seconds * factor:.0f}s")
+        else:
+            credential_set.consecutive_throttles = 0
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {c.name: c.get_stats() for c in self.credential_sets}
+
+
+credential_pool = CredentialPool.from_config()
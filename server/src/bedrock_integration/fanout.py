@@ -0,0 +1,80 @@
+"""
+多模型对比（fan-out）
+
+功能：同一个请求同时发给多个模型，各模型的事件流合并为一个带标签的流，
+      请求只上传、解码一次
+原理：
+  - 每个模型的事件流由独立的任务读取并写入共享队列，先到先出，慢的模型不会阻塞其他模型
+  - 每个事件加上 "model" 字段标明来源模型
+  - 某个模型出错时输出 {"model": ..., "error": ...}，其他模型继续
+  - 消费者断开时取消所有读取任务，上游流随之关闭
+配置：
+  - FANOUT_MAX_MODELS：单个请求最多的模型数（默认 4）
+  - FANOUT_BUFFER：每个模型在队列中缓冲的事件数（默认 64）
+"""
+import asyncio
+import logging
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+MAX_MODELS = int(os.environ.get("FANOUT_MAX_MODELS", "4"))
+BUFFER = int(os.environ.get("FANOUT_BUFFER", "64"))
+
+_DONE = object()
+
+
+class FanoutStats:
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.active = 0
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "requests": self.requests,
+            "streams": self.streams,
+            "errors": self.errors,
+            "active": self.active
+        }
+
+
+fanout_stats = FanoutStats()
+
+
+async def multiplex(sources: Dict[str, Callable[[], AsyncIterator[dict]]]) -> AsyncIterator[dict]:
+    """并发读取多个事件流，按到达顺序产出带 "model" 标签的事件"""
+    fanout_stats.requests += 1
+    fanout_stats.streams += len(sources)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BUFFER * len(sources))
+
+    async def pump(tag: str, make_events: Callable[[], AsyncIterator[dict]]):
+        try:
+            async with aclosing(make_events()) as events:
+                async for event in events:
+                    await queue.put({"model": tag, **event})
+        except Exception as error:
+            logger.warning(f"Fan-out stream {tag} failed: {error}")
+            fanout_stats.errors += 1
+            await queue.put({"model": tag, "error": str(error)})
+        await queue.put(_DONE)
+
+    fanout_stats.active += 1
+    tasks = [asyncio.ensure_future(pump(tag, make_events)) for tag, make_events in sources.items()]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        fanout_stats.active -= 1
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
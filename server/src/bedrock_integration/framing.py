@@ -0,0 +1,59 @@
+"""
+二进制流帧编码（MessagePack）
+
+功能：为 converse 流提供长度前缀的 MessagePack 帧，作为 JSON 文本流的替代
+协商：客户端在 Accept 头中包含 application/x-msgpack 时启用；
+      服务端未安装 msgpack 时回退为 JSON
+帧格式：4 字节大端无符号长度 + MessagePack 负载
+  - raw 模式：每帧是一个原始 Bedrock 事件
+  - lean 模式：每帧是一个 lean 增量帧（见 projection.py）
+  - 错误：{"error": "..."}
+"""
+import struct
+from contextlib import aclosing
+from typing import AsyncIterator, List
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack 为可选依赖
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+_LENGTH = struct.Struct(">I")
+
+
+def accepts_msgpack(accept: str | None) -> bool:
+    """根据 Accept 头判断是否使用 MessagePack"""
+    return msgpack is not None and bool(accept) and MSGPACK_MEDIA_TYPE in accept
+
+
+def pack_frame(value) -> bytes:
+    payload = msgpack.packb(value, use_bin_type=True)
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def pack_frames(frames: List[dict]) -> bytes:
+    return b"".join(pack_frame(frame) for frame in frames)
+
+
+def unpack_frames(data: bytes) -> List[dict]:
+    """解析完整的帧序列（用于测试与基准）"""
+    frames = []
+    offset = 0
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        frames.append(msgpack.unpackb(data[offset:offset + length], raw=False))
+        offset += length
+    return frames
+
+
+async def msgpack_stream(events: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """原始 Bedrock 事件 -> MessagePack 帧"""
+    try:
+        async with aclosing(events):
+            async for item in events:
+                yield pack_frame(item)
+    except Exception as err:
+        yield pack_frame({"error": str(err)})
@@ -0,0 +1,236 @@
+"""
+图片生成任务队列
+
+功能：图片生成以任务方式执行，提交后立即返回任务 id，结果通过轮询或完成流获取，
+      生成期间不占用 HTTP 请求，也不阻塞事件循环
+状态：queued -> running -> succeeded / failed / cancelled
+策略：
+  - 最多 IMAGE_JOB_CONCURRENCY 个任务同时运行，其余按提交顺序排队
+  - 排队与运行中的任务总数超过 IMAGE_JOB_MAX_PENDING 时拒绝提交
+  - 取消排队中的任务立即生效；运行中的任务停止等待并释放并发名额，
+    已发出的 invoke_model 调用在线程池中结束后结果被丢弃
+  - 结束的任务保留 IMAGE_JOB_TTL 秒供查询，之后被清理；保留的任务数或结果字节数超出上限时，
+    先清理最早结束的任务
+  - 客户端取得结束任务的结果后即释放结果，之后的查询只返回状态
+  - 同步的 /api/image 与批量生成在返回结果后立即移除任务，不保留
+  - 批量生成（/api/image/batch）的每张图片也作为任务执行，与单张生成共用并发名额
+配置：
+  - IMAGE_JOB_CONCURRENCY：同时运行的任务数（默认 4）
+  - IMAGE_JOB_MAX_PENDING：排队与运行中的任务上限（默认 64）
+  - IMAGE_JOB_TTL：结束的任务保留时间，秒（默认 600）
+  - IMAGE_JOB_MAX_KEPT：保留的已结束任务数上限（默认 256）
+  - IMAGE_JOB_MAX_RESULT_BYTES：保留的结果总字节数上限（默认 64MB）
+  - IMAGE_BATCH_MAX_IMAGES：单次批量生成最多的图片数（默认 16）
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = int(os.environ.get("IMAGE_JOB_CONCURRENCY", "4"))
+MAX_PENDING = int(os.environ.get("IMAGE_JOB_MAX_PENDING", "64"))
+TTL = float(os.environ.get("IMAGE_JOB_TTL", "600"))
+MAX_KEPT = int(os.environ.get("IMAGE_JOB_MAX_KEPT", "256"))
+MAX_RESULT_BYTES = int(os.environ.get("IMAGE_JOB_MAX_RESULT_BYTES", str(64 * 1024 * 1024)))
+MAX_BATCH_IMAGES = int(os.environ.get("IMAGE_BATCH_MAX_IMAGES", "16"))
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    """排队与运行中的任务已达上限"""
+
+
+class ImageJob:
+    def __init__(self, run: Callable[[], Awaitable[dict]]):
+        self.id = uuid.uuid4().hex
+        self.run = run
+        self.status = "queued"
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.result_bytes = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def set_status(self, status: str):
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        elif status in FINISHED:
+            self.finished_at = time.time()
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, timeout: Optional[float] = None) -> bool:
+        """等待状态变化，超时返回 False"""
+        if self.finished:
+            return False
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait(self, timeout: Optional[float] = None):
+        """等待任务结束（最多 timeout 秒）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.finished:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            await self.wait_change(remaining)
+
+    def to_dict(self) -> Dict:
+        job = {"jobId": self.id, "status": self.status, "createdAt": self.created_at}
+        if self.started_at:
+            job["startedAt"] = self.started_at
+        if self.finished_at:
+            job["finishedAt"] = self.finished_at
+        if self.result is not None:
+            job["result"] = self.result
+        if self.error is not None:
+            job["error"] = self.error
+        return job
+
+
+class ImageJobQueue:
+    def __init__(self, concurrency: int = CONCURRENCY, max_pending: int = MAX_PENDING, ttl: float = TTL,
+                 max_kept: int = MAX_KEPT, max_result_bytes: int = MAX_RESULT_BYTES):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.max_kept = max_kept
+        self.max_result_bytes = max_result_bytes
+        self.result_bytes = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._concurrency = concurrency
+        self._jobs: OrderedDict = OrderedDict()  # {job id: ImageJob}，按提交顺序
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def submit(self, run: Callable[[], Awaitable[dict]]) -> ImageJob:
+        """提交任务，run 返回 {"image": ...} 或 {"error": ...}"""
+        self._purge()
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise JobQueueFull(f"Too many image jobs in progress ({self.max_pending})")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        job = ImageJob(run)
+        self._jobs[job.id] = job
+        self.submitted += 1
+        job.task = asyncio.ensure_future(self._execute(job))
+        job.task.add_done_callback(lambda _: self._on_done(job))
+        return job
+
+    def _on_done(self, job: ImageJob):
+        # 任务被取消（包括尚未开始运行就被取消）
+        if not job.finished:
+            self.cancelled += 1
+            job.set_status("cancelled")
+        self._purge()
+
+    async def _execute(self, job: ImageJob):
+        try:
+            async with self._semaphore:
+                job.set_status("running")
+                result = await job.run()
+            if "error" in result:
+                job.error = result["error"]
+                self.failed += 1
+                job.set_status("failed")
+            else:
+                job.result = result
+                job.result_bytes = sum(len(value) for value in result.values() if isinstance(value, str))
+                if job.id in self._jobs:
+                    self.result_bytes += job.result_bytes
+                self.succeeded += 1
+                job.set_status("succeeded")
+        except Exception as error:
+            logger.warning(f"Image job {job.id} failed: {error}")
+            job.error = str(error)
+            self.failed += 1
+            job.set_status("failed")
+
+    def get(self, job_id: str) -> Optional[ImageJob]:
+        self._purge()
+        return self._jobs.get(job_id)
+
+    def collect(self, job: ImageJob) -> Dict:
+        """返回任务状态；任务已结束时结果只返回这一次，随后释放"""
+        data = job.to_dict()
+        if job.finished and job.result is not None:
+            self._release(job)
+        return data
+
+    def cancel(self, job_id: str) -> Optional[ImageJob]:
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.task.cancel()
+        return job
+
+    def discard(self, job: ImageJob):
+        """移除结果已直接返回给调用方的任务，未结束时先取消"""
+        if not job.finished:
+            job.task.cancel()
+        if job.id in self._jobs:
+            self._release(job)
+            del self._jobs[job.id]
+
+    def _release(self, job: ImageJob):
+        if job.id in self._jobs:
+            self.result_bytes -= job.result_bytes
+        job.result = None
+        job.result_bytes = 0
+
+    def _purge(self):
+        expired_before = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < expired_before]
+        for job_id in expired:
+            self._release(self._jobs[job_id])
+            del self._jobs[job_id]
+        # 超出数量或字节上限时，从最早提交的已结束任务开始清理
+        finished = [job for job in self._jobs.values() if job.finished]
+        while finished and (len(finished) > self.max_kept or self.result_bytes > self.max_result_bytes):
+            job = finished.pop(0)
+            self._release(job)
+            del self._jobs[job.id]
+            self.evicted += 1
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "queued": sum(1 for job in self._jobs.values() if job.status == "queued"),
+            "running": sum(1 for job in self._jobs.values() if job.status == "running"),
+            "kept": len(self._jobs),
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "result_bytes": self.result_bytes
+        }
+
+
+image_jobs = ImageJobQueue()
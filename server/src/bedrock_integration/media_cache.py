@@ -0,0 +1,115 @@
+"""
+媒体内容缓存
+
+功能：按内容哈希缓存已解码的图片、视频、文档，避免每轮对话重复 base64 解码
+职责：
+  - 以解码后字节的 SHA-256 为键，LRU 淘汰，按字节数限制容量
+  - 记录 base64 文本到 SHA-256 的别名，重复上传的同一内容直接命中
+  - 客户端可用 {"source": {"sha256": "..."}} 引用已上传的内容，无需重复发送
+共享：converse、图片生成、虚拟试穿路径使用同一个缓存实例
+配置：MEDIA_CACHE_MAX_BYTES（默认 64MB）
+"""
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class MediaNotCached(ValueError):
+    """引用的媒体哈希不在缓存中，客户端需要重新上传"""
+
+    def __init__(self, digests: List[str]):
+        super().__init__(f"Media not cached: {', '.join(digests)}")
+        self.digests = digests
+
+
+class MediaCache:
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()   # {sha256: bytes}
+        self._aliases: Dict[str, str] = {}           # {base64 摘要: sha256}
+        self._alias_keys: Dict[str, List[str]] = {}  # {sha256: [base64 摘要]}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def decode(self, data: str) -> bytes:
+        """解码 base64 内容，命中缓存时直接返回已解码的字节"""
+        alias = hashlib.blake2b(data.encode("ascii"), digest_size=16).hexdigest()
+        with self._lock:
+            digest = self._aliases.get(alias)
+            if digest is not None and digest in self._entries:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return self._entries[digest]
+            self.misses += 1
+
+        decoded = base64.b64decode(data)
+        digest = self.put(decoded)
+        with self._lock:
+            if digest in self._entries:
+                self._aliases[alias] = digest
+                self._alias_keys.setdefault(digest, []).append(alias)
+                return self._entries[digest]
+        return decoded
+
+    def put(self, data: bytes) -> str:
+        """缓存原始字节，返回 SHA-256"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return digest
+            if len(data) > self.max_bytes:
+                return digest
+            self._entries[digest] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                oldest, oldest_data = self._entries.popitem(last=False)
+                self._size -= len(oldest_data)
+                for alias in self._alias_keys.pop(oldest, []):
+                    self._aliases.pop(alias, None)
+                self.evicted += 1
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """按 SHA-256 获取字节"""
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+            return data
+
+    def resolve(self, digest: str) -> bytes:
+        """按 SHA-256 获取字节，不存在时抛出 MediaNotCached"""
+        data = self.get(digest)
+        if data is None:
+            raise MediaNotCached([digest])
+        return data
+
+    def missing(self, digests: List[str]) -> List[str]:
+        """返回不在缓存中的哈希"""
+        with self._lock:
+            return [d for d in digests if d not in self._entries]
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted
+            }
+
+
+media_cache = MediaCache()
@@ -0,0 +1,87 @@
+"""
+Converse 流式消息组装器
+
+功能：根据 converse_stream 事件还原完整的 assistant 消息
+用途：服务端需要保存或继续对话时（会话存储、工具循环等）使用
+支持：text、reasoningContent、toolUse 内容块以及 usage/metrics 元数据
+"""
+import json
+from typing import Dict, Optional
+
+
+class MessageAssembler:
+    def __init__(self):
+        self.role = "assistant"
+        self.blocks: Dict[int, dict] = {}
+        self.stop_reason: Optional[str] = None
+        self.usage: Optional[dict] = None
+        self.metrics: Optional[dict] = None
+        self._tool_inputs: Dict[int, str] = {}
+
+    def feed(self, event: dict):
+        """处理一个 converse_stream 事件"""
+        if "messageStart" in event:
+            self.role = event["messageStart"].get("role", "assistant")
+        elif "contentBlockStart" in event:
+            index = event["contentBlockStart"]["contentBlockIndex"]
+            start = event["contentBlockStart"].get("start", {})
+            if "toolUse" in start:
+                self.blocks[index] = {
+                    "toolUse": {
+                        "toolUseId": start["toolUse"]["toolUseId"],
+                        "name": start["toolUse"]["name"],
+                        "input": {}
+                    }
+                }
+                self._tool_inputs[index] = ""
+        elif "contentBlockDelta" in event:
+            index = event["contentBlockDelta"]["contentBlockIndex"]
+            delta = event["contentBlockDelta"]["delta"]
+            if "text" in delta:
+                block = self.blocks.setdefault(index, {"text": ""})
+                block["text"] += delta["text"]
+            elif "reasoningContent" in delta:
+                self._feed_reasoning(index, delta["reasoningContent"])
+            elif "toolUse" in delta:
+                self._tool_inputs[index] = self._tool_inputs.get(index, "") + delta["toolUse"].get("input", "")
+        elif "contentBlockStop" in event:
+            index = event["contentBlockStop"]["contentBlockIndex"]
+            if index in self._tool_inputs and index in self.blocks:
+                raw_input = self._tool_inputs.pop(index)
+                try:
+                    self.blocks[index]["toolUse"]["input"] = json.loads(raw_input) if raw_input else {}
+                except json.JSONDecodeError:
+                    self.blocks[index]["toolUse"]["input"] = {"raw": raw_input}
+        elif "messageStop" in event:
+            self.stop_reason = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            self.usage = event["metadata"].get("usage")
+            self.metrics = event["metadata"].get("metrics")
+
+    def _feed_reasoning(self, index: int, reasoning: dict):
+        if "redactedContent" in reasoning:
+            self.blocks[index] = {"reasoningContent": {"redactedContent": reasoning["redactedContent"]}}
+            return
+        block = self.blocks.setdefault(index, {"reasoningContent": {"reasoningText": {"text": ""}}})
+        reasoning_text = block["reasoningContent"].setdefault("reasoningText", {"text": ""})
+        if "text" in reasoning:
+            reasoning_text["text"] += reasoning["text"]
+        if "signature" in reasoning:
+            reasoning_text["signature"] = reasoning["signature"]
+
+    @property
+    def complete(self) -> bool:
+        """是否已收到 messageStop"""
+        return self.stop_reason is not None
+
+    @property
+    def text(self) -> str:
+        return "".join(block.get("text", "") for _, block in sorted(self.blocks.items()))
+
+    def message(self) -> dict:
+        """组装后的 Bedrock 消息"""
+        content = [
+            block for _, block in sorted(self.blocks.items())
+            if not ("text" in block and block["text"] == "")
+        ]
+        return {"role": self.role, "content": content}
@@ -0,0 +1,49 @@
+"""
+Converse multipart 请求解析
+
+功能：支持以 multipart/form-data 上传图片、视频、文档的原始二进制，避免 base64
+格式：
+  - request 字段：ConverseRequest 的 JSON
+  - 其余文件字段：媒体原始字节，字段名由 JSON 中的 source.part 引用
+示例：
+    {"image": {"format": "png", "source": {"part": "img0"}}}
+  解析后变为 Bedrock 需要的 {"image": {"format": "png", "source": {"bytes": b"..."}}}
+"""
+from typing import Dict, List
+from starlette.datastructures import UploadFile
+
+MEDIA_TYPES = ("image", "video", "document")
+REQUEST_FIELD = "request"
+
+
+async def read_converse_form(raw_request) -> tuple[str, Dict[str, bytes]]:
+    """读取 multipart 表单，返回 (request JSON, {part 名称: 字节})"""
+    parts: Dict[str, bytes] = {}
+    request_json = None
+    async with raw_request.form() as form:
+        for name, value in form.multi_items():
+            if name == REQUEST_FIELD:
+                if isinstance(value, UploadFile):
+                    request_json = (await value.read()).decode("utf-8")
+                else:
+                    request_json = value
+            elif isinstance(value, UploadFile):
+                parts[name] = await value.read()
+    if request_json is None:
+        raise ValueError(f"Missing '{REQUEST_FIELD}' field")
+    return request_json, parts
+
+
+def attach_media_parts(messages: List[dict], parts: Dict[str, bytes]):
+    """把 source.part 引用替换为对应的二进制内容（原地修改）"""
+    for message in messages:
+        for content in message.get("content", []):
+            for media_type in MEDIA_TYPES:
+                if media_type not in content:
+                    continue
+                source = content[media_type].get("source", {})
+                if "part" in source:
+                    part_name = source.pop("part")
+                    if part_name not in parts:
+                        raise ValueError(f"Missing multipart part: {part_name}")
+                    source["bytes"] = parts[part_name]
@@ -0,0 +1,201 @@
+"""
+Lean 流式输出
+
+功能：把冗长的 Bedrock 事件投影为紧凑的增量帧，并在短时间窗口内合并写出
+帧格式（每行一个 JSON，以 \\n 分隔）：
+  - {"t": "..."}                       文本增量
+  - {"r": "..."}                       推理（reasoning）增量
+  - {"tu": {"id": "...", "name": "..."}} 工具调用开始
+  - {"ti": "..."}                      工具调用参数增量（JSON 片段）
+  - {"tp": {...}}                      服务端工具执行进度（agent 模式，见 agent_loop.py）
+  - {"end": {"stop": "...", "usage": {...}, "metrics": {...}}}  结束帧
+  - {"error": "..."}                   错误
+对比模式（多模型 fan-out）下每帧带 "m" 字段标明模型，如 {"m": "model-id", "t": "..."}
+合并：窗口内相邻的同类增量合并为一帧，所有帧一次写出，减少字节数与系统调用；
+  只合并同一模型、同一内容块的增量（agent 模式下各步的内容块序号连续，不同步骤不会合并）
+配置：LEAN_STREAM_WINDOW_MS（默认 20）
+"""
+import asyncio
+import json
+import os
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    orjson = None
+
+WINDOW_MS = int(os.environ.get("LEAN_STREAM_WINDOW_MS", "20"))
+
+# 可以与相邻同类帧合并的增量类型
+_MERGEABLE = ("t", "r", "ti")
+# 增量帧上的内容块序号，只在合并时使用，不写出
+_BLOCK = "_b"
+
+
+def dumps(value) -> bytes:
+    """紧凑 JSON 编码，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class LeanProjection:
+    """把 Bedrock 事件转换为 lean 帧"""
+
+    def __init__(self):
+        self.stop_reason = None
+        self.finished = False
+
+    def project(self, event: dict) -> List[dict]:
+        if "contentBlockDelta" in event:
+            delta = event["contentBlockDelta"]["delta"]
+            block = event["contentBlockDelta"].get("contentBlockIndex")
+            if "text" in delta:
+                return [{"t": delta["text"], _BLOCK: block}]
+            if "reasoningContent" in delta and "text" in delta["reasoningContent"]:
+                return [{"r": delta["reasoningContent"]["text"], _BLOCK: block}]
+            if "toolUse" in delta:
+                return [{"ti": delta["toolUse"].get("input", ""), _BLOCK: block}]
+        elif "contentBlockStart" in event:
+            tool_use = event["contentBlockStart"].get("start", {}).get("toolUse")
+            if tool_use:
+                return [{"tu": {"id": tool_use["toolUseId"], "name": tool_use["name"]}}]
+        elif "toolProgress" in event:
+            return [{"tp": event["toolProgress"]}]
+        elif "messageStop" in event:
+            self.stop_reason = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            self.finished = True
+            metadata = event["metadata"]
+            return [{"end": {
+                "stop": self.stop_reason,
+                "usage": metadata.get("usage"),
+                "metrics": metadata.get("metrics")
+            }}]
+        return []
+
+    def finish(self) -> List[dict]:
+        """上游没有 metadata 事件时补发结束帧"""
+        if self.finished or self.stop_reason is None:
+            return []
+        self.finished = True
+        return [{"end": {"stop": self.stop_reason}}]
+
+
+class TaggedProjection:
+    """按 "model" 标签分别投影多个模型的事件，帧带 "m" 标签"""
+
+    def __init__(self):
+        self.projections: Dict[str, LeanProjection] = {}
+
+    def project(self, event: dict) -> List[dict]:
+        tag = event["model"]
+        if "error" in event:
+            return [{"m": tag, "error": event["error"]}]
+        projection = self.projections.setdefault(tag, LeanProjection())
+        return [{"m": tag, **frame} for frame in projection.project(event)]
+
+    def finish(self) -> List[dict]:
+        return [{"m": tag, **frame} for tag, projection in self.projections.items() for frame in projection.finish()]
+
+
+def merge_frame(buffer: List[Tuple[Any, dict]], frame: dict):
+    """追加帧，与前一个同类增量帧（同一模型、同一内容块）合并；buffer 中为 (合并键, 帧)"""
+    merge_key = (frame.get("m"), frame.pop(_BLOCK, None))
+    if buffer and buffer[-1][0] == merge_key:
+        last = buffer[-1][1]
+        for key in _MERGEABLE:
+            if key in frame and key in last:
+                last[key] += frame[key]
+                return
+    buffer.append((merge_key, frame))
+
+
+def encode_frames(frames: List[dict]) -> bytes:
+    return b"".join(dumps(frame) + b"\n" for frame in frames)
+
+
+async def coalesce(
+    events: AsyncIterator[dict],
+    project: Callable[[dict], List[dict]],
+    encode: Callable[[List[dict]], bytes],
+    window: float
+) -> AsyncIterator[bytes]:
+    """
+    按时间窗口合并帧
+
+    第一帧进入缓冲区后最多等待 window 秒，期间到达的帧一起编码写出；
+    上游暂停时不会继续持有已缓冲的帧
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer: List[Tuple[Any, dict]] = []
+    deadline = 0.0
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield encode([frame for _, frame in buffer])
+                buffer = []
+                continue
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # 先写出已缓冲的帧，再把上游异常交给调用方
+                if buffer:
+                    yield encode([frame for _, frame in buffer])
+                    buffer = []
+                raise
+            for frame in project(event):
+                if not buffer:
+                    deadline = loop.time() + window
+                merge_frame(buffer, frame)
+        if buffer:
+            yield encode([frame for _, frame in buffer])
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait({pending})
+        # 确定性地关闭上游，使 Bedrock 连接及时释放
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def lean_frames(
+    events: AsyncIterator[dict],
+    window_ms: int = WINDOW_MS,
+    projection=None
+) -> AsyncIterator[List[dict]]:
+    """Bedrock 事件 -> 按时间窗口合并后的 lean 帧列表（WebSocket 等按消息发送的传输使用）"""
+    projection = projection or LeanProjection()
+    async with aclosing(coalesce(events, projection.project, list, window_ms / 1000)) as batches:
+        async for frames in batches:
+            yield frames
+    tail = projection.finish()
+    if tail:
+        yield tail
+
+
+async def lean_stream(
+    events: AsyncIterator[dict],
+    window_ms: int = WINDOW_MS,
+    encode: Callable[[List[dict]], bytes] = encode_frames,
+    projection=None
+) -> AsyncIterator[bytes]:
+    """Bedrock 事件 -> lean 帧字节流（encode 默认为 JSON 行，也可传入 MessagePack 编码）"""
+    try:
+        async with aclosing(lean_frames(events, window_ms, projection)) as batches:
+            async for frames in batches:
+                yield encode(frames)
+    except Exception as err:
+        yield encode([{"error": str(err)}])
@@ -0,0 +1,106 @@
+"""
+Prompt 缓存检查点
+
+功能：为支持 Bedrock prompt caching 的模型自动插入 cachePoint，长系统提示与多轮历史只在首次写入缓存，
+      后续轮次直接读取，降低首 token 延迟与输入成本
+策略：
+  - 系统提示足够长时，在其末尾插入检查点
+  - 历史足够长时，在最后一条用户消息末尾插入检查点（本轮写入，下一轮读取），
+    并保留上一条用户消息处的检查点（即上一轮写入的位置，本轮读取）
+  - 检查点前的内容少于模型的最小缓存长度时不插入
+  - 请求中已包含 cachePoint 时保持不变，以客户端为准
+  - 不修改传入的消息（可能是服务端保存的历史），只复制被改动的消息
+用量：缓存读写 token 数来自流的 metadata.usage（cacheReadInputTokens / cacheWriteInputTokens）
+配置：PROMPT_CACHE_ENABLED（默认 false，缓存写入按溢价计费，一次性的提示用不上），请求中的 promptCache 可覆盖
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+from bedrock_integration.token_estimator import estimate_block_tokens, estimate_message_tokens
+
+ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "false").lower() == "true"
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+# (模型 ID 片段, 每个检查点前的最小 token 数, 最多检查点数)
+_MODEL_RULES = [
+    ("claude-3-5-haiku", 2048, 4),
+    ("claude-haiku-4", 2048, 4),
+    ("claude-3-7-sonnet", 1024, 4),
+    ("claude-sonnet-4", 1024, 4),
+    ("claude-opus-4", 1024, 4),
+    ("amazon.nova", 1000, 4),
+]
+
+
+def cache_rule(model_id: str) -> Optional[Tuple[int, int]]:
+    """返回模型的 (最小 token 数, 最多检查点数)，不支持 prompt caching 时返回 None"""
+    for pattern, min_tokens, max_points in _MODEL_RULES:
+        if pattern in model_id:
+            return min_tokens, max_points
+    return None
+
+
+def has_cache_point(blocks: Optional[List[dict]]) -> bool:
+    return any("cachePoint" in block for block in blocks or [])
+
+
+class PromptCachePolicy:
+    def __init__(self, enabled: bool = ENABLED):
+        self.enabled = enabled
+        self.applied = 0
+        self.checkpoints = 0
+        self.skipped_unsupported = 0
+
+    def apply(self, command: dict, enabled: Optional[bool] = None):
+        """为 converse 命令插入缓存检查点（直接修改 command 的 system / messages 字段）"""
+        if not (self.enabled if enabled is None else enabled):
+            return
+        rule = cache_rule(command["modelId"])
+        if rule is None:
+            self.skipped_unsupported += 1
+            return
+        min_tokens, max_points = rule
+        system = command.get("system")
+        messages = command["messages"]
+        if has_cache_point(system) or any(has_cache_point(m.get("content")) for m in messages):
+            return
+
+        points = 0
+        prefix_tokens = 0
+        if system:
+            prefix_tokens = sum(estimate_block_tokens(block) for block in system)
+            if prefix_tokens >= min_tokens:
+                command["system"] = system + [CACHE_POINT]
+                points += 1
+
+        # 用户消息末尾是稳定的边界：之后的助手回复在下一轮也会原样发回
+        boundaries = []
+        for index, message in enumerate(messages):
+            prefix_tokens += estimate_message_tokens(message)
+            if message.get("role") == "user" and prefix_tokens >= min_tokens:
+                boundaries.append(index)
+        selected = boundaries[-min(2, max_points - points):] if points < max_points else []
+
+        if selected:
+            messages = list(messages)
+            for index in selected:
+                message = messages[index]
+                messages[index] = {**message, "content": list(message.get("content", [])) + [CACHE_POINT]}
+            command["messages"] = messages
+            points += len(selected)
+
+        if points:
+            self.applied += 1
+            self.checkpoints += points
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "enabled": self.enabled,
+            "applied": self.applied,
+            "checkpoints": self.checkpoints,
+            "skipped_unsupported": self.skipped_unsupported
+        }
+
+
+prompt_cache_policy = PromptCachePolicy()
@@ -0,0 +1,245 @@
+"""
+可恢复的流式输出
+
+功能：流的生成与 HTTP 连接解耦，网络中断后客户端可从已接收的位置继续读取
+原理：
+  - 每个可恢复流有一个 ID 和一个按字节数限制的环形缓冲区，记录已输出的数据块
+  - 后台任务持续读取上游并写入缓冲区，与客户端连接无关
+  - 客户端按字节偏移量（已收到的字节数）重新订阅，先回放缓冲区内容再继续实时输出
+  - 偏移量以编码后的字节计算，适用于所有输出格式（JSON、lean、MessagePack）
+  - 订阅者太慢、未读数据已被淘汰时，输出一个错误帧（encode_error，含已收到的字节数）后结束，
+    不会静默截断；按该偏移量恢复时若数据已不在缓冲区，恢复接口返回 410
+生命周期：
+  - 无订阅者超过 STREAM_ORPHAN_TIMEOUT 秒且仍在生成：取消上游生成
+  - 生成结束后保留 STREAM_REPLAY_TTL 秒供恢复
+  - 流数或缓冲总字节数超出上限时，先淘汰最早结束的流，再淘汰最早失去订阅者、仍在生成的流；
+    仍有客户端连接的流不被淘汰，流数已满时新请求不再可恢复（不返回 X-Stream-Id）
+配置：
+  - STREAM_REPLAY_BUFFER_BYTES：每个流的缓冲区大小（默认 1MB）
+  - STREAM_REPLAY_MAX_STREAMS：保留的可恢复流数上限（默认 1000）
+  - STREAM_REPLAY_MAX_BYTES：所有流缓冲区的总字节数上限（默认 64MB）
+  - STREAM_ORPHAN_TIMEOUT：默认 30 秒
+  - STREAM_REPLAY_TTL：默认 120 秒
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+BUFFER_BYTES = int(os.environ.get("STREAM_REPLAY_BUFFER_BYTES", str(1024 * 1024)))
+ORPHAN_TIMEOUT = float(os.environ.get("STREAM_ORPHAN_TIMEOUT", "30"))
+REPLAY_TTL = float(os.environ.get("STREAM_REPLAY_TTL", "120"))
+MAX_STREAMS = int(os.environ.get("STREAM_REPLAY_MAX_STREAMS", "1000"))
+MAX_BYTES = int(os.environ.get("STREAM_REPLAY_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class StreamGone(Exception):
+    """请求的偏移量已不在缓冲区中"""
+
+
+class ReplayableStream:
+    def __init__(self, stream_id: str, body: AsyncIterator, media_type: str,
+                 buffer_bytes: int = BUFFER_BYTES,
+                 encode_error: Optional[Callable[[str, int], bytes]] = None):
+        self.stream_id = stream_id
+        self.media_type = media_type
+        self.encode_error = encode_error  # (错误信息, 字节偏移量) -> 该输出格式的错误帧
+        self.buffer_bytes = buffer_bytes
+        self.chunks: deque = deque()  # [(起始偏移量, bytes)]
+        self.first_seq = 0            # 缓冲区中第一个数据块的序号
+        self.start_offset = 0         # 缓冲区中最早的字节偏移量
+        self.end_offset = 0           # 已生成的总字节数
+        self.done = False
+        self.subscribers = 0
+        self.lagged = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(body))
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+        self.on_expire = None
+        self.on_resize = None
+
+    async def _run(self, body: AsyncIterator):
+        """后台读取上游，写入环形缓冲区"""
+        try:
+            async with aclosing(body):
+                async for chunk in body:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode("utf-8")
+                    self._append(chunk)
+        except asyncio.CancelledError:
+            logger.info(f"Stream {self.stream_id} cancelled")
+        except Exception as e:
+            logger.error(f"Stream {self.stream_id} failed: {e}")
+        finally:
+            self.done = True
+            self._notify()
+            asyncio.get_running_loop().call_later(REPLAY_TTL, self._expire)
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self.end_offset - self.start_offset
+
+    @property
+    def orphaned(self) -> bool:
+        """曾有订阅者、现在没有的流（刚启动、尚未订阅的流不算）"""
+        return self.subscribers == 0 and self._orphan_timer is not None
+
+    def _append(self, chunk: bytes):
+        before = self.buffered_bytes
+        self.chunks.append((self.end_offset, chunk))
+        self.end_offset += len(chunk)
+        while len(self.chunks) > 1 and self.end_offset - self.chunks[0][0] > self.buffer_bytes:
+            self.chunks.popleft()
+            self.first_seq += 1
+        self.start_offset = self.chunks[0][0]
+        self._notify()
+        if self.on_resize:
+            self.on_resize(self, self.buffered_bytes - before)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _locate(self, offset: int) -> tuple[int, int]:
+        """字节偏移量 -> (数据块序号, 块内偏移)"""
+        for index, (start, chunk) in enumerate(self.chunks):
+            if start + len(chunk) > offset:
+                return self.first_seq + index, offset - start
+        return self.first_seq + len(self.chunks), 0
+
+    async def subscribe(self, offset: int = 0) -> AsyncIterator[bytes]:
+        """从指定字节偏移量开始读取（先回放，再实时输出）"""
+        self._attach()
+        try:
+            seq, skip = self._locate(offset)
+            while True:
+                changed = self._changed
+                while self.first_seq <= seq < self.first_seq + len(self.chunks):
+                    start, chunk = self.chunks[seq - self.first_seq]
+                    yield chunk[skip:] if skip else chunk
+                    offset = start + len(chunk)
+                    seq += 1
+                    skip = 0
+                if seq < self.first_seq:
+                    # 订阅者太慢，未读数据已被淘汰：明确告知客户端，而不是当作正常结束
+                    self.lagged += 1
+                    message = (f"Stream {self.stream_id} fell behind, output from byte {offset} "
+                               f"is no longer buffered (buffered from {self.start_offset})")
+                    logger.warning(message)
+                    if self.encode_error:
+                        yield self.encode_error(message, offset)
+                    return
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            self._detach()
+
+    def _attach(self):
+        self.subscribers += 1
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            self._orphan_timer = asyncio.get_running_loop().call_later(ORPHAN_TIMEOUT, self._cancel_orphan)
+
+    def _cancel_orphan(self):
+        if self.subscribers == 0 and not self.done:
+            logger.info(f"Stream {self.stream_id} has no subscribers, cancelling generation")
+            self._task.cancel()
+
+    def cancel(self):
+        self._task.cancel()
+
+    def _expire(self):
+        if self.on_expire:
+            self.on_expire(self.stream_id)
+
+
+class StreamRegistry:
+    def __init__(self, max_streams: int = MAX_STREAMS, max_bytes: int = MAX_BYTES):
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        self.streams: Dict[str, ReplayableStream] = {}  # 按启动顺序
+        self.buffered_bytes = 0
+        self.started = 0
+        self.resumed = 0
+        self.evicted = 0
+        self.rejected = 0
+        self.lagged = 0  # 已移除的流累计的落后订阅者数
+
+    def start(self, body: AsyncIterator, media_type: str,
+              encode_error: Optional[Callable[[str, int], bytes]] = None) -> Optional[ReplayableStream]:
+        """启动一个可恢复的流；流数已满且没有可淘汰的流时返回 None，由调用方按普通流输出"""
+        self._evict(reserve=1)
+        if len(self.streams) >= self.max_streams:
+            self.rejected += 1
+            return None
+        stream_id = uuid.uuid4().hex
+        stream = ReplayableStream(stream_id, body, media_type, encode_error=encode_error)
+        stream.on_expire = self._remove
+        stream.on_resize = self._resize
+        self.streams[stream_id] = stream
+        self.started += 1
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ReplayableStream]:
+        return self.streams.get(stream_id)
+
+    def resume(self, stream_id: str, offset: int) -> AsyncIterator[bytes]:
+        """恢复读取，流不存在返回 KeyError，偏移量不可用抛出 StreamGone"""
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            raise KeyError(f"Stream {stream_id} not found")
+        if offset < stream.start_offset or offset > stream.end_offset:
+            raise StreamGone(f"Offset {offset} is outside buffered range "
+                             f"[{stream.start_offset}, {stream.end_offset}]")
+        self.resumed += 1
+        return stream.subscribe(offset)
+
+    def _remove(self, stream_id: str):
+        stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            self.buffered_bytes -= stream.buffered_bytes
+            self.lagged += stream.lagged
+
+    def _resize(self, stream: ReplayableStream, delta: int):
+        if stream.stream_id in self.streams:
+            self.buffered_bytes += delta
+            if self.buffered_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self, reserve: int = 0):
+        """超出上限时按启动顺序淘汰：先淘汰已结束的流，再淘汰无订阅者的流"""
+        while len(self.streams) + reserve > self.max_streams or self.buffered_bytes > self.max_bytes:
+            victim = next((s for s in self.streams.values() if s.done), None) \
+                or next((s for s in self.streams.values() if s.orphaned), None)
+            if victim is None:
+                return
+            victim.cancel()
+            self._remove(victim.stream_id)
+            self.evicted += 1
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "streams": len(self.streams),
+            "generating": sum(1 for s in self.streams.values() if not s.done),
+            "buffered_bytes": self.buffered_bytes,
+            "started": self.started,
+            "resumed": self.resumed,
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+            "lagged": self.lagged + sum(s.lagged for s in self.streams.values())
+        }
+
+
+stream_registry = StreamRegistry()
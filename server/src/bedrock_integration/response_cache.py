@@ -0,0 +1,124 @@
+"""
+响应缓存（精确匹配）
+
+功能：完全相同的 converse 请求直接重放已记录的事件流，跳过模型调用
+      （如固定的系统提示词加同一问题、重新生成的建议）
+键：converse 命令（模型、system、messages、inferenceConfig 等）的规范化 JSON 哈希，
+    媒体字节按内容哈希参与计算，不区分区域
+记录：只缓存正常结束（end_turn / stop_sequence）的完整事件流，中断、出错或工具调用的流不缓存
+重放：缓存的是原始 Bedrock 事件，重放时经过与实时流相同的编码（converse_v3、lean、MessagePack）
+淘汰：TTL 过期，超出容量时按 LRU 淘汰，容量按字节计算
+启用：请求中设置 "responseCache": true（按请求开启）
+配置：
+  - RESPONSE_CACHE_MAX_BYTES：缓存容量（默认 32MB，0 表示关闭）
+  - RESPONSE_CACHE_TTL：缓存有效期，秒（默认 600）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "600"))
+
+_CACHEABLE_STOP_REASONS = ("end_turn", "stop_sequence")
+
+
+def _encode_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"blake2b": hashlib.blake2b(value, digest_size=16).hexdigest()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def cache_key(command: dict) -> str:
+    """converse 命令的规范化哈希"""
+    canonical = json.dumps(command, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+                           default=_encode_bytes)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = MAX_BYTES, ttl: float = TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # {key: (过期时间, 字节数, 事件列表)}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        """获取未过期的事件列表"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: str, events: List[dict]):
+        size = len(json.dumps(events, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, events)
+            self._size += size
+            self.stored += 1
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    async def record(self, key: str, events: AsyncIterator[dict]) -> AsyncIterator[dict]:
+        """转发事件流，正常结束时写入缓存"""
+        recorded = []
+        stop_reason = None
+        async with aclosing(events) as stream:
+            async for event in stream:
+                recorded.append(event)
+                if "messageStop" in event:
+                    stop_reason = event["messageStop"].get("stopReason")
+                yield event
+        if stop_reason in _CACHEABLE_STOP_REASONS:
+            self.put(key, recorded)
+
+    @staticmethod
+    async def replay(events: List[dict]) -> AsyncIterator[dict]:
+        for event in events:
+            yield event
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stored": self.stored,
+                "evicted": self.evicted
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,266 @@
+"""
+跨区域对冲与故障转移
+
+功能：converse 流在首 token 之前可切换到另一个区域或跨区域推理配置（inference profile），降低区域拥塞时的尾部延迟
+路由候选：
+  - 跨区域推理配置（us./eu./apac. 前缀）：同一配置 ID 发往同一地理区域内的其他区域
+  - 普通模型 ID：同一区域内对应地理区域的跨区域推理配置（如 us.anthropic.claude-...），
+    仅当 /api/models 列出过该推理配置时才使用
+策略：
+  - 对冲：BEDROCK_HEDGE_AFTER_MS 毫秒内未收到首 token 时，向下一个候选再发一个请求，
+    先收到首 token 的流胜出，较慢的流立即关闭
+  - 故障转移：首 token 前出现 ThrottlingException / ServiceUnavailableException 时改用下一个候选
+  - 首 token 之后的错误直接返回给客户端（已输出的内容无法撤回）
+  - 所有路由都失败时抛出第一个可重试错误（如限流），没有时抛出第一个错误，
+    保证准入控制和凭证池看到原始的限流错误
+配置：
+  - BEDROCK_HEDGE_AFTER_MS：对冲等待时间，0 表示不对冲（默认 0）
+  - BEDROCK_FAILOVER_ENABLED：默认 true
+  - BEDROCK_ROUTE_MAX_ALTERNATES：每个请求最多使用的备选路由数（默认 2）
+  - BEDROCK_ROUTE_REGIONS：跨区域推理配置可用的区域列表（逗号分隔），覆盖内置列表
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+from botocore.exceptions import ClientError
+from bedrock_integration.admission import is_throttling_error
+from bedrock_integration.credential_pool import CredentialLease, CredentialPool, credential_pool
+from bedrock_integration.stream_engine import BedrockStream
+
+logger = logging.getLogger(__name__)
+
+HEDGE_AFTER_MS = int(os.environ.get("BEDROCK_HEDGE_AFTER_MS", "0"))
+FAILOVER_ENABLED = os.environ.get("BEDROCK_FAILOVER_ENABLED", "true").lower() == "true"
+MAX_ALTERNATES = int(os.environ.get("BEDROCK_ROUTE_MAX_ALTERNATES", "2"))
+ROUTE_REGIONS = [r.strip() for r in os.environ.get("BEDROCK_ROUTE_REGIONS", "").split(",") if r.strip()]
+
+# 跨区域推理配置前缀 -> 可调用该配置的区域
+GEO_REGIONS = {
+    "us": ["us-east-1", "us-west-2", "us-east-2"],
+    "eu": ["eu-central-1", "eu-west-1", "eu-west-3"],
+    "apac": ["ap-northeast-1", "ap-southeast-1", "ap-southeast-2"],
+}
+
+RETRYABLE_ERRORS = {"throttlingexception", "serviceunavailableexception"}
+
+
+@dataclass(frozen=True)
+class Route:
+    region: str
+    model_id: str
+
+    def __str__(self):
+        return f"{self.region}/{self.model_id}"
+
+
+def region_geo(region: str) -> Optional[str]:
+    """区域所属的跨区域推理配置前缀"""
+    if region.startswith("us-"):
+        return "us"
+    if region.startswith("eu-"):
+        return "eu"
+    if region.startswith("ap-"):
+        return "apac"
+    return None
+
+
+def geo_regions(geo: str) -> List[str]:
+    if ROUTE_REGIONS:
+        return [region for region in ROUTE_REGIONS if region_geo(region) == geo]
+    return GEO_REGIONS.get(geo, [])
+
+
+# /api/models 列出的跨区域推理配置 ID
+inference_profiles: Set[str] = set()
+
+
+def register_inference_profiles(model_ids: Iterable[str]):
+    """记录带地理前缀的模型 ID，普通模型 ID 只会故障转移到已知存在的推理配置"""
+    inference_profiles.update(m for m in model_ids if m.split(".", 1)[0] in GEO_REGIONS)
+
+
+def candidate_routes(model_id: str, region: str) -> List[Route]:
+    """主路由与备选路由（按优先级排列）"""
+    routes = [Route(region, model_id)]
+    prefix = model_id.split(".", 1)[0]
+    if prefix in GEO_REGIONS:
+        routes += [Route(other, model_id) for other in geo_regions(prefix) if other != region]
+    else:
+        geo = region_geo(region)
+        if geo and f"{geo}.{model_id}" in inference_profiles:
+            routes.append(Route(region, f"{geo}.{model_id}"))
+    return routes[:1 + MAX_ALTERNATES]
+
+
+def is_retryable(error: Exception) -> bool:
+    """首 token 前可以故障转移的错误"""
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        return code.lower() in RETRYABLE_ERRORS
+    return False
+
+
+def primary_failure(failures: List[Exception]) -> Exception:
+    """所有路由失败时返回给调用方的错误：第一个可重试错误，否则第一个错误"""
+    return next((error for error in failures if is_retryable(error)), failures[0])
+
+
+def is_first_token(event: dict) -> bool:
+    """messageStart 之后的任何事件都说明模型已开始输出"""
+    return "messageStart" not in event
+
+
+class _Attempt:
+    """一个路由上的 Bedrock 流"""
+
+    def __init__(self, route: Route, lease: CredentialLease, client, command: dict):
+        self.route = route
+        self.lease = lease
+        self.stream = BedrockStream(client, {**command, "modelId": route.model_id})
+        self.iterator = self.stream.events()
+        self.buffer: List[dict] = []
+        self.pending: Optional[asyncio.Future] = None
+        self.finished = False
+
+    def next(self) -> asyncio.Future:
+        if self.pending is None:
+            self.pending = asyncio.ensure_future(self.iterator.__anext__())
+        return self.pending
+
+    async def close(self, error: Optional[Exception] = None, count_throttle: bool = True):
+        self.lease.release(error, count_throttle)
+        if self.pending is not None:
+            self.pending.cancel()
+            await asyncio.wait({self.pending})
+            if not self.pending.cancelled():
+                # 读取已完成但未被使用的结果，避免未处理异常的警告
+                self.pending.exception()
+            self.pending = None
+        await self.iterator.aclose()
+
+
+class BedrockRouter:
+    def __init__(self, hedge_after_ms: int = HEDGE_AFTER_MS, failover: bool = FAILOVER_ENABLED):
+        self.hedge_after = hedge_after_ms / 1000
+        self.failover = failover
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.cancelled = 0
+        self.route_wins: Dict[str, int] = {}
+
+    async def events(
+        self,
+        command: dict,
+        region: str,
+        pool: Optional[CredentialPool] = None
+    ) -> AsyncIterator[dict]:
+        """按路由策略产出 Bedrock 事件，每个路由从凭证池中选择凭证"""
+        pool = pool or credential_pool
+        routes = candidate_routes(command["modelId"], region)
+        if not self.failover and self.hedge_after <= 0:
+            routes = routes[:1]
+        remaining = iter(routes)
+        attempts: List[_Attempt] = []
+        failures: List[Exception] = []
+        # 本请求中已计过限流的凭证，一个请求对每组凭证只计一次
+        throttled_sets = set()
+        self.requests += 1
+
+        async def launch() -> bool:
+            route = next(remaining, None)
+            if route is None:
+                return False
+            lease = pool.lease(route.region)
+            try:
+                client = await lease.client_async()
+            except Exception as error:
+                lease.release(error)
+                raise
+            attempts.append(_Attempt(route, lease, client, command))
+            return True
+
+        loop = asyncio.get_running_loop()
+        await launch()
+        hedge_at = loop.time() + self.hedge_after if self.hedge_after > 0 else None
+        hedged = False
+        winner = None
+        try:
+            while winner is None:
+                if not attempts:
+                    raise primary_failure(failures)
+                timeout = max(0.0, hedge_at - loop.time()) if hedge_at is not None else None
+                done, _ = await asyncio.wait({attempt.next() for attempt in attempts}, timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    if await launch():
+                        hedged = True
+                        self.hedged += 1
+                        logger.info(f"No first token from {attempts[0].route}, hedging to {attempts[-1].route}")
+                    continue
+                for attempt in [a for a in attempts if a.pending in done]:
+                    task, attempt.pending = attempt.pending, None
+                    try:
+                        event = task.result()
+                    except StopAsyncIteration:
+                        attempt.finished = True
+                        winner = attempt
+                        break
+                    except Exception as error:
+                        attempts.remove(attempt)
+                        credential_set = attempt.lease.credential_set
+                        await attempt.close(error, credential_set not in throttled_sets)
+                        if is_throttling_error(error):
+                            throttled_sets.add(credential_set)
+                        failures.append(error)
+                        if self.failover and is_retryable(error) and await launch():
+                            self.failovers += 1
+                            logger.warning(f"{attempt.route} failed before first token ({error}), "
+                                           f"failing over to {attempts[-1].route}")
+                        continue
+                    attempt.buffer.append(event)
+                    if is_first_token(event):
+                        winner = attempt
+                        break
+
+            for attempt in [a for a in attempts if a is not winner]:
+                # 关闭较慢的流
+                attempts.remove(attempt)
+                await attempt.close()
+                self.cancelled += 1
+            if hedged and winner.route != routes[0]:
+                self.hedge_wins += 1
+            self.route_wins[str(winner.route)] = self.route_wins.get(str(winner.route), 0) + 1
+
+            for event in winner.buffer:
+                yield event
+            if not winner.finished:
+                try:
+                    async for event in winner.iterator:
+                        yield event
+                except Exception as error:
+                    await winner.close(error)
+                    raise
+        finally:
+            for attempt in attempts:
+                await attempt.close()
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "hedge_after_ms": int(self.hedge_after * 1000),
+            "failover": self.failover,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "cancelled": self.cancelled,
+            "route_wins": dict(self.route_wins)
+        }
+
+
+bedrock_router = BedrockRouter()
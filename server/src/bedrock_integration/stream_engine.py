@@ -0,0 +1,140 @@
+"""
+Bedrock 异步流式引擎
+
+功能：在不阻塞事件循环的前提下读取 Bedrock converse_stream 事件流
+原理：
+  - boto3 没有原生 async 客户端，事件流由 chat_stream 线程池中的读取线程拉取
+    （不占用 AnyIO 线程池，大小由 POOL_CHAT_STREAM_SIZE 配置）
+  - 读取线程通过有界缓冲区把事件交给事件循环上的协程
+  - 缓冲区满时读取线程暂停读取，对慢速客户端形成背压
+  - 消费端关闭时立即关闭上游 HTTP 连接
+  - 每个流在生成期间占用一个读取线程，同时进行的流不超过 POOL_CHAT_STREAM_SIZE；
+    读取线程全忙时最多排队 BEDROCK_STREAM_QUEUE_TIMEOUT 秒，超时抛出 StreamCapacityExceeded（返回 429）
+用法：
+    async with BedrockStream(client, command) as stream:
+        async for event in stream:
+            ...
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, AsyncIterator, Dict
+from bedrock_integration.admission import AdmissionRejected
+from workload_pools import get_pool
+
+logger = logging.getLogger(__name__)
+
+STREAM_BUFFER_SIZE = int(os.environ.get("BEDROCK_STREAM_BUFFER", "64"))
+QUEUE_TIMEOUT = float(os.environ.get("BEDROCK_STREAM_QUEUE_TIMEOUT", "10"))
+
+_END = object()
+
+
+class StreamCapacityExceeded(AdmissionRejected):
+    """等待读取线程超时"""
+
+
+class BedrockStream:
+    """Bedrock converse_stream 事件流的异步封装"""
+
+    def __init__(self, client, command: Dict[str, Any], buffer_size: int = STREAM_BUFFER_SIZE,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.client = client
+        self.command = command
+        self.queue_timeout = queue_timeout
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._slots = threading.Semaphore(buffer_size)
+        self._closed = threading.Event()
+        self._event_stream = None
+        self._loop = None
+        self._reader = None
+        self._started = asyncio.Event()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __aiter__(self) -> AsyncIterator[dict]:
+        return self.events()
+
+    def start(self):
+        """启动读取线程"""
+        if self._reader is None:
+            self._loop = asyncio.get_running_loop()
+            self._reader = get_pool("chat_stream").submit(self._pump)
+
+    async def events(self) -> AsyncIterator[dict]:
+        """逐个产出 Bedrock 事件，上游异常在此处重新抛出"""
+        self.start()
+        try:
+            if not self._started.is_set():
+                try:
+                    await asyncio.wait_for(self._started.wait(), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    raise StreamCapacityExceeded(
+                        f"No chat stream reader free after {self.queue_timeout:.0f}s") from None
+            while True:
+                item = await self._queue.get()
+                self._slots.release()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """停止读取并关闭上游连接（可重复调用）"""
+        if not self._closed.is_set():
+            self._closed.set()
+            if self._reader is not None:
+                # 仍在线程池中排队的读取任务直接取消
+                self._reader.cancel()
+            self._close_upstream()
+
+    def _pump(self):
+        """读取线程：拉取上游事件并投递到事件循环"""
+        try:
+            self._loop.call_soon_threadsafe(self._started.set)
+            if self._closed.is_set():
+                return
+            response = self.client.converse_stream(**self.command)
+            self._event_stream = response["stream"]
+            if self._closed.is_set():
+                return
+            for event in self._event_stream:
+                if not self._deliver(event):
+                    break
+        except Exception as error:
+            if not self._closed.is_set():
+                self._deliver(error)
+        finally:
+            self._close_upstream()
+            self._deliver(_END)
+
+    def _deliver(self, item) -> bool:
+        """把事件放入缓冲区；缓冲区满时阻塞读取线程，流关闭时返回 False"""
+        while not self._slots.acquire(timeout=0.5):
+            if self._closed.is_set():
+                return False
+        if self._closed.is_set():
+            return False
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭
+            return False
+        return True
+
+    def _close_upstream(self):
+        event_stream = self._event_stream
+        if event_stream is not None:
+            try:
+                event_stream.close()
+            except Exception as e:
+                logger.debug(f"Error closing Bedrock event stream: {e}")
@@ -0,0 +1,57 @@
+"""
+本地 token 估算
+
+功能：不调用模型，快速估算 Bedrock messages 的 token 数，用于 prompt 缓存检查点与上下文压缩
+估算规则：
+  - ASCII 文本约 4 个字符一个 token，中日韩等非 ASCII 字符约 1 个字符一个 token
+  - 图片、文档、视频按固定值估算
+  - 工具调用与工具结果按其 JSON 长度估算
+"""
+import json
+from typing import List
+
+# 媒体块的粗略 token 估算
+MEDIA_TOKENS = {"image": 1600, "document": 2000, "video": 4000}
+
+MEDIA_BLOCKS = tuple(MEDIA_TOKENS)
+
+
+def estimate_text_tokens(text: str) -> int:
+    if text.isascii():
+        return len(text) // 4
+    # 非 ASCII 字符在 UTF-8 中占 2~3 字节，用多出的字节数近似其数量
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    return (len(text) - non_ascii) // 4 + non_ascii
+
+
+def estimate_block_tokens(block: dict) -> int:
+    """估算单个内容块的 token 数"""
+    if "text" in block:
+        return estimate_text_tokens(block["text"])
+    for media, tokens in MEDIA_TOKENS.items():
+        if media in block:
+            return tokens
+    if "toolUse" in block:
+        return estimate_text_tokens(json.dumps(block["toolUse"].get("input", {}), ensure_ascii=False)) + 10
+    if "toolResult" in block:
+        return sum(estimate_block_tokens(item) for item in block["toolResult"].get("content", [])) + 10
+    if "json" in block:
+        return estimate_text_tokens(json.dumps(block["json"], ensure_ascii=False))
+    if "reasoningContent" in block:
+        return estimate_text_tokens(block["reasoningContent"].get("reasoningText", {}).get("text", ""))
+    return 0
+
+
+def estimate_message_tokens(message: dict) -> int:
+    return sum(estimate_block_tokens(block) for block in message.get("content", [])) + 4
+
+
+def estimate_messages_tokens(messages: List[dict]) -> int:
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def estimate_command_tokens(command: dict, output_tokens: int = 1024) -> int:
+    """估算一次 converse 调用的 token 数（输入 + 预计输出）"""
+    system = sum(estimate_block_tokens(block) for block in command.get("system") or [])
+    max_tokens = command.get("inferenceConfig", {}).get("maxTokens", output_tokens)
+    return system + estimate_messages_tokens(command["messages"]) + min(max_tokens, output_tokens)
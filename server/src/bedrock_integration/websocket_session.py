@@ -0,0 +1,210 @@
+"""
+WebSocket 会话
+
+功能：一个 WebSocket 连接只认证一次，同时承载多个 converse / 工具调用流，按 id 区分
+客户端消息（JSON 文本帧）：
+  - {"type": "auth", "token": "..."}                     认证（也可在握手时带 Authorization 头）
+  - {"type": "converse" | "tool", "id": "...", "request": {...}, "window": N}
+                                                          开始一个流，window 为可选的流控窗口
+  - {"type": "ack", "id": "...", "count": N}             确认已处理 N 条消息，归还流控窗口
+  - {"type": "cancel", "id": "..."}                      取消流，上游 Bedrock 流随之关闭
+  - {"type": "ping"}
+服务端消息：每条消息带 "id" 与 "type"
+  - ready / pong                                         连接级消息（无 id）
+  - event / frames / result / start                     流内容（由各处理函数产出）
+  - done / cancelled / error                             流结束
+流控：
+  - 设置 window 时，每个流最多有 window 条未确认的消息，超出后暂停读取上游，直到客户端 ack；
+    ack 的 count 最多归还该流未确认的消息数
+  - 无法处理的消息（非 JSON、二进制帧、参数无效）只回复 error，不关闭连接
+  - 所有流共用一个有界发送队列，连接写不动时各流的生产者随之等待（背压）
+配置：
+  - WS_SEND_BUFFER：发送队列长度（默认 256）
+  - WS_MAX_STREAMS：每个连接同时进行的流数（默认 16）
+  - WS_AUTH_TIMEOUT：握手后等待认证消息的时间，秒（默认 10）
+"""
+import asyncio
+import json
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, Optional
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from bedrock_integration.projection import dumps
+
+SEND_BUFFER = int(os.environ.get("WS_SEND_BUFFER", "256"))
+MAX_STREAMS = int(os.environ.get("WS_MAX_STREAMS", "16"))
+AUTH_TIMEOUT = float(os.environ.get("WS_AUTH_TIMEOUT", "10"))
+
+Handler = Callable[[dict], AsyncIterator[dict]]
+
+
+class StreamCredit:
+    """单个流的流控窗口，最多 window 条未确认的消息"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.available = window
+        self._changed = asyncio.Event()
+
+    async def take(self):
+        while self.available <= 0:
+            await self._changed.wait()
+        self.available -= 1
+
+    def grant(self, count: int):
+        """归还 count 条，超出未确认数的部分被忽略"""
+        self.available = min(self.window, self.available + max(0, count))
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+def positive_int(value) -> Optional[int]:
+    """解析客户端给出的正整数，无效时返回 None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return number if number > 0 else None
+
+
+class WebSocketStats:
+    def __init__(self):
+        self.connections = 0
+        self.active_connections = 0
+        self.streams = 0
+        self.active_streams = 0
+        self.cancelled = 0
+        self.errors = 0
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "connections": self.connections,
+            "active_connections": self.active_connections,
+            "streams": self.streams,
+            "active_streams": self.active_streams,
+            "cancelled": self.cancelled,
+            "errors": self.errors
+        }
+
+
+websocket_stats = WebSocketStats()
+
+
+class WebSocketSession:
+    def __init__(self, websocket: WebSocket, handlers: Dict[str, Handler],
+                 describe_error: Callable[[Exception], dict] = lambda error: {"error": str(error)}):
+        self.websocket = websocket
+        self.handlers = handlers
+        self.describe_error = describe_error
+        self.streams: Dict[str, asyncio.Task] = {}
+        self.credits: Dict[str, StreamCredit] = {}
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=SEND_BUFFER)
+
+    async def send(self, message: dict):
+        await self._outbox.put(message)
+
+    async def run(self):
+        """处理已认证的连接，直到客户端断开"""
+        websocket_stats.connections += 1
+        websocket_stats.active_connections += 1
+        writer = asyncio.ensure_future(self._write())
+        try:
+            await self.send({"type": "ready"})
+            while not writer.done():
+                receive = asyncio.ensure_future(self.websocket.receive())
+                await asyncio.wait({receive, writer}, return_when=asyncio.FIRST_COMPLETED)
+                if not receive.done():
+                    receive.cancel()
+                    break
+                message = receive.result()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is None:
+                    await self.send({"type": "error", "error": "Only JSON text messages are supported"})
+                    continue
+                try:
+                    await self._handle(message["text"])
+                except Exception as error:
+                    # 单条消息出错不影响连接上的其他流
+                    await self.send({"type": "error", "error": f"Invalid message: {error}"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            websocket_stats.active_connections -= 1
+            tasks = list(self.streams.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+    async def _write(self):
+        while True:
+            message = await self._outbox.get()
+            await self.websocket.send_text(dumps(message).decode("utf-8"))
+
+    async def _handle(self, text: str):
+        try:
+            message = json.loads(text)
+            kind = message.get("type")
+            stream_id = message.get("id")
+        except (ValueError, AttributeError):
+            await self.send({"type": "error", "error": "Invalid message"})
+            return
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "cancel":
+            task = self.streams.get(stream_id)
+            if task is not None:
+                task.cancel()
+                await self.send({"id": stream_id, "type": "cancelled"})
+        elif kind == "ack":
+            count = positive_int(message.get("count", 1))
+            if count is None:
+                await self.send({"id": stream_id, "type": "error", "error": "count must be a positive integer"})
+                return
+            credit = self.credits.get(stream_id)
+            if credit is not None:
+                credit.grant(count)
+        elif kind in self.handlers:
+            if not isinstance(stream_id, str) or stream_id in self.streams:
+                await self.send({"id": stream_id, "type": "error", "error": "A unique string id is required"})
+            elif len(self.streams) >= MAX_STREAMS:
+                await self.send({"id": stream_id, "type": "error", "status": 429,
+                                 "error": f"At most {MAX_STREAMS} concurrent streams per connection"})
+            elif message.get("window") is not None and positive_int(message["window"]) is None:
+                await self.send({"id": stream_id, "type": "error", "error": "window must be a positive integer"})
+            else:
+                window = positive_int(message.get("window"))
+                handler = self.handlers[kind]
+                self.streams[stream_id] = asyncio.ensure_future(
+                    self._run_stream(stream_id, handler(message.get("request") or {}), window))
+        else:
+            await self.send({"id": stream_id, "type": "error", "error": f"Unknown message type: {kind}"})
+
+    async def _run_stream(self, stream_id: str, messages: AsyncIterator[dict], window: Optional[int]):
+        websocket_stats.streams += 1
+        websocket_stats.active_streams += 1
+        credit = StreamCredit(window) if window else None
+        if credit is not None:
+            self.credits[stream_id] = credit
+        try:
+            async with aclosing(messages) as stream:
+                async for body in stream:
+                    if credit is not None:
+                        await credit.take()
+                    await self.send({"id": stream_id, **body})
+            await self.send({"id": stream_id, "type": "done"})
+        except asyncio.CancelledError:
+            websocket_stats.cancelled += 1
+            raise
+        except Exception as error:
+            websocket_stats.errors += 1
+            await self.send({"id": stream_id, "type": "error", **self.describe_error(error)})
+        finally:
+            websocket_stats.active_streams -= 1
+            self.streams.pop(stream_id, None)
+            self.credits.pop(stream_id, None)
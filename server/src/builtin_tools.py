@@ -4,10 +4,11 @@ Built-in Tools - web_fetch
 import httpx
 import time
 import json
-import boto3
 import re
 from bs4 import BeautifulSoup
 from typing import Dict, Any
+from workload_pools import run_in_pool
+from bedrock_integration.client_registry import get_client
 
 
 class BuiltInTools:
@@ -83,13 +84,13 @@ class BuiltInTools:
         
         # 处理内容
         if mode == "regex":
-            text = self._clean_html_regex(html, config, debug_info)
+            text = await run_in_pool("html_parse", self._clean_html_regex, html, config, debug_info)
             processed_by = "regex"
         elif mode == "ai_summary":
             text = await self._clean_html_ai(html, url, config, debug_info)
             processed_by = "ai_summary"
         else:
-            text = self._clean_html_regex(html, config, debug_info)
+            text = await run_in_pool("html_parse", self._clean_html_regex, html, config, debug_info)
             processed_by = "regex"
         
         # 构建结果
@@ -164,7 +165,7 @@ class BuiltInTools:
         debug_info["steps"].append("Using AI summary mode...")
         
         # 先用 regex 清理
-        cleaned_text = self._clean_html_regex(html, config, debug_info)
+        cleaned_text = await run_in_pool("html_parse", self._clean_html_regex, html, config, debug_info)
         
         # 截断过长内容
         max_input = 100000
@@ -188,20 +189,12 @@ class BuiltInTools:
         debug_info["steps"].append(f"Calling Bedrock: {summary_model}")
         
         try:
-            # 创建 Bedrock 客户端
-            bedrock_kwargs = {
-                'region_name': aws_region
-            }
-            
-            # 添加凭证（如果提供）
-            if config.get("awsAccessKeyId"):
-                bedrock_kwargs['aws_access_key_id'] = config.get("awsAccessKeyId")
-            if config.get("awsSecretAccessKey"):
-                bedrock_kwargs['aws_secret_access_key'] = config.get("awsSecretAccessKey")
-            if config.get("awsSessionToken"):
-                bedrock_kwargs['aws_session_token'] = config.get("awsSessionToken")
-            
-            bedrock = boto3.client('bedrock-runtime', **bedrock_kwargs)
+            # 获取复用的 Bedrock 客户端（凭证为空时使用默认凭证链）
+            bedrock = get_client('bedrock-runtime', aws_region, credentials={
+                'aws_access_key_id': config.get("awsAccessKeyId"),
+                'aws_secret_access_key': config.get("awsSecretAccessKey"),
+                'aws_session_token': config.get("awsSessionToken")
+            })
             
             # 构建提示词
             full_prompt = f"""{summary_prompt}
@@ -213,23 +206,25 @@ Content:
 
 Summary:"""
             
-            # 调用 Bedrock
-            response = bedrock.invoke_model(
-                modelId=summary_model,
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 4096,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": full_prompt
-                        }
-                    ]
-                })
-            )
+            # 调用 Bedrock（阻塞调用放到 html_parse 线程池）
+            def invoke_summary():
+                response = bedrock.invoke_model(
+                    modelId=summary_model,
+                    body=json.dumps({
+                        "anthropic_version": "bedrock-2023-05-31",
+                        "max_tokens": 4096,
+                        "messages": [
+                            {
+                                "role": "user",
+                                "content": full_prompt
+                            }
+                        ]
+                    })
+                )
+                return json.loads(response['body'].read())
             
             # 解析响应
-            result = json.loads(response['body'].read())
+            result = await run_in_pool("html_parse", invoke_summary)
             summary = result['content'][0]['text']
             
             debug_info["steps"].append(f"AI summary: {len(summary)} chars")
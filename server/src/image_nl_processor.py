@@ -1,14 +1,12 @@
-import random
 import json
-import base64
 from fastapi import HTTPException
+from bedrock_integration.media_cache import media_cache
 
 
 def get_native_request_with_ref_image(client, prompt, ref_images, width, height):
     result = get_analyse_result(client, prompt, get_prompt())
     try:
         result_objet = json.loads(result)
-        seed = random.randint(0, 2147483647)
         if result_objet['target_task_type'] == 'BACKGROUND_REMOVAL':
             return {
                 "taskType": "BACKGROUND_REMOVAL",
@@ -26,7 +24,6 @@ def get_native_request_with_ref_image(client, prompt, ref_images, width, height)
                     "cfgScale": 6.5,
                     "height": height,
                     "width": width,
-                    "seed": seed,
                 },
             }
         elif result_objet['target_task_type'] == 'COLOR_GUIDED_GENERATION':
@@ -87,7 +84,7 @@ def get_analyse_result(client, prompt, global_prompt, image=None):
     try:
         content = [{"text": prompt}]
         if image is not None:
-            image_bytes = base64.b64decode(image)
+            image_bytes = media_cache.decode(image)
             content.append({"image": {"format": "jpeg", "source": {"bytes": image_bytes}}})
 
         messages = [
@@ -118,7 +115,6 @@ def get_analyse_result(client, prompt, global_prompt, image=None):
 def get_native_request_with_virtual_try_on(client, prompt, ref_images, width, height):
     garment_image = ref_images[1]['source']['bytes']
     garment_class = get_garment_class(client, prompt, garment_image)
-    seed = random.randint(0, 2147483647)
 
     return {
         "taskType": "VIRTUAL_TRY_ON",
@@ -131,9 +127,7 @@ def get_native_request_with_virtual_try_on(client, prompt, ref_images, width, he
                 "garmentClass": garment_class,
             },
         },
-        "imageGenerationConfig": {
-            "seed": seed,
-        },
+        "imageGenerationConfig": {},
     }
 
 
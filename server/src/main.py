@@ -1,8 +1,10 @@
+import asyncio
 import base64
 import logging
-from typing import List
+from contextlib import asynccontextmanager, aclosing
+from typing import AsyncIterator, List
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, Request as FastAPIRequest
+from fastapi import FastAPI, HTTPException, Depends, Request as FastAPIRequest, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse, PlainTextResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 import boto3
@@ -16,9 +18,34 @@ from typing import Annotated
 from urllib.request import urlopen, Request
 import time
 from image_nl_processor import get_native_request_with_ref_image, get_analyse_result, get_native_request_with_virtual_try_on
-import httpx
 from tool_manager import ToolManager
 from mcp_integration.manager import MCPManager
+from bedrock_integration.routing import bedrock_router, register_inference_profiles
+from bedrock_integration.message_assembler import MessageAssembler
+from bedrock_integration.projection import lean_stream, lean_frames, TaggedProjection, encode_frames
+from bedrock_integration.framing import accepts_msgpack, msgpack_stream, pack_frames, MSGPACK_MEDIA_TYPE
+from bedrock_integration.conversation_store import conversation_store, ConversationConflict
+from bedrock_integration.multipart import read_converse_form, attach_media_parts
+from bedrock_integration.media_cache import media_cache, MediaNotCached
+from bedrock_integration.client_registry import get_client, get_client_async, client_registry, WARMUP_REGIONS
+from bedrock_integration.replay import stream_registry, StreamGone
+from bedrock_integration.prompt_cache import prompt_cache_policy
+from bedrock_integration.context_compaction import context_compactor
+from bedrock_integration.admission import admission_controller, AdmissionRejected, is_throttling_error
+from bedrock_integration.token_estimator import estimate_command_tokens
+from bedrock_integration.credential_pool import credential_pool
+from bedrock_integration.agent_loop import AgentLoop, agent_stats, has_tool_blocks, flatten_tool_blocks
+from bedrock_integration.fanout import multiplex, fanout_stats, MAX_MODELS as FANOUT_MAX_MODELS
+from bedrock_integration.batch import run_batch, batch_stats, MAX_ITEMS as BATCH_MAX_ITEMS
+from bedrock_integration.response_cache import response_cache, cache_key
+from bedrock_integration.image_jobs import image_jobs, JobQueueFull, FINISHED as IMAGE_JOB_FINISHED, \
+    MAX_BATCH_IMAGES as IMAGE_BATCH_MAX_IMAGES
+from bedrock_integration.websocket_session import WebSocketSession, websocket_stats, AUTH_TIMEOUT as WS_AUTH_TIMEOUT
+from openai_proxy.client_pool import upstream_clients
+from openai_proxy.upstream_groups import upstream_groups
+from openai_proxy.sse_usage import SSEUsageParser
+from workload_pools import run_in_pool, get_pool_stats
+from stream_stats import StreamStats, StreamProgress
 
 # Configure logging
 logging.basicConfig(
@@ -27,7 +54,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    if WARMUP_REGIONS:
+        # Resolve credentials/endpoints once so the first chat does not pay for it
+        await run_in_pool("control", client_registry.warm_up, WARMUP_REGIONS)
+    upstream_clients.start()
+    yield
+    await upstream_clients.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -42,6 +81,7 @@ security = HTTPBearer()
 mcp_manager = MCPManager()
 tool_manager = ToolManager()
 tool_manager.mcp_manager = mcp_manager  # 使用共享的 mcp_manager
+stream_stats = StreamStats()
 
 @app.get("/")
 async def root():
@@ -50,6 +90,8 @@ async def root():
 
 auth_token = ''
 CACHE_DURATION = 120000
+# Until every shipped app sends X-Upstream-Api-Key, /api/openai also accepts the upstream key as its bearer token
+OPENAI_PROXY_REQUIRE_API_KEY = os.environ.get("OPENAI_PROXY_REQUIRE_API_KEY", "false").lower() == "true"
 cache = {
     "latest_version": "",
     "last_check": 0
@@ -65,12 +107,50 @@ class ImageRequest(BaseModel):
     height: int
 
 
+class ImageBatchRequest(ImageRequest):
+    prompt: str | None = None
+    # Several prompts, count images each
+    prompts: List[str] | None = None
+    count: int = 1
+
+
 class ConverseRequest(BaseModel):
     messages: List[dict] = []
     modelId: str
     enableThinking: bool | None = None
     region: str
     system: List[dict] | None = None
+    # Server-side history: send only the new messages of this turn
+    conversationId: str | None = None
+    historyLength: int | None = None
+    # 'lean' streams compact text/reasoning/tool deltas plus one final usage frame
+    streamMode: str | None = None
+    # Keep generating in the background so the client can resume after a dropped connection
+    resumable: bool | None = None
+    # Override PROMPT_CACHE_ENABLED for this request
+    promptCache: bool | None = None
+    # Run these tools server-side and keep going until the model stops calling them,
+    # e.g. ["web_fetch", "mcp:*"]; toolSettings is the web_fetch config of /api/tool/exec
+    agentTools: List[str] | None = None
+    toolSettings: dict | None = None
+    maxAgentSteps: int | None = None
+    # Replay the recorded stream of an identical earlier request instead of calling the model
+    responseCache: bool | None = None
+
+
+class ConverseCompareRequest(ConverseRequest):
+    modelId: str | None = None
+    # Every model answers the same messages, events are tagged with the model id
+    modelIds: List[str]
+
+
+class BatchConverseItem(ConverseRequest):
+    # Echoed back on the result line
+    id: str | None = None
+
+
+class BatchConverseRequest(BaseModel):
+    items: List[BatchConverseItem]
 
 
 class StreamOptions(BaseModel):
@@ -92,6 +172,10 @@ class TokenRequest(BaseModel):
     region: str
 
 
+class MediaLookupRequest(BaseModel):
+    hashes: List[str]
+
+
 class UpgradeRequest(BaseModel):
     os: str
     version: str
@@ -112,7 +196,7 @@ def get_api_key_from_ssm(use_cache_token: bool):
     if not api_key_name:
         raise HTTPException(status_code=500, detail="API_KEY_NAME environment variable not set")
     
-    ssm_client = boto3.client('ssm')
+    ssm_client = get_client('ssm')
     try:
         response = ssm_client.get_parameter(
             Name=api_key_name,
@@ -125,22 +209,74 @@ def get_api_key_from_ssm(use_cache_token: bool):
                             detail=f"Error: Please create your API Key in Parameter Store, {str(error)}")
 
 
-def verify_api_key(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
-                   use_cache_token: bool = True):
-    if credentials.credentials != get_api_key_from_ssm(use_cache_token):
+async def current_api_key(use_cache_token: bool = True) -> str:
+    # A cached key is returned on the event loop and SSM lookups run in the storage pool,
+    # so auth never waits for an AnyIO worker thread
+    if use_cache_token and auth_token != '':
+        return auth_token
+    return await run_in_pool("storage", get_api_key_from_ssm, use_cache_token)
+
+
+async def verify_api_key(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+                         use_cache_token: bool = True):
+    if credentials.credentials != await current_api_key(use_cache_token):
         raise HTTPException(status_code=401, detail="Invalid API Key")
     return credentials.credentials
 
 
-def verify_and_refresh_token(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]):
-    return verify_api_key(credentials, use_cache_token=False)
+async def verify_and_refresh_token(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]):
+    return await verify_api_key(credentials, use_cache_token=False)
 
 
-async def create_bedrock_command(request: ConverseRequest) -> tuple[boto3.client, dict]:
+def decode_media_blocks(messages: List[dict]):
+    # Decoded media is shared through the content-hash cache, blocks may also reference
+    # an uploaded asset by sha256. Media uploaded through multipart is already raw bytes.
+    missing = []
+    for message in messages:
+        if message["role"] == "user":
+            for content in message["content"]:
+                for media_type in ('image', 'video', 'document'):
+                    if media_type in content:
+                        source = content[media_type]['source']
+                        if 'sha256' in source:
+                            data = media_cache.get(source['sha256'])
+                            if data is None:
+                                missing.append(source['sha256'])
+                                continue
+                            source['bytes'] = data
+                            del source['sha256']
+                        elif isinstance(source['bytes'], str):
+                            source['bytes'] = media_cache.decode(source['bytes'])
+    if missing:
+        raise MediaNotCached(missing)
+
+
+def resolve_ref_images(ref_images: List[dict] | None):
+    # Image models take base64 in their JSON body, so cached references are re-encoded
+    for ref_image in ref_images or []:
+        source = ref_image['source']
+        if 'sha256' in source:
+            data = media_cache.resolve(source.pop('sha256'))
+            source['bytes'] = base64.b64encode(data).decode('ascii')
+
+
+async def parse_multipart_converse_request(raw_request: FastAPIRequest,
+                                           model: type[ConverseRequest] = ConverseRequest) -> ConverseRequest:
+    request_json, parts = await read_converse_form(raw_request)
+    request = model.model_validate_json(request_json)
+    attach_media_parts(request.messages, parts)
+    for data in parts.values():
+        media_cache.put(data)
+    return request
+
+
+async def create_bedrock_command(request: ConverseRequest,
+                                 decode_media: bool = True) -> tuple[boto3.client, dict]:
+    # decode_media=False: the caller already decoded the media blocks (compare shares them across models)
     model_id = request.modelId
     region = request.region
 
-    client = boto3.client("bedrock-runtime", region_name=region)
+    client = await get_client_async("bedrock-runtime", region)
 
     max_tokens = 4096
     if model_id.startswith('meta.llama'):
@@ -150,18 +286,10 @@ async def create_bedrock_command(request: ConverseRequest) -> tuple[boto3.client
     if 'claude-3-7-sonnet' in model_id or 'claude-sonnet-4' in model_id:
         max_tokens = 64000
 
-    for message in request.messages:
-        if message["role"] == "user":
-            for content in message["content"]:
-                if 'image' in content:
-                    image_bytes = base64.b64decode(content['image']['source']['bytes'])
-                    content['image']['source']['bytes'] = image_bytes
-                if 'video' in content:
-                    video_bytes = base64.b64decode(content['video']['source']['bytes'])
-                    content['video']['source']['bytes'] = video_bytes
-                if 'document' in content:
-                    document_bytes = base64.b64decode(content['document']['source']['bytes'])
-                    content['document']['source']['bytes'] = document_bytes
+    request.messages = await context_compactor.compact(
+        request.messages, model_id, max_tokens, region, request.conversationId)
+    if decode_media:
+        decode_media_blocks(request.messages)
 
     command = {
         "inferenceConfig": {"maxTokens": max_tokens},
@@ -180,63 +308,579 @@ async def create_bedrock_command(request: ConverseRequest) -> tuple[boto3.client
     if request.system is not None:
         command["system"] = request.system
 
+    prompt_cache_policy.apply(command, request.promptCache)
+
     return client, command
 
 
+async def raw_stream(events, separator: str):
+    # Raw Bedrock events as JSON, the wire format of converse_v2/converse_v3
+    try:
+        async with aclosing(events):
+            async for item in events:
+                yield json.dumps(item) + separator
+    except Exception as err:
+        yield f"Error: {str(err)}"
+
+
+def encode_converse_stream(events, request: ConverseRequest, accept: str | None, separator: str,
+                           projection=None):
+    """Pick the wire encoding of a converse stream, returns (body, media_type)"""
+    if accepts_msgpack(accept):
+        if request.streamMode == 'lean':
+            return lean_stream(events, encode=pack_frames, projection=projection), MSGPACK_MEDIA_TYPE
+        return msgpack_stream(events), MSGPACK_MEDIA_TYPE
+    if request.streamMode == 'lean':
+        return lean_stream(events, projection=projection), "application/x-ndjson"
+    return raw_stream(events, separator), "text/event-stream"
+
+
+def stream_error_encoder(media_type: str):
+    # Error frame in the wire format of a resumable stream, written when a subscriber falls behind
+    def encode(message: str, offset: int) -> bytes:
+        if media_type == MSGPACK_MEDIA_TYPE:
+            return pack_frames([{"error": message, "offset": offset}])
+        if media_type == "application/x-ndjson":
+            return encode_frames([{"error": message, "offset": offset}])
+        return f"Error: {message}".encode("utf-8")
+    return encode
+
+
+async def wait_for_disconnect(raw_request: FastAPIRequest):
+    while True:
+        message = await raw_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def close_on_disconnect(raw_request: FastAPIRequest, body):
+    # Close the body (and with it the upstream model stream) as soon as the client goes away,
+    # instead of waiting for the next write to fail
+    disconnected = asyncio.ensure_future(wait_for_disconnect(raw_request))
+    iterator = body.__aiter__()
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({pending, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not pending.done():
+                return
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        disconnected.cancel()
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait({pending})
+        await iterator.aclose()
+
+
+async def primed(events):
+    # Wait for the first event before the response starts, so queueing timeouts and throttles
+    # become a status code instead of an error line inside a 200 body
+    iterator = events.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        await iterator.aclose()
+        raise
+
+    async def resumed():
+        async with aclosing(iterator):
+            if first is None:
+                return
+            yield first
+            async for item in iterator:
+                yield item
+    return resumed()
+
+
+def model_events(command: dict, region: str):
+    # One converse stream under admission control, with failover and hedging across routes
+    return admission_controller.stream(
+        command["modelId"], region, estimate_command_tokens(command),
+        lambda: bedrock_router.events(command, region))
+
+
+async def recorded_events(events, command: dict):
+    progress = StreamProgress(command["inferenceConfig"]["maxTokens"])
+    stream_stats.record_start("bedrock")
+    try:
+        async with aclosing(events) as stream:
+            async for item in stream:
+                progress.feed(item)
+                yield item
+    except (GeneratorExit, asyncio.CancelledError):
+        # Consumer went away before the model finished
+        stream_stats.record_abort("bedrock", progress.output_tokens, progress.tokens_saved)
+        raise
+    except Exception as err:
+        stream_stats.record_failure("bedrock", str(err))
+        raise
+    stream_stats.record_complete("bedrock", progress.usage, progress, command["modelId"])
+
+
+async def converse_events(request: ConverseRequest) -> tuple[AsyncIterator[dict], dict]:
+    """Prepare a converse turn, returns its Bedrock event stream and the response headers"""
+    conversation_id = request.conversationId
+    new_messages = request.messages
+    base_length = 0
+    if conversation_id:
+        request.messages, base_length = await conversation_store.prepare(
+            conversation_id, new_messages, request.historyLength)
+
+    _, command = await create_bedrock_command(request)
+    agent = None
+    if request.agentTools:
+        agent = AgentLoop(tool_manager, request.agentTools, request.toolSettings, request.maxAgentSteps)
+        agent.prepare(command)
+    if "toolConfig" not in command and has_tool_blocks(command["messages"]):
+        # Stored history keeps earlier tool turns, Bedrock rejects them without a toolConfig
+        command["messages"] = flatten_tool_blocks(command["messages"])
+    key = cache_key(command) if request.responseCache and response_cache.enabled and not agent else None
+    cached = response_cache.get(key) if key else None
+    if cached is None:
+        admission_controller.check(command["modelId"], request.region)
+
+    def region_events(command):
+        return model_events(command, request.region)
+
+    async def bedrock_events():
+        assembler = MessageAssembler() if conversation_id and not agent else None
+        if cached is not None:
+            events = response_cache.replay(cached)
+        else:
+            events = agent.run(command, region_events) if agent else region_events(command)
+            events = recorded_events(events, command)
+            if key:
+                events = response_cache.record(key, events)
+        async with aclosing(events) as stream:
+            async for item in stream:
+                if assembler:
+                    assembler.feed(item)
+                yield item
+        if assembler and assembler.complete:
+            await conversation_store.commit(
+                conversation_id, base_length, new_messages + [assembler.message()])
+        elif conversation_id and agent and agent.complete:
+            await conversation_store.commit(conversation_id, base_length, new_messages + agent.turn_messages)
+
+    headers = {"X-Conversation-Id": conversation_id} if conversation_id else {}
+    if key:
+        headers["X-Response-Cache"] = "hit" if cached is not None else "miss"
+    return bedrock_events(), headers
+
+
+async def stream_converse(request: ConverseRequest, raw_request: FastAPIRequest, separator: str):
+    try:
+        events, headers = await converse_events(request)
+        events = await primed(events)
+        body, media_type = encode_converse_stream(events, request, raw_request.headers.get("accept"), separator)
+        replay = stream_registry.start(body, media_type, stream_error_encoder(media_type)) \
+            if request.resumable else None
+        if replay is not None:
+            headers["X-Stream-Id"] = replay.stream_id
+            body = replay.subscribe(0)
+        return StreamingResponse(close_on_disconnect(raw_request, body), media_type=media_type, headers=headers)
+
+    except (ConversationConflict, MediaNotCached) as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=409)
+    except AdmissionRejected as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=429,
+                                 headers={"Retry-After": str(int(error.retry_after))})
+    except Exception as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=500)
+
+
 @app.post("/api/converse/v3")
 async def converse_v3(request: ConverseRequest,
+                      raw_request: FastAPIRequest,
                       _: Annotated[str, Depends(verify_api_key)]):
+    return await stream_converse(request, raw_request, '\n\n')
+
+
+@app.post("/api/converse/v2")
+async def converse_v2(request: ConverseRequest,
+                      raw_request: FastAPIRequest,
+                      _: Annotated[str, Depends(verify_api_key)]):
+    return await stream_converse(request, raw_request, '')
+
+
+@app.get("/api/converse/stream/{stream_id}")
+async def resume_converse_stream(stream_id: str,
+                                 raw_request: FastAPIRequest,
+                                 _: Annotated[str, Depends(verify_api_key)],
+                                 offset: int = 0):
+    """Resume a resumable converse stream from the number of bytes already received"""
     try:
-        client, command = await create_bedrock_command(request)
+        body = stream_registry.resume(stream_id, offset)
+    except KeyError as error:
+        raise HTTPException(status_code=404, detail=str(error))
+    except StreamGone as error:
+        raise HTTPException(status_code=410, detail=str(error))
+    media_type = stream_registry.get(stream_id).media_type
+    return StreamingResponse(close_on_disconnect(raw_request, body), media_type=media_type,
+                             headers={"X-Stream-Id": stream_id})
+
+
+@app.delete("/api/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str,
+                              _: Annotated[str, Depends(verify_api_key)]):
+    try:
+        await conversation_store.delete(conversation_id)
+        return {"success": True}
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
 
-        def event_generator():
-            try:
-                response = client.converse_stream(**command)
-                for item in response['stream']:
-                    yield json.dumps(item) + '\n\n'
-            except Exception as err:
-                yield f"Error: {str(err)}"
 
-        return StreamingResponse(event_generator(), media_type="text/event-stream")
+@app.post("/api/converse/v3/multipart")
+async def converse_v3_multipart(raw_request: FastAPIRequest,
+                                api_key: Annotated[str, Depends(verify_api_key)]):
+    try:
+        request = await parse_multipart_converse_request(raw_request)
+    except Exception as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=400)
+    return await converse_v3(request, raw_request, api_key)
+
 
+@app.post("/api/converse/v2/multipart")
+async def converse_v2_multipart(raw_request: FastAPIRequest,
+                                api_key: Annotated[str, Depends(verify_api_key)]):
+    try:
+        request = await parse_multipart_converse_request(raw_request)
+    except Exception as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=400)
+    return await converse_v2(request, raw_request, api_key)
+
+
+async def stream_compare(request: ConverseCompareRequest, raw_request: FastAPIRequest, separator: str):
+    model_ids = list(dict.fromkeys(request.modelIds))
+    if not 0 < len(model_ids) <= FANOUT_MAX_MODELS:
+        return PlainTextResponse(f"Error: modelIds must list 1 to {FANOUT_MAX_MODELS} models", status_code=400)
+    if request.conversationId or request.resumable or request.agentTools:
+        return PlainTextResponse("Error: compare does not support conversationId, resumable or agentTools",
+                                 status_code=400)
+    try:
+        # Decode the uploaded media once, the per-model commands share the decoded blocks
+        decode_media_blocks(request.messages)
+        commands = {}
+        for model_id in model_ids:
+            _, commands[model_id] = await create_bedrock_command(
+                request.model_copy(update={"modelId": model_id}), decode_media=False)
+            admission_controller.check(model_id, request.region)
+
+        def source(command):
+            return lambda: recorded_events(model_events(command, request.region), command)
+
+        events = multiplex({model_id: source(command) for model_id, command in commands.items()})
+        body, media_type = encode_converse_stream(
+            events, request, raw_request.headers.get("accept"), separator, TaggedProjection())
+        return StreamingResponse(close_on_disconnect(raw_request, body), media_type=media_type)
+
+    except MediaNotCached as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=409)
+    except AdmissionRejected as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=429,
+                                 headers={"Retry-After": str(int(error.retry_after))})
     except Exception as error:
         return PlainTextResponse(f"Error: {str(error)}", status_code=500)
 
 
-@app.post("/api/converse/v2")
-async def converse_v2(request: ConverseRequest,
-                      _: Annotated[str, Depends(verify_api_key)]):
+@app.post("/api/converse/compare")
+async def converse_compare(request: ConverseCompareRequest,
+                           raw_request: FastAPIRequest,
+                           _: Annotated[str, Depends(verify_api_key)]):
+    """Stream the answers of several models to the same messages, multiplexed into one response"""
+    return await stream_compare(request, raw_request, '\n\n')
+
+
+@app.post("/api/converse/compare/multipart")
+async def converse_compare_multipart(raw_request: FastAPIRequest,
+                                     api_key: Annotated[str, Depends(verify_api_key)]):
     try:
-        client, command = await create_bedrock_command(request)
+        request = await parse_multipart_converse_request(raw_request, ConverseCompareRequest)
+    except Exception as error:
+        return PlainTextResponse(f"Error: {str(error)}", status_code=400)
+    return await converse_compare(request, raw_request, api_key)
+
+
+async def converse_once(request: ConverseRequest) -> dict:
+    if request.conversationId or request.resumable or request.agentTools:
+        raise ValueError("batch items do not support conversationId, resumable or agentTools")
+    _, command = await create_bedrock_command(request)
+    assembler = MessageAssembler()
+    events = recorded_events(model_events(command, request.region), command)
+    async with aclosing(events) as stream:
+        async for item in stream:
+            assembler.feed(item)
+    return {
+        "message": assembler.message(),
+        "stopReason": assembler.stop_reason,
+        "usage": assembler.usage,
+        "metrics": assembler.metrics
+    }
 
-        def event_generator():
-            try:
-                response = client.converse_stream(**command)
-                for item in response['stream']:
-                    yield json.dumps(item)
-            except Exception as err:
-                yield f"Error: {str(err)}"
 
-        return StreamingResponse(event_generator(), media_type="text/event-stream")
+async def ndjson_stream(lines):
+    async with aclosing(lines):
+        async for line in lines:
+            yield encode_frames([line])
+
+
+@app.post("/api/converse/batch")
+async def converse_batch(request: BatchConverseRequest,
+                         raw_request: FastAPIRequest,
+                         _: Annotated[str, Depends(verify_api_key)]):
+    """Run independent converse requests concurrently, one NDJSON result line per item as it completes"""
+    if not 0 < len(request.items) <= BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"items must contain 1 to {BATCH_MAX_ITEMS} requests")
+    jobs = [(item.id, lambda item=item: converse_once(item)) for item in request.items]
+    body = ndjson_stream(run_batch(jobs))
+    return StreamingResponse(close_on_disconnect(raw_request, body), media_type="application/x-ndjson")
+
+
+def describe_error(error: Exception) -> dict:
+    # The HTTP status a converse or tool request would have answered with
+    if isinstance(error, (ConversationConflict, MediaNotCached)):
+        return {"status": 409, "error": str(error)}
+    if isinstance(error, AdmissionRejected):
+        return {"status": 429, "error": str(error), "retryAfter": error.retry_after}
+    if isinstance(error, ValueError):
+        return {"status": 400, "error": str(error)}
+    return {"status": 500, "error": str(error)}
+
+
+async def ws_converse(payload: dict):
+    request = ConverseRequest.model_validate(payload)
+    if request.resumable:
+        raise ValueError("resumable is not supported over WebSocket")
+    events, headers = await converse_events(request)
+    if headers:
+        yield {"type": "start", "headers": headers}
+    if request.streamMode == 'lean':
+        async with aclosing(lean_frames(events)) as batches:
+            async for frames in batches:
+                yield {"type": "frames", "frames": frames}
+    else:
+        async with aclosing(events) as stream:
+            async for event in stream:
+                yield {"type": "event", "event": event}
+
+
+async def ws_tool(payload: dict):
+    request = ToolExecuteRequest.model_validate(payload)
+    result = await tool_manager.execute_tool(
+        name=request.name,
+        arguments=request.arguments,
+        config=request.config or {}
+    )
+    yield {"type": "result", "result": result}
+
 
+@app.websocket("/api/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """Authenticate once, then run concurrent converse and tool streams tagged by id"""
+    await websocket.accept()
+    try:
+        token = websocket.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not token:
+            message = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+            token = message.get("token", "") if message.get("type") == "auth" else ""
+        if not token or token != await current_api_key():
+            await websocket.close(code=1008, reason="Invalid API Key")
+            return
+    except WebSocketDisconnect:
+        return
     except Exception as error:
-        return PlainTextResponse(f"Error: {str(error)}", status_code=500)
+        await websocket.close(code=1008, reason=f"Authentication failed: {error}"[:120])
+        return
+    await WebSocketSession(websocket, {"converse": ws_converse, "tool": ws_tool}, describe_error).run()
 
 
-@app.post("/api/image")
-async def gen_image(request: ImageRequest,
-                    _: Annotated[str, Depends(verify_api_key)]):
+async def prepare_image_request(request: ImageRequest, prompt: str) -> dict:
+    # Translation and prompt analysis, shared by every image generated from the prompt
     model_id = request.modelId
-    prompt = request.prompt
     ref_images = request.refImages
-    width = request.width
-    height = request.height
-    region = request.region
-    client = boto3.client("bedrock-runtime",
-                          region_name=region)
     if (ref_images is None or model_id.startswith("stability.")) and contains_chinese(prompt):
-        prompt = get_english_prompt(client, prompt)
-    return get_image(client, model_id, prompt, ref_images, width, height)
+        async with credential_pool.lease(request.region) as lease:
+            prompt = await run_in_pool("image", get_english_prompt, await lease.client_async(), prompt)
+    async with credential_pool.lease(request.region) as lease:
+        return await run_in_pool("image", get_native_image_request, await lease.client_async(), model_id, prompt,
+                                 ref_images, request.width, request.height)
+
+
+async def invoke_image(request: ImageRequest, native_request: dict) -> dict:
+    async def invoke():
+        # Each attempt picks the least loaded credential set
+        async with credential_pool.lease(request.region) as lease:
+            return await run_in_pool("image", get_image, await lease.client_async(), request.modelId, native_request)
+
+    try:
+        return await admission_controller.call(request.modelId, request.region, invoke)
+    except Exception as error:
+        return {"error": str(error)}
+
+
+async def generate_image(request: ImageRequest) -> dict:
+    try:
+        resolve_ref_images(request.refImages)
+        native_request = await prepare_image_request(request, request.prompt)
+    except Exception as error:
+        return {"error": str(error)}
+    return await invoke_image(request, native_request)
+
+
+def submit_image_job(request: ImageRequest):
+    try:
+        # Missing media answers 409 like converse, so the client re-uploads it
+        resolve_ref_images(request.refImages)
+    except MediaNotCached as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    try:
+        return image_jobs.submit(lambda: generate_image(request))
+    except JobQueueFull as error:
+        raise HTTPException(status_code=429, detail=str(error), headers={"Retry-After": "5"})
+
+
+@app.post("/api/image")
+async def gen_image(request: ImageRequest,
+                    _: Annotated[str, Depends(verify_api_key)]):
+    # Synchronous form of an image job, it shares the job concurrency limit
+    job = submit_image_job(request)
+    try:
+        await job.wait()
+        if job.status == "succeeded":
+            return job.result
+        return {"error": job.error or f"Image job {job.status}"}
+    finally:
+        # The result goes back inline, nothing will poll for it
+        image_jobs.discard(job)
+
+
+async def image_batch_lines(request: ImageBatchRequest):
+    prompts = request.prompts or [request.prompt]
+    # One preparation per distinct prompt, started right away and awaited by each of its images
+    prepared = {prompt: asyncio.ensure_future(prepare_image_request(request, prompt)) for prompt in set(prompts)}
+
+    async def generate(prompt: str) -> dict:
+        native_request = await prepared[prompt]
+        try:
+            job = image_jobs.submit(lambda: invoke_image(request, native_request))
+        except JobQueueFull as error:
+            raise AdmissionRejected(str(error), retry_after=5)
+        try:
+            await job.wait()
+            if job.status != "succeeded":
+                raise RuntimeError(job.error or f"Image job {job.status}")
+            return job.result
+        finally:
+            # The image is streamed back inline, nothing will poll for it
+            image_jobs.discard(job)
+
+    jobs = [(None, lambda prompt=prompt: generate(prompt)) for prompt in prompts for _ in range(request.count)]
+    try:
+        async with aclosing(run_batch(jobs)) as lines:
+            async for line in lines:
+                yield line
+    finally:
+        for task in prepared.values():
+            task.cancel()
+        await asyncio.gather(*prepared.values(), return_exceptions=True)
+
+
+@app.post("/api/image/batch")
+async def gen_image_batch(request: ImageBatchRequest,
+                          raw_request: FastAPIRequest,
+                          _: Annotated[str, Depends(verify_api_key)]):
+    """Generate count images for each prompt concurrently, one NDJSON line per image as it completes"""
+    if not request.prompts and not request.prompt:
+        raise HTTPException(status_code=400, detail="prompt or prompts is required")
+    total = len(request.prompts or [request.prompt]) * request.count
+    if not 0 < total <= IMAGE_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"A batch must generate 1 to {IMAGE_BATCH_MAX_IMAGES} images")
+    try:
+        resolve_ref_images(request.refImages)
+    except MediaNotCached as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    body = ndjson_stream(image_batch_lines(request))
+    return StreamingResponse(close_on_disconnect(raw_request, body), media_type="application/x-ndjson")
+
+
+@app.post("/api/image/jobs")
+async def submit_image(request: ImageRequest,
+                       _: Annotated[str, Depends(verify_api_key)]):
+    """Queue an image generation, returns the job id to poll or stream"""
+    return submit_image_job(request).to_dict()
+
+
+def find_image_job(job_id: str):
+    job = image_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown image job: {job_id}")
+    return job
+
+
+@app.get("/api/image/jobs/{job_id}")
+async def get_image_job(job_id: str,
+                        _: Annotated[str, Depends(verify_api_key)],
+                        wait: float = 0):
+    """Job status and result; wait > 0 long-polls until the job finishes (at most 30 seconds)"""
+    job = find_image_job(job_id)
+    if wait > 0:
+        await job.wait(min(wait, 30))
+    return image_jobs.collect(job)
+
+
+@app.get("/api/image/jobs/{job_id}/stream")
+async def stream_image_job(job_id: str,
+                           raw_request: FastAPIRequest,
+                           _: Annotated[str, Depends(verify_api_key)]):
+    """NDJSON status updates of a job, ending with the finished job and its result"""
+    job = find_image_job(job_id)
+
+    async def updates():
+        status = None
+        while True:
+            if job.status != status:
+                status = job.status
+                yield encode_frames([image_jobs.collect(job)])
+            if status in IMAGE_JOB_FINISHED:
+                return
+            await job.wait_change()
+
+    return StreamingResponse(close_on_disconnect(raw_request, updates()), media_type="application/x-ndjson")
+
+
+@app.delete("/api/image/jobs/{job_id}")
+async def cancel_image_job(job_id: str,
+                           _: Annotated[str, Depends(verify_api_key)]):
+    job = image_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown image job: {job_id}")
+    await job.wait(5)
+    return image_jobs.collect(job)
+
+
+@app.post("/api/media")
+async def upload_media(raw_request: FastAPIRequest,
+                       _: Annotated[str, Depends(verify_api_key)]):
+    """Upload raw media bytes so later requests can reference them by sha256"""
+    data = await raw_request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty body")
+    return {"sha256": media_cache.put(data), "size": len(data)}
+
+
+@app.post("/api/media/lookup")
+async def lookup_media(request: MediaLookupRequest,
+                       _: Annotated[str, Depends(verify_api_key)]):
+    return {"missing": media_cache.missing(request.hashes)}
 
 
 @app.post("/api/token")
@@ -247,9 +891,11 @@ async def get_token(request: TokenRequest,
         client_role_arn = os.environ.get('CLIENT_ROLE_ARN')
         if not client_role_arn:
             return {"error": "CLIENT_ROLE_ARN environment variable not set"}
-        sts_client = boto3.client('sts', region_name=region)
+        sts_client = await get_client_async('sts', region)
         session_name = f"SwiftChatClient-{int(time.time())}"
-        response = sts_client.assume_role(
+        response = await run_in_pool(
+            "control",
+            sts_client.assume_role,
             RoleArn=client_role_arn,
             RoleSessionName=session_name,
             DurationSeconds=3600
@@ -270,11 +916,10 @@ async def get_token(request: TokenRequest,
 async def get_models(request: ModelsRequest,
                      _: Annotated[str, Depends(verify_api_key)]):
     region = request.region
-    client = boto3.client("bedrock",
-                          region_name=region)
+    client = await get_client_async("bedrock", region)
 
     try:
-        response = client.list_foundation_models()
+        response = await run_in_pool("control", client.list_foundation_models)
         if response.get("modelSummaries"):
             model_names = set()
             text_model = []
@@ -304,6 +949,7 @@ async def get_models(request: ModelsRequest,
                             "modelName": model["modelName"]
                         })
                     model_names.add(model["modelName"])
+            register_inference_profiles(model["modelId"] for model in text_model)
             return {"textModel": text_model, "imageModel": image_model}
         else:
             return []
@@ -315,7 +961,7 @@ async def get_models(request: ModelsRequest,
 @app.post("/api/upgrade")
 async def upgrade(request: UpgradeRequest,
                   _: Annotated[str, Depends(verify_and_refresh_token)]):
-    new_version = get_latest_version()
+    new_version = await run_in_pool("control", get_latest_version)
     total_number = calculate_version_total(request.version)
     need_upgrade = False
     url = ''
@@ -331,41 +977,102 @@ async def upgrade(request: UpgradeRequest,
 
 
 @app.post("/api/openai")
-async def converse_openai(request: GPTRequest, raw_request: FastAPIRequest):
-    auth_header = raw_request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid auth header")
-    openai_api_key = auth_header.split(" ")[1]
-    request_url = raw_request.headers.get("request_url")
-    if not request_url or not request_url.startswith("http"):
-        raise HTTPException(status_code=401, detail="Invalid request url")
+async def converse_openai(request: GPTRequest, raw_request: FastAPIRequest,
+                          credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]):
+    # New clients send the server API key as bearer token and the upstream key in X-Upstream-Api-Key,
+    # older clients send only the upstream key as bearer token
+    upstream_api_key = raw_request.headers.get("X-Upstream-Api-Key")
+    verified = bool(upstream_api_key) or OPENAI_PROXY_REQUIRE_API_KEY
+    if verified:
+        await verify_api_key(credentials)
+    else:
+        upstream_api_key = credentials.credentials
     http_referer = raw_request.headers.get("HTTP-Referer")
     x_title = raw_request.headers.get("X-Title")
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+        **({"HTTP-Referer": http_referer} if http_referer else {}),
+        **({"X-Title": x_title} if x_title else {})
+    }
+
+    group_name = raw_request.headers.get("upstream_group")
+    if group_name:
+        # Upstream keys come from the group config, so the caller must hold the server API key
+        if not verified:
+            await verify_api_key(credentials)
+        group = upstream_groups.get(group_name)
+        if group is None:
+            raise HTTPException(status_code=404, detail=f"Unknown upstream group: {group_name}")
+
+        def upstream_chunks():
+            return group.stream(request.model_dump(), headers)
+    else:
+        request_url = raw_request.headers.get("request_url")
+        if not request_url or not request_url.startswith("http"):
+            raise HTTPException(status_code=401, detail="Invalid request url")
+        if not upstream_api_key:
+            raise HTTPException(status_code=401, detail="Invalid upstream api key")
+
+        async def upstream_chunks():
+            async with upstream_clients.stream(
+                    "POST",
+                    request_url,
+                    json=request.model_dump(),
+                    headers={"Authorization": f"Bearer {upstream_api_key}", **headers}
+            ) as response:
+                async for chunk in response.aiter_bytes():
+                    yield chunk
 
     async def event_generator():
-        async with httpx.AsyncClient() as client:
-            try:
-                async with client.stream(
-                        "POST",
-                        request_url,
-                        json=request.model_dump(),
-                        headers={
-                            "Authorization": f"Bearer {openai_api_key}",
-                            "Content-Type": "application/json",
-                            "Accept": "text/event-stream",
-                            **({"HTTP-Referer": http_referer} if http_referer else {}),
-                            **({"X-Title": x_title} if x_title else {})
-                        }
-                ) as response:
-                    async for line in response.aiter_bytes():
-                        if line:
-                            yield line
-
-            except Exception as err:
-                print("error:", err)
-                yield f"Error: {str(err)}".encode('utf-8')
-
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+        # Usage and timing are parsed from each chunk after it has been forwarded
+        parser = SSEUsageParser()
+        stream_stats.record_start("openai")
+        try:
+            async with aclosing(upstream_chunks()) as chunks:
+                async for line in chunks:
+                    if line:
+                        yield line
+                        parser.feed(line)
+            stream_stats.record_complete("openai", parser.progress.usage, parser.progress,
+                                         parser.model or request.model)
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # Leaving the stream context closes the upstream connection
+            stream_stats.record_abort("openai", parser.progress.output_tokens)
+            raise
+        except Exception as err:
+            print("error:", err)
+            stream_stats.record_failure("openai", str(err))
+            yield f"Error: {str(err)}".encode('utf-8')
+
+    return StreamingResponse(close_on_disconnect(raw_request, event_generator()), media_type="text/event-stream")
+
+
+@app.get("/api/metrics")
+async def get_metrics(_: Annotated[str, Depends(verify_api_key)]):
+    """Worker pool, AWS client, cache and stream statistics"""
+    return {
+        "pools": get_pool_stats(),
+        "clients": client_registry.get_stats(),
+        "conversations": conversation_store.get_stats(),
+        "media": media_cache.get_stats(),
+        "replay": stream_registry.get_stats(),
+        "prompt_cache": prompt_cache_policy.get_stats(),
+        "compaction": context_compactor.get_stats(),
+        "routing": bedrock_router.get_stats(),
+        "admission": admission_controller.get_stats(),
+        "credentials": credential_pool.get_stats(),
+        "agent": agent_stats.get_stats(),
+        "compare": fanout_stats.get_stats(),
+        "batch": batch_stats.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "websocket": websocket_stats.get_stats(),
+        "upstreams": upstream_clients.get_stats(),
+        "upstream_groups": upstream_groups.get_stats(),
+        "image_jobs": image_jobs.get_stats(),
+        "streams": stream_stats.get_stats()
+    }
 
 
 def calculate_version_total(version: str) -> int:
@@ -398,46 +1105,62 @@ def get_latest_version() -> str:
     return '0.0.0'
 
 
-def get_image(client, model_id, prompt, ref_image, width, height):
-    try:
-        seed = random.randint(0, 2147483647)
-        native_request = {}
-        if model_id.startswith("amazon"):
-            if ref_image is None:
-                native_request = {
-                    "taskType": "TEXT_IMAGE",
-                    "textToImageParams": {"text": prompt},
-                    "imageGenerationConfig": {
-                        "numberOfImages": 1,
-                        "quality": "standard",
-                        "cfgScale": 8.0,
-                        "height": height,
-                        "width": width,
-                        "seed": seed,
-                    },
-                }
-            elif len(ref_image) == 2:
-                native_request = get_native_request_with_virtual_try_on(client, prompt, ref_image, width, height)
-            else:
-                native_request = get_native_request_with_ref_image(client, prompt, ref_image, width, height)
-        elif model_id.startswith("stability."):
+def get_native_image_request(client, model_id, prompt, ref_image, width, height):
+    # Prompt analysis for reference images happens here, once per prompt however many images are generated
+    native_request = {}
+    if model_id.startswith("amazon"):
+        if ref_image is None:
             native_request = {
-                "prompt": prompt,
-                "output_format": "jpeg",
-                "mode": "text-to-image",
+                "taskType": "TEXT_IMAGE",
+                "textToImageParams": {"text": prompt},
+                "imageGenerationConfig": {
+                    "numberOfImages": 1,
+                    "quality": "standard",
+                    "cfgScale": 8.0,
+                    "height": height,
+                    "width": width,
+                },
             }
-            if ref_image:
-                native_request['mode'] = 'image-to-image'
-                native_request['image'] = ref_image[0]['source']['bytes']
-                native_request['strength'] = 0.5
-            else:
-                native_request['aspect_ratio'] = "1:1"
-        request = json.dumps(native_request)
+        elif len(ref_image) == 2:
+            native_request = get_native_request_with_virtual_try_on(client, prompt, ref_image, width, height)
+        else:
+            native_request = get_native_request_with_ref_image(client, prompt, ref_image, width, height)
+    elif model_id.startswith("stability."):
+        native_request = {
+            "prompt": prompt,
+            "output_format": "jpeg",
+            "mode": "text-to-image",
+        }
+        if ref_image:
+            native_request['mode'] = 'image-to-image'
+            native_request['image'] = ref_image[0]['source']['bytes']
+            native_request['strength'] = 0.5
+        else:
+            native_request['aspect_ratio'] = "1:1"
+    return native_request
+
+
+def with_random_seed(native_request):
+    # A fresh seed per call, so images generated from the same request differ
+    seed = random.randint(0, 2147483647)
+    if "imageGenerationConfig" in native_request:
+        return {**native_request, "imageGenerationConfig": {**native_request["imageGenerationConfig"], "seed": seed}}
+    if "prompt" in native_request:
+        return {**native_request, "seed": seed}
+    return native_request
+
+
+def get_image(client, model_id, native_request):
+    try:
+        request = json.dumps(with_random_seed(native_request))
         response = client.invoke_model(modelId=model_id, body=request)
         model_response = json.loads(response["body"].read())
         base64_image_data = model_response["images"][0]
         return {"image": base64_image_data}
     except Exception as error:
+        if is_throttling_error(error):
+            # Let admission control back off and retry
+            raise
         error_msg = str(error)
         print(f"Error occurred: {error_msg}")
         return {"error": error_msg}
@@ -0,0 +1 @@
+"""OpenAI-compatible proxy support"""
@@ -0,0 +1,170 @@
+"""
+上游 HTTP 客户端池
+
+功能：/api/openai 按上游主机复用 httpx.AsyncClient，代理请求不再每次重新做 DNS、TCP、TLS 握手
+策略：
+  - 以 (scheme, host, port) 为键，每个上游主机一个客户端，连接保持 keep-alive，支持时使用 HTTP/2
+  - 空闲超过 OPENAI_CLIENT_IDLE_TIMEOUT 的客户端被关闭（有进行中请求的客户端不会被关闭）
+  - 客户端数量不超过 OPENAI_MAX_UPSTREAM_CLIENTS，超出时按 LRU 淘汰最久未使用的客户端；
+    被淘汰的客户端若仍有进行中请求，则在最后一个请求结束后关闭
+  - 客户端池随应用 lifespan 启动与关闭
+配置：
+  - OPENAI_HTTP2：是否启用 HTTP/2（默认 true，需要安装 h2）
+  - OPENAI_MAX_CONNECTIONS：每个上游主机的最大连接数（默认 100）
+  - OPENAI_MAX_KEEPALIVE_CONNECTIONS：每个上游主机保持的空闲连接数（默认 20）
+  - OPENAI_KEEPALIVE_EXPIRY：空闲连接的保持时间，秒（默认 60）
+  - OPENAI_CONNECT_TIMEOUT：连接超时，秒（默认 10）
+  - OPENAI_READ_TIMEOUT：两次读取之间的超时，秒（默认 300）
+  - OPENAI_CLIENT_IDLE_TIMEOUT：客户端空闲多久后关闭，秒（默认 600）
+  - OPENAI_MAX_UPSTREAM_CLIENTS：最多保留的上游主机客户端数（默认 32）
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+import httpx
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # pragma: no cover - h2 为可选依赖，缺少时使用 HTTP/1.1
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+HTTP2 = os.environ.get("OPENAI_HTTP2", "true").lower() == "true" and h2 is not None
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("OPENAI_READ_TIMEOUT", "300"))
+IDLE_TIMEOUT = float(os.environ.get("OPENAI_CLIENT_IDLE_TIMEOUT", "600"))
+MAX_CLIENTS = max(1, int(os.environ.get("OPENAI_MAX_UPSTREAM_CLIENTS", "32")))
+
+HostKey = Tuple[str, str, Optional[int]]
+
+
+class UpstreamClient:
+    def __init__(self, key: HostKey):
+        self.key = key
+        self.client = httpx.AsyncClient(
+            http2=HTTP2,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.http2_responses = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+    def get_stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "http2_responses": self.http2_responses,
+            "idle_for": 0.0 if self.in_flight else round(time.monotonic() - self.last_used, 1)
+        }
+
+
+class UpstreamClientPool:
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, max_clients: int = MAX_CLIENTS):
+        self.idle_timeout = idle_timeout
+        self.max_clients = max_clients
+        # 按最近使用排序，最久未使用的在最前
+        self._clients: "OrderedDict[HostKey, UpstreamClient]" = OrderedDict()
+        self._evictor: Optional[asyncio.Task] = None
+        self.created = 0
+        self.evicted = 0
+
+    @staticmethod
+    def host_key(url: str) -> HostKey:
+        parsed = httpx.URL(url)
+        return parsed.scheme, parsed.host, parsed.port
+
+    async def _client(self, url: str) -> UpstreamClient:
+        key = self.host_key(url)
+        upstream = self._clients.get(key)
+        if upstream is not None:
+            self._clients.move_to_end(key)
+            return upstream
+        upstream = self._clients[key] = UpstreamClient(key)
+        self.created += 1
+        while len(self._clients) > self.max_clients:
+            _, lru = self._clients.popitem(last=False)
+            await self._retire(lru)
+        return upstream
+
+    async def _retire(self, upstream: UpstreamClient):
+        """淘汰客户端：空闲则立即关闭，否则等进行中的请求结束后关闭"""
+        upstream.retired = True
+        self.evicted += 1
+        if upstream.in_flight == 0:
+            await upstream.client.aclose()
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """通过该主机的共享客户端发起流式请求"""
+        upstream = await self._client(url)
+        upstream.in_flight += 1
+        upstream.requests += 1
+        try:
+            async with upstream.client.stream(method, url, **kwargs) as response:
+                if response.http_version == "HTTP/2":
+                    upstream.http2_responses += 1
+                yield response
+        finally:
+            upstream.in_flight -= 1
+            upstream.last_used = time.monotonic()
+            if upstream.retired and upstream.in_flight == 0:
+                await upstream.client.aclose()
+
+    async def evict_idle(self):
+        """关闭空闲超时的客户端"""
+        now = time.monotonic()
+        idle = [key for key, upstream in self._clients.items()
+                if upstream.in_flight == 0 and now - upstream.last_used > self.idle_timeout]
+        for key in idle:
+            await self._retire(self._clients.pop(key))
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout))
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.warning(f"Failed to evict idle upstream clients: {e}")
+
+    def start(self):
+        if self._evictor is None:
+            self._evictor = asyncio.ensure_future(self._evict_loop())
+
+    async def close(self):
+        if self._evictor is not None:
+            self._evictor.cancel()
+            self._evictor = None
+        clients, self._clients = list(self._clients.values()), OrderedDict()
+        for upstream in clients:
+            await upstream.client.aclose()
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {
+            "http2": HTTP2,
+            "max_clients": self.max_clients,
+            "created": self.created,
+            "evicted": self.evicted,
+            "hosts": {
+                f"{scheme}://{host}" + (f":{port}" if port else ""): upstream.get_stats()
+                for (scheme, host, port), upstream in self._clients.items()
+            }
+        }
+
+
+upstream_clients = UpstreamClientPool()
@@ -0,0 +1,70 @@
+"""
+OpenAI SSE 流的增量解析
+
+功能：在 /api/openai 透传路径上旁路解析 chat completions 的 SSE 流，提取 usage、首 token 时间与生成速度，
+      写入与 Bedrock 流相同的 StreamStats
+原理：
+  - 每个 chunk 原样转发后再解析，不延迟、不重新缓冲转发的数据
+  - 只保留未结束的半行，完整的 data: 行按 JSON 解析，解析失败的行被忽略
+  - 内容增量（content、reasoning_content、reasoning、tool_calls 参数）与 usage 转换为
+    Bedrock 形式的事件交给 StreamProgress，两种来源的统计口径一致
+  - 上游未返回 usage 时按输出字符数估算 token
+"""
+import json
+from typing import Optional
+from stream_stats import StreamProgress
+
+# 半行缓冲的上限，超出时丢弃（非 SSE 响应或异常的超长行）
+_MAX_PENDING = 1024 * 1024
+
+
+def bedrock_usage(usage: dict) -> dict:
+    """OpenAI usage -> Bedrock usage 字段"""
+    converted = {
+        "inputTokens": usage.get("prompt_tokens") or 0,
+        "outputTokens": usage.get("completion_tokens") or 0,
+        "totalTokens": usage.get("total_tokens") or 0
+    }
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached:
+        converted["cacheReadInputTokens"] = cached
+    return converted
+
+
+class SSEUsageParser:
+    def __init__(self, progress: Optional[StreamProgress] = None):
+        self.progress = progress or StreamProgress()
+        self.model: Optional[str] = None
+        self._pending = b""
+
+    def feed(self, chunk: bytes):
+        """解析一段透传的字节"""
+        data = self._pending + chunk
+        lines = data.split(b"\n")
+        self._pending = lines.pop()
+        if len(self._pending) > _MAX_PENDING:
+            self._pending = b""
+        for line in lines:
+            line = line.strip()
+            if line.startswith(b"data:"):
+                self._feed_data(line[5:].strip())
+
+    def _feed_data(self, payload: bytes):
+        if not payload or payload == b"[DONE]":
+            return
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        self.model = self.model or message.get("model")
+        for choice in message.get("choices") or []:
+            delta = choice.get("delta") or {}
+            text = "".join(delta.get(key) or "" for key in ("content", "reasoning_content", "reasoning"))
+            for tool_call in delta.get("tool_calls") or []:
+                text += (tool_call.get("function") or {}).get("arguments") or ""
+            if text:
+                self.progress.feed({"contentBlockDelta": {"delta": {"text": text}}})
+        if message.get("usage"):
+            self.progress.feed({"metadata": {"usage": bedrock_usage(message["usage"])}})
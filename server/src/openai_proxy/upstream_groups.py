@@ -0,0 +1,213 @@
+"""
+上游分组（负载均衡与故障转移）
+
+功能：把多个等价的 OpenAI 兼容端点配置为一个命名分组，/api/openai 按观测到的延迟与错误率在组内选择端点，
+      代理流量不再受单个服务商的尾延迟影响
+选择：
+  - 每个端点维护首字节时间（TTFB）与错误率的指数加权移动平均（EWMA）
+  - 得分 = TTFB × (1 + 错误率惩罚 × 错误率) × (1 + 进行中请求数)，选得分最低的端点；尚无样本的端点优先尝试
+  - 失败的端点暂时跳过，连续失败时跳过时间加倍（最多 8 倍）
+故障转移：首字节之前出现连接错误、超时、429 或 5xx 时改用下一个端点；首字节之后的错误直接返回给客户端
+配置：OPENAI_UPSTREAM_GROUPS，JSON 对象或 JSON 文件路径
+    {
+      "gpt-4o": [
+        {"name": "openai", "url": "https://api.openai.com/v1/chat/completions", "apiKey": "sk-..."},
+        {"name": "openrouter", "url": "https://openrouter.ai/api/v1/chat/completions", "apiKey": "sk-or-...",
+         "model": "openai/gpt-4o", "headers": {"X-Title": "SwiftChat"}}
+      ]
+    }
+  - model：替换请求中的模型名（各服务商的模型名不同时使用）
+  - OPENAI_UPSTREAM_TTFB_TIMEOUT：等待首字节的最长时间，秒（默认 20）
+  - OPENAI_UPSTREAM_MAX_ATTEMPTS：每个请求最多尝试的端点数（默认 3）
+  - OPENAI_UPSTREAM_EWMA_ALPHA：EWMA 的平滑系数（默认 0.3）
+  - OPENAI_UPSTREAM_COOLDOWN：端点失败后的跳过时间，秒（默认 10）
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional
+from openai_proxy.client_pool import upstream_clients
+
+logger = logging.getLogger(__name__)
+
+GROUPS_CONFIG = os.environ.get("OPENAI_UPSTREAM_GROUPS", "")
+TTFB_TIMEOUT = float(os.environ.get("OPENAI_UPSTREAM_TTFB_TIMEOUT", "20"))
+MAX_ATTEMPTS = int(os.environ.get("OPENAI_UPSTREAM_MAX_ATTEMPTS", "3"))
+EWMA_ALPHA = float(os.environ.get("OPENAI_UPSTREAM_EWMA_ALPHA", "0.3"))
+COOLDOWN = float(os.environ.get("OPENAI_UPSTREAM_COOLDOWN", "10"))
+
+# 错误率为 100% 时得分放大的倍数
+_ERROR_PENALTY = 10.0
+_MAX_COOLDOWN_FACTOR = 8
+
+
+class UpstreamError(Exception):
+    """首字节之前的可重试错误"""
+
+
+class UpstreamUnavailable(Exception):
+    """分组内所有端点都失败"""
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+async def first_chunk(chunks: AsyncIterator[bytes]) -> bytes:
+    async for chunk in chunks:
+        if chunk:
+            return chunk
+    return b""
+
+
+class Upstream:
+    def __init__(self, name: str, url: str, api_key: Optional[str] = None, model: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.headers = headers or {}
+        self.ttfb: Optional[float] = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    @classmethod
+    def from_config(cls, index: int, entry: dict) -> "Upstream":
+        return cls(
+            name=entry.get("name") or f"upstream-{index}",
+            url=entry["url"],
+            api_key=entry.get("apiKey"),
+            model=entry.get("model"),
+            headers=entry.get("headers")
+        )
+
+    def score(self) -> float:
+        if self.ttfb is None:
+            return 0.0
+        return self.ttfb * (1 + _ERROR_PENALTY * self.error_rate) * (1 + self.in_flight)
+
+    def record_success(self, ttfb: float):
+        self.ttfb = ttfb if self.ttfb is None else EWMA_ALPHA * ttfb + (1 - EWMA_ALPHA) * self.ttfb
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures += 1
+        factor = min(_MAX_COOLDOWN_FACTOR, 2 ** (self.consecutive_failures - 1))
+        self.down_until = time.monotonic() + COOLDOWN * factor
+
+    def get_stats(self) -> Dict:
+        return {
+            "ttfb_ms": round(self.ttfb * 1000) if self.ttfb is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "down_for": round(max(0.0, self.down_until - time.monotonic()), 1)
+        }
+
+
+class UpstreamGroup:
+    def __init__(self, name: str, upstreams: List[Upstream]):
+        self.name = name
+        self.upstreams = upstreams
+        self.requests = 0
+        self.failovers = 0
+
+    def ranked(self) -> List[Upstream]:
+        """按得分排序的端点，跳过中的端点排在最后"""
+        now = time.monotonic()
+        return sorted(self.upstreams, key=lambda u: (u.down_until > now, u.score()))
+
+    async def stream(self, payload: dict, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        """选择端点转发请求，首字节之前失败时改用下一个端点"""
+        self.requests += 1
+        errors = []
+        for attempt, upstream in enumerate(self.ranked()[:MAX_ATTEMPTS]):
+            if attempt:
+                self.failovers += 1
+            body = {**payload, "model": upstream.model} if upstream.model else payload
+            request_headers = {**headers, **upstream.headers}
+            if upstream.api_key:
+                request_headers["Authorization"] = f"Bearer {upstream.api_key}"
+            upstream.in_flight += 1
+            upstream.requests += 1
+            committed = False
+            start = time.monotonic()
+            try:
+                async with upstream_clients.stream("POST", upstream.url, json=body,
+                                                   headers=request_headers) as response:
+                    if is_retryable_status(response.status_code):
+                        raise UpstreamError(f"HTTP {response.status_code}")
+                    chunks = response.aiter_bytes()
+                    try:
+                        chunk = await asyncio.wait_for(first_chunk(chunks), TTFB_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        raise UpstreamError(f"No response within {TTFB_TIMEOUT:.0f}s")
+                    upstream.record_success(time.monotonic() - start)
+                    committed = True
+                    yield chunk
+                    async for chunk in chunks:
+                        if chunk:
+                            yield chunk
+                return
+            except Exception as error:
+                upstream.record_failure()
+                if committed:
+                    raise
+                logger.info(f"Upstream {upstream.name} of group {self.name} failed before first byte: {error}")
+                errors.append(f"{upstream.name}: {error}")
+            finally:
+                upstream.in_flight -= 1
+        raise UpstreamUnavailable(f"All upstreams of group {self.name} failed ({'; '.join(errors)})")
+
+    def get_stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "failovers": self.failovers,
+            "upstreams": {upstream.name: upstream.get_stats() for upstream in self.upstreams}
+        }
+
+
+class UpstreamGroups:
+    def __init__(self, groups: Optional[Dict[str, UpstreamGroup]] = None):
+        self.groups = groups or {}
+
+    @classmethod
+    def from_config(cls, config: str = GROUPS_CONFIG) -> "UpstreamGroups":
+        if not config:
+            return cls()
+        try:
+            if config.lstrip().startswith("{"):
+                entries = json.loads(config)
+            else:
+                with open(config, encoding="utf-8") as f:
+                    entries = json.load(f)
+            groups = {
+                name: UpstreamGroup(name, [Upstream.from_config(i, entry) for i, entry in enumerate(upstreams)])
+                for name, upstreams in entries.items()
+            }
+            logger.info(f"Loaded {len(groups)} upstream groups")
+            return cls(groups)
+        except Exception as e:
+            logger.error(f"Invalid OPENAI_UPSTREAM_GROUPS, upstream groups disabled: {e}")
+            return cls()
+
+    def get(self, name: str) -> Optional[UpstreamGroup]:
+        return self.groups.get(name)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        return {name: group.get_stats() for name, group in self.groups.items()}
+
+
+upstream_groups = UpstreamGroups.from_config()
@@ -0,0 +1,182 @@
+"""
+Stream Statistics - 流式对话统计
+"""
+from collections import deque
+from typing import Dict, Optional
+import time
+
+# 每个模型保留的最近延迟样本数
+_SAMPLES = 200
+
+
+class StreamProgress:
+    """单个流的进度，用于估算中断时已生成和节省的 token，以及首 token 时间与生成速度"""
+
+    def __init__(self, max_tokens: int = 0):
+        self.max_tokens = max_tokens
+        self.output_chars = 0
+        self.usage: Optional[dict] = None
+        self.completed = False
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def feed(self, event: dict):
+        if "contentBlockDelta" in event:
+            delta = event["contentBlockDelta"]["delta"]
+            chars = self.output_chars
+            if "text" in delta:
+                self.output_chars += len(delta["text"])
+            elif "reasoningContent" in delta:
+                self.output_chars += len(delta["reasoningContent"].get("text", ""))
+            elif "toolUse" in delta:
+                self.output_chars += len(delta["toolUse"].get("input", ""))
+            if self.first_token_at is None and self.output_chars > chars:
+                self.first_token_at = time.monotonic()
+        elif "metadata" in event:
+            self.usage = event["metadata"].get("usage")
+            self.completed = True
+            self.finished_at = time.monotonic()
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """首 token 时间，秒"""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """首 token 之后的输出速度"""
+        if self.first_token_at is None:
+            return None
+        duration = (self.finished_at or time.monotonic()) - self.first_token_at
+        if duration <= 0 or self.output_tokens <= 1:
+            return None
+        return self.output_tokens / duration
+
+    @property
+    def output_tokens(self) -> int:
+        if self.usage:
+            return self.usage.get("outputTokens", 0)
+        # 约 4 个字符一个 token
+        return self.output_chars // 4
+
+    @property
+    def tokens_saved(self) -> int:
+        """中断后未生成的 token 上限（maxTokens 减去已生成部分）"""
+        return max(0, self.max_tokens - self.output_tokens)
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class LatencySamples:
+    """单个模型最近的首 token 时间与生成速度"""
+
+    def __init__(self):
+        self.completed = 0
+        self.output_tokens = 0
+        self.ttft = deque(maxlen=_SAMPLES)
+        self.tokens_per_second = deque(maxlen=_SAMPLES)
+
+    def add(self, output_tokens: int, ttft: Optional[float], tokens_per_second: Optional[float]):
+        self.completed += 1
+        self.output_tokens += output_tokens
+        if ttft is not None:
+            self.ttft.append(ttft * 1000)
+        if tokens_per_second is not None:
+            self.tokens_per_second.append(tokens_per_second)
+
+    def get_stats(self) -> Dict:
+        stats = {"completed": self.completed, "output_tokens": self.output_tokens}
+        if self.ttft:
+            stats["ttft_ms"] = {
+                "avg": round(sum(self.ttft) / len(self.ttft)),
+                "p50": round(_percentile(self.ttft, 0.5)),
+                "p95": round(_percentile(self.ttft, 0.95))
+            }
+        if self.tokens_per_second:
+            stats["tokens_per_second"] = {
+                "avg": round(sum(self.tokens_per_second) / len(self.tokens_per_second), 1),
+                "p50": round(_percentile(self.tokens_per_second, 0.5), 1)
+            }
+        return stats
+
+
+class StreamStats:
+    def __init__(self):
+        self.stats = {}
+        self.models: Dict[str, Dict[str, LatencySamples]] = {}
+
+    def _get(self, source: str) -> Dict:
+        if source not in self.stats:
+            self.stats[source] = {
+                "started": 0,
+                "completed": 0,
+                "failed": 0,
+                "aborted": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cache_read_input_tokens": 0,
+                "cache_write_input_tokens": 0,
+                "aborted_output_tokens": 0,
+                "tokens_saved": 0,
+                "errors": []
+            }
+        return self.stats[source]
+
+    def record_start(self, source: str):
+        """记录流开始"""
+        self._get(source)["started"] += 1
+
+    def record_complete(self, source: str, usage: Optional[dict] = None,
+                        progress: Optional[StreamProgress] = None, model: Optional[str] = None):
+        """记录流正常结束；传入 progress 与 model 时按模型记录首 token 时间与生成速度"""
+        stats = self._get(source)
+        stats["completed"] += 1
+        if usage:
+            stats["input_tokens"] += usage.get("inputTokens", 0)
+            stats["output_tokens"] += usage.get("outputTokens", 0)
+            stats["cache_read_input_tokens"] += usage.get("cacheReadInputTokens", 0)
+            stats["cache_write_input_tokens"] += usage.get("cacheWriteInputTokens", 0)
+        if progress is not None and model:
+            samples = self.models.setdefault(source, {}).setdefault(model, LatencySamples())
+            samples.add(progress.output_tokens, progress.ttft, progress.tokens_per_second)
+
+    def record_failure(self, source: str, error: str):
+        """记录流失败"""
+        stats = self._get(source)
+        stats["failed"] += 1
+        stats["errors"].append({
+            "error": error,
+            "timestamp": time.time()
+        })
+
+        # 只保留最近10个错误
+        if len(stats["errors"]) > 10:
+            stats["errors"] = stats["errors"][-10:]
+
+    def record_abort(self, source: str, output_tokens: int = 0, tokens_saved: int = 0):
+        """记录客户端断开导致的中断"""
+        stats = self._get(source)
+        stats["aborted"] += 1
+        stats["aborted_output_tokens"] += output_tokens
+        stats["tokens_saved"] += tokens_saved
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        result = {}
+        for source, stats in self.stats.items():
+            finished = stats["completed"] + stats["failed"] + stats["aborted"]
+            result[source] = {
+                **stats,
+                "active": stats["started"] - finished
+            }
+            if source in self.models:
+                result[source]["models"] = {
+                    model: samples.get_stats() for model, samples in self.models[source].items()
+                }
+        return result
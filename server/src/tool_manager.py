@@ -2,7 +2,7 @@
 Tool Manager - 统一管理所有工具
 """
 import time
-from typing import Dict, Any
+from typing import Dict, Any, List
 from builtin_tools import BuiltInTools
 from tool_stats import ToolStats
 from mcp_integration.manager import MCPManager
@@ -56,6 +56,32 @@ class ToolManager:
             self.stats.record_failure(name, str(e))
             raise
     
+    def list_tool_specs(self) -> List[Dict[str, Any]]:
+        """可供模型调用的工具（名称、描述、输入 JSON Schema）"""
+        specs = [
+            {
+                "name": "web_fetch",
+                "description": "Fetch and extract content from a web URL. Returns the main text content of the page.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "url": {"type": "string", "description": "The URL to fetch content from"}
+                    },
+                    "required": ["url"]
+                }
+            }
+        ]
+        for server_id, server in self.mcp_manager.servers.items():
+            if server["status"] != "active":
+                continue
+            for tool in server.get("tools", []):
+                specs.append({
+                    "name": f"mcp:{server_id}:{tool['name']}",
+                    "description": f"[{server['config']['name']}] {tool.get('description', '')}",
+                    "inputSchema": tool.get("inputSchema") or {"type": "object", "properties": {}}
+                })
+        return specs
+
     def get_stats(self) -> Dict:
         """获取统计信息"""
         return self.stats.get_stats()
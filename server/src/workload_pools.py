@@ -0,0 +1,121 @@
+"""
+Workload Pools - 按工作负载隔离的线程池
+
+每类阻塞工作使用独立、有界的线程池，长时间的 Bedrock 流不会占满
+AnyIO 默认线程池，从而拖慢 /api/models、/api/token 等短请求。
+
+线程池大小可通过环境变量配置：POOL_<NAME>_SIZE，例如 POOL_CHAT_STREAM_SIZE
+chat_stream 的每个线程在读流期间占用一个 AWS 连接，默认大小与连接池（AWS_MAX_POOL_CONNECTIONS）一致，
+两者一起调整，避免读流线程排队等待连接
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# 每个共享 AWS 客户端的 HTTP 连接池大小，client_registry 也从这里读取
+MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "100"))
+
+POOL_DEFAULTS = {
+    "chat_stream": MAX_POOL_CONNECTIONS,   # Bedrock 事件流读取（每个流占用一个线程和一个连接）
+    "image": 8,            # 图片生成 invoke_model
+    "html_parse": 4,       # web_fetch 的 HTML 解析与 AI 总结
+    "summary": 4,          # 上下文压缩时的历史总结
+    "storage": 8,          # SSM / 本地磁盘等存储 I/O
+    "control": 16,         # 模型列表、STS 等短小的控制面调用
+}
+
+
+class WorkloadPool:
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"pool-{name}"
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """提交任务，返回 concurrent.futures.Future"""
+        submitted_at = time.monotonic()
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self.total_wait += time.monotonic() - submitted_at
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        future = self._executor.submit(run)
+
+        def on_done(f: Future):
+            # 排队中被取消的任务不会执行 run()
+            if f.cancelled():
+                with self._lock:
+                    self.queued -= 1
+
+        future.add_done_callback(on_done)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行阻塞函数并等待结果"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait": round(self.total_wait / started, 4) if started else 0
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+pools: Dict[str, WorkloadPool] = {
+    name: WorkloadPool(name, int(os.environ.get(f"POOL_{name.upper()}_SIZE", default)))
+    for name, default in POOL_DEFAULTS.items()
+}
+
+
+def get_pool(name: str) -> WorkloadPool:
+    if name not in pools:
+        raise ValueError(f"Unknown workload pool: {name}")
+    return pools[name]
+
+
+async def run_in_pool(name: str, fn: Callable, *args, **kwargs) -> Any:
+    """在指定工作负载的线程池中执行阻塞函数"""
+    return await get_pool(name).run(fn, *args, **kwargs)
+
+
+def get_pool_stats() -> Dict:
+    return {name: pool.get_stats() for name, pool in pools.items()}
@@ -0,0 +1,6 @@
+"""测试公共配置：服务端代码位于 src/，按部署时的方式直接导入"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,72 @@
+"""测试用的 Bedrock Runtime 替身：按 (区域, 模型) 返回事件或抛出错误"""
+from typing import Dict, List, Tuple
+from botocore.exceptions import ClientError
+from bedrock_integration.credential_pool import CredentialSet
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "ConverseStream")
+
+
+def throttle() -> ClientError:
+    return client_error("ThrottlingException")
+
+
+def make_events(text: str = "hello") -> List[dict]:
+    return [
+        {"messageStart": {"role": "assistant"}},
+        {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": text}}},
+        {"contentBlockStop": {"contentBlockIndex": 0}},
+        {"messageStop": {"stopReason": "end_turn"}},
+        {"metadata": {"usage": {"inputTokens": 1, "outputTokens": 1, "totalTokens": 2}}},
+    ]
+
+
+class FakeEventStream:
+    def __init__(self, events: List[dict]):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrock:
+    """converse_stream 按 (区域, 模型) 查表；值为异常、事件列表，或每次调用时返回两者之一的函数"""
+
+    def __init__(self, region: str, behaviour: Dict[Tuple[str, str], object]):
+        self.region = region
+        self.behaviour = behaviour
+        self.calls: List[Tuple[str, str]] = []
+
+    def converse_stream(self, **command):
+        key = (self.region, command["modelId"])
+        self.calls.append(key)
+        outcome = self.behaviour.get(key, make_events())
+        if callable(outcome):
+            outcome = outcome()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return {"stream": FakeEventStream(outcome)}
+
+
+class FakeCredentialSet(CredentialSet):
+    """不创建 boto3 客户端，所有区域共用一张行为表"""
+
+    def __init__(self, name: str, behaviour: Dict[Tuple[str, str], object], **kwargs):
+        super().__init__(name, **kwargs)
+        self.behaviour = behaviour
+        self.clients: Dict[str, FakeBedrock] = {}
+
+    def client(self, service: str, region: str):
+        return self.clients.setdefault(region, FakeBedrock(region, self.behaviour))
+
+    async def client_async(self, service: str, region: str):
+        return self.client(service, region)
+
+    @property
+    def requests(self) -> List[Tuple[str, str]]:
+        return [call for client in self.clients.values() for call in client.calls]
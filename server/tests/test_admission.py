@@ -0,0 +1,99 @@
+"""准入控制：限流后的重试、AdmissionRejected（429）与 AIMD 并发上限"""
+import asyncio
+import pytest
+from botocore.exceptions import ClientError
+from bedrock_integration import admission
+from bedrock_integration.admission import AdmissionController, AdmissionLimiter, AdmissionRejected
+from fakes import client_error, make_events, throttle
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(admission, "backoff_delay", lambda attempt: 0)
+
+
+def upstream(outcomes: list):
+    """每次调用依次取一个结果：异常在首个事件前抛出，"partial" 在首个事件后抛出限流"""
+    def make_events_once():
+        outcome = outcomes.pop(0)
+
+        async def events():
+            if isinstance(outcome, Exception):
+                raise outcome
+            for event in make_events():
+                yield event
+                if outcome == "partial":
+                    raise throttle()
+        return events()
+    return make_events_once
+
+
+async def collect(controller: AdmissionController, outcomes: list) -> list:
+    stream = controller.stream("model", "us-east-1", 100, upstream(outcomes))
+    return [event async for event in stream]
+
+
+def test_throttle_before_first_event_is_retried():
+    controller = AdmissionController(max_retries=2)
+    events = asyncio.run(collect(controller, [throttle(), "ok"]))
+    assert events == make_events()
+    limiter = controller.limiter("model", "us-east-1")
+    assert (limiter.retries, limiter.throttled, limiter.in_flight) == (1, 1, 0)
+
+
+def test_exhausted_retries_raise_admission_rejected():
+    controller = AdmissionController(max_retries=1)
+    with pytest.raises(AdmissionRejected) as raised:
+        asyncio.run(collect(controller, [throttle(), throttle()]))
+    assert "after 1 retries" in str(raised.value)
+    assert raised.value.retry_after >= 1
+    assert isinstance(raised.value.__cause__, ClientError)
+    assert controller.limiter("model", "us-east-1").in_flight == 0
+
+
+def test_throttle_after_first_event_is_not_retried():
+    controller = AdmissionController(max_retries=2)
+    with pytest.raises(ClientError, match="ThrottlingException"):
+        asyncio.run(collect(controller, ["partial", "ok"]))
+    assert controller.limiter("model", "us-east-1").retries == 0
+
+
+def test_other_errors_propagate_unchanged():
+    controller = AdmissionController(max_retries=2)
+    with pytest.raises(ClientError, match="ValidationException"):
+        asyncio.run(collect(controller, [client_error("ValidationException")]))
+    assert controller.limiter("model", "us-east-1").throttled == 0
+
+
+def test_queue_wait_times_out():
+    async def scenario():
+        limiter = AdmissionLimiter(("model", "us-east-1"))
+        limiter.limit = 1.0
+        held = await limiter.acquire()
+        try:
+            await limiter.acquire(max_wait=0.05)
+        finally:
+            held.release()
+
+    with pytest.raises(AdmissionRejected, match="Timed out"):
+        asyncio.run(scenario())
+
+
+def test_full_queue_rejects_immediately(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUE", 0)
+    controller = AdmissionController()
+    with pytest.raises(AdmissionRejected, match="Too many queued"):
+        controller.check("model", "us-east-1")
+    assert controller.limiter("model", "us-east-1").rejected == 1
+
+
+def test_one_wave_of_throttles_halves_the_limit_once():
+    async def scenario():
+        limiter = AdmissionLimiter(("model", "us-east-1"))
+        tickets = [await limiter.acquire() for _ in range(4)]
+        tickets[0].release(throttled=True)
+        first = limiter.limit
+        tickets[1].release(throttled=True)
+        return first, limiter.limit
+
+    assert asyncio.run(scenario()) == (2.0, 2.0)
@@ -0,0 +1,103 @@
+"""服务端工具循环：工具失败、步数上限与无 toolConfig 时的历史转换"""
+import asyncio
+from bedrock_integration.agent_loop import AgentLoop, flatten_tool_blocks, has_tool_blocks
+
+
+class Tools:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+
+    def list_tool_specs(self):
+        return [{"name": "web_fetch", "description": "Fetch a URL", "inputSchema": {"type": "object"}}]
+
+    async def execute_tool(self, name, arguments, config):
+        self.calls.append((name, arguments))
+        if self.fail:
+            raise RuntimeError("network down")
+        return {"content": "page"}
+
+
+def tool_call_events(tool_use_id: str) -> list:
+    return [
+        {"messageStart": {"role": "assistant"}},
+        {"contentBlockStart": {"contentBlockIndex": 0,
+                               "start": {"toolUse": {"toolUseId": tool_use_id, "name": "web_fetch"}}}},
+        {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"toolUse": {"input": '{"url": "https://a"}'}}}},
+        {"contentBlockStop": {"contentBlockIndex": 0}},
+        {"messageStop": {"stopReason": "tool_use"}},
+        {"metadata": {"usage": {"inputTokens": 10, "outputTokens": 5}}},
+    ]
+
+
+def answer_events() -> list:
+    return [
+        {"messageStart": {"role": "assistant"}},
+        {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": "done"}}},
+        {"contentBlockStop": {"contentBlockIndex": 0}},
+        {"messageStop": {"stopReason": "end_turn"}},
+        {"metadata": {"usage": {"inputTokens": 20, "outputTokens": 2}}},
+    ]
+
+
+def run_loop(agent: AgentLoop, steps: list) -> tuple[list, list]:
+    commands = []
+
+    async def call_model(command):
+        commands.append(command)
+        for event in steps[len(commands) - 1]:
+            yield event
+
+    async def collect():
+        command = {"modelId": "model", "messages": [{"role": "user", "content": [{"text": "hi"}]}]}
+        agent.prepare(command)
+        return [event async for event in agent.run(command, call_model)]
+    return asyncio.run(collect()), commands
+
+
+def test_tool_error_is_returned_to_the_model():
+    tools = Tools(fail=True)
+    agent = AgentLoop(tools, ["web_fetch"])
+    events, commands = run_loop(agent, [tool_call_events("t1"), answer_events()])
+
+    tool_result = commands[1]["messages"][-1]["content"][0]["toolResult"]
+    assert tool_result["status"] == "error" and "network down" in tool_result["content"][0]["text"]
+    progress = [event["toolProgress"]["status"] for event in events if "toolProgress" in event]
+    assert progress == ["running", "error"]
+    # 第二步的内容块序号接在第一步之后
+    assert [event["contentBlockDelta"]["contentBlockIndex"] for event in events if "contentBlockDelta" in event] \
+        == [0, 1]
+    assert events[-1]["metadata"]["usage"] == {"inputTokens": 30, "outputTokens": 7}
+    assert agent.complete
+
+
+def test_max_steps_leaves_the_turn_incomplete():
+    agent = AgentLoop(Tools(), ["web_fetch"], max_steps=2)
+    events, commands = run_loop(agent, [tool_call_events("t1"), tool_call_events("t2")])
+    assert len(commands) == 2
+    assert not agent.complete
+    assert [event for event in events if "messageStop" in event] == [{"messageStop": {"stopReason": "tool_use"}}]
+
+
+def test_no_matching_tools_adds_no_tool_config():
+    command = {"messages": []}
+    AgentLoop(Tools(), ["mcp:*"]).prepare(command)
+    assert "toolConfig" not in command
+
+
+def test_flatten_tool_blocks_copies_only_changed_messages():
+    plain = {"role": "user", "content": [{"text": "hi"}]}
+    call = {"role": "assistant", "content": [
+        {"toolUse": {"toolUseId": "t1", "name": "web_fetch", "input": {"url": "https://a"}}}]}
+    image = {"image": {"format": "png", "source": {"bytes": b"png"}}}
+    result = {"role": "user", "content": [
+        {"toolResult": {"toolUseId": "t1", "status": "error", "content": [{"text": "failed"}, image]}}]}
+    messages = [plain, call, result]
+
+    flattened = flatten_tool_blocks(messages)
+
+    assert has_tool_blocks(messages) and not has_tool_blocks(flattened)
+    assert flattened[0] is plain
+    assert flattened[1]["content"] == [{"text": '[Tool call web_fetch: {"url": "https://a"}]'}]
+    assert flattened[2]["content"] == [{"text": "[Tool result (error): failed]"}, image]
+    assert "toolUse" in call["content"][0]
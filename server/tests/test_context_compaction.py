@@ -0,0 +1,71 @@
+"""上下文压缩：预算内不压缩、会话切分点沿用与只在需要时计算哈希"""
+import asyncio
+import pytest
+from bedrock_integration import context_compaction
+from bedrock_integration.context_compaction import ContextCompactor
+
+MODEL = "anthropic.claude-3-7-sonnet-20250219-v1:0"
+
+
+def conversation(turns: int) -> list:
+    messages = []
+    for index in range(turns):
+        messages.append({"role": "user", "content": [{"text": f"q{index} " + "x" * 800}]})
+        messages.append({"role": "assistant", "content": [{"text": f"a{index} " + "y" * 800}]})
+    return messages + [{"role": "user", "content": [{"text": "final"}]}]
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """记录每次计算哈希时覆盖的消息数"""
+    counts = []
+    prefix_digests = context_compaction.prefix_digests
+
+    def spy(messages, count=None):
+        counts.append(len(messages[:count]))
+        return prefix_digests(messages, count)
+
+    monkeypatch.setattr(context_compaction, "prefix_digests", spy)
+    monkeypatch.setattr(context_compaction, "MAX_INPUT_TOKENS", 2000)
+    return counts
+
+
+def compact(compactor: ContextCompactor, messages: list, conversation_id=None) -> list:
+    return asyncio.run(compactor.compact(messages, MODEL, 1000, "us-east-1", conversation_id))
+
+
+def test_disabled_compaction_returns_messages_untouched(hashed):
+    messages = conversation(10)
+    assert compact(ContextCompactor(enabled=False), messages, "c1") is messages
+    assert hashed == []
+
+
+def test_within_budget_conversation_is_not_hashed(hashed):
+    messages = conversation(1)
+    assert compact(ContextCompactor(enabled=True, mode="drop"), messages, "c1") is messages
+    assert hashed == []
+
+
+def test_conversation_keeps_its_cut_and_hashes_only_the_prefix(hashed):
+    compactor = ContextCompactor(enabled=True, mode="drop")
+    first = compact(compactor, conversation(10), "c1")
+    cut = compactor._states["c1"]["cut"]
+    assert len(first) == 21 - cut and hashed == [cut]
+
+    hashed.clear()
+    more = conversation(10) + [{"role": "assistant", "content": [{"text": "ok"}]},
+                               {"role": "user", "content": [{"text": "more"}]}]
+    second = compact(compactor, more, "c1")
+    assert compactor._states["c1"]["cut"] == cut
+    assert second[0] == more[cut] and hashed == [cut]
+
+
+def test_changed_history_discards_saved_cut(hashed):
+    compactor = ContextCompactor(enabled=True, mode="drop")
+    compact(compactor, conversation(10), "c1")
+    fingerprint = compactor._states["c1"]["fingerprint"]
+    edited = conversation(10)
+    edited[0] = {"role": "user", "content": [{"text": "edited " + "x" * 800}]}
+    result = compact(compactor, edited, "c1")
+    assert compactor._states["c1"]["fingerprint"] != fingerprint
+    assert len(result) < len(edited)
@@ -0,0 +1,103 @@
+"""服务端会话存储：historyLength 协议、并发写入与磁盘层恢复"""
+import asyncio
+import pytest
+from bedrock_integration.conversation_store import ConversationConflict, ConversationStore
+
+
+def message(role: str, text: str) -> dict:
+    return {"role": role, "content": [{"text": text}]}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_new_conversation_uses_messages_as_history():
+    store = ConversationStore(disk_dir="")
+    messages, base = run(store.prepare("c1", [message("user", "hi")], None))
+    assert messages == [message("user", "hi")] and base == 0
+
+
+def test_history_is_prepended_to_delta():
+    store = ConversationStore(disk_dir="")
+
+    async def scenario():
+        await store.commit("c1", 0, [message("user", "hi"), message("assistant", "hello")])
+        return await store.prepare("c1", [message("user", "again")], 2)
+
+    messages, base = run(scenario())
+    assert base == 2
+    assert [m["content"][0]["text"] for m in messages] == ["hi", "hello", "again"]
+
+
+def test_history_length_mismatch_conflicts():
+    store = ConversationStore(disk_dir="")
+
+    async def scenario():
+        await store.commit("c1", 0, [message("user", "hi"), message("assistant", "hello")])
+        await store.prepare("c1", [message("user", "again")], 4)
+
+    with pytest.raises(ConversationConflict, match="expected 4"):
+        run(scenario())
+
+
+def test_missing_history_length_conflicts_once_history_exists():
+    store = ConversationStore(disk_dir="")
+
+    async def scenario():
+        await store.commit("c1", 0, [message("user", "hi"), message("assistant", "hello")])
+        await store.prepare("c1", [message("user", "hi"), message("assistant", "hello")], None)
+
+    with pytest.raises(ConversationConflict, match="historyLength is required"):
+        run(scenario())
+
+
+def test_unknown_conversation_with_history_length_conflicts():
+    store = ConversationStore(disk_dir="")
+    with pytest.raises(ConversationConflict, match="not found"):
+        run(store.prepare("c1", [message("user", "hi")], 2))
+
+
+def test_history_length_zero_rebuilds_conversation():
+    store = ConversationStore(disk_dir="")
+
+    async def scenario():
+        await store.commit("c1", 0, [message("user", "old")])
+        return await store.prepare("c1", [message("user", "new")], 0)
+
+    messages, base = run(scenario())
+    assert messages == [message("user", "new")] and base == 0
+
+
+def test_commit_is_skipped_when_history_changed_during_generation():
+    store = ConversationStore(disk_dir="")
+
+    async def scenario():
+        await store.commit("c1", 0, [message("user", "hi"), message("assistant", "hello")])
+        first = await store.commit("c1", 2, [message("user", "a"), message("assistant", "b")])
+        second = await store.commit("c1", 2, [message("user", "c"), message("assistant", "d")])
+        return first, second, await store.get("c1")
+
+    first, second, history = run(scenario())
+    assert (first, second) == (True, False)
+    assert len(history) == 4
+
+
+def test_invalid_conversation_id_is_rejected():
+    store = ConversationStore(disk_dir="")
+    with pytest.raises(ValueError):
+        run(store.prepare("../etc/passwd", [], None))
+
+
+def test_disk_tier_restores_evicted_conversation(tmp_path):
+    store = ConversationStore(disk_dir=str(tmp_path))
+
+    async def scenario():
+        await store.commit("c1", 0, [message("user", "hi"), message("assistant", "hello")])
+        await store.commit("c1", 2, [message("user", "again"), message("assistant", "sure")])
+        store._remove("c1")
+        return await store.get("c1")
+
+    history = run(scenario())
+    assert [m["content"][0]["text"] for m in history] == ["hi", "hello", "again", "sure"]
+    assert store.disk_hits == 1
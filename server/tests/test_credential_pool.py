@@ -0,0 +1,73 @@
+"""凭证池：负载选择、限流降级与每个请求只计一次限流"""
+import time
+from bedrock_integration.credential_pool import CredentialLease, CredentialPool, CredentialSet
+from fakes import client_error, throttle
+
+
+def release_throttled(pool: CredentialPool, credential_set: CredentialSet, count_throttle: bool = True):
+    """让指定凭证完成一次被限流的调用"""
+    credential_set.in_flight += 1
+    CredentialLease(pool, credential_set, "us-east-1").release(throttle(), count_throttle)
+
+
+def test_lease_prefers_least_loaded_by_weight():
+    small, large = CredentialSet("small"), CredentialSet("large", weight=3)
+    pool = CredentialPool([small, large])
+    chosen = [pool.lease("us-east-1").credential_set.name for _ in range(4)]
+    assert chosen.count("large") == 3 and chosen.count("small") == 1
+
+
+def test_lease_respects_regions():
+    us, eu = CredentialSet("us", regions=["us-east-1"]), CredentialSet("eu", regions=["eu-west-1"])
+    pool = CredentialPool([us, eu])
+    assert pool.lease("eu-west-1").credential_set is eu
+    # 没有凭证声明的区域使用全部凭证
+    assert pool.lease("ap-northeast-1").credential_set in (us, eu)
+
+
+def test_throttled_set_is_demoted_and_skipped():
+    a, b = CredentialSet("a"), CredentialSet("b")
+    pool = CredentialPool([a, b], demote_seconds=30)
+    pool.lease("us-east-1").release(throttle())
+    assert a.demoted_until > time.monotonic()
+    assert pool.lease("us-east-1").credential_set is b
+
+
+def test_consecutive_throttles_double_the_demotion():
+    a, b = CredentialSet("a"), CredentialSet("b")
+    pool = CredentialPool([a, b], demote_seconds=30)
+    release_throttled(pool, a)
+    release_throttled(pool, a)
+    assert 59 < a.demoted_until - time.monotonic() <= 60
+
+
+def test_single_set_is_not_demoted():
+    only = CredentialSet("only")
+    pool = CredentialPool([only], demote_seconds=30)
+    pool.lease("us-east-1").release(throttle())
+    assert only.throttled == 1
+    assert only.demoted_until == 0.0 and only.in_flight == 0
+
+
+def test_repeated_throttle_in_one_request_is_not_counted():
+    a, b = CredentialSet("a"), CredentialSet("b")
+    pool = CredentialPool([a, b], demote_seconds=30)
+    release_throttled(pool, a)
+    demoted_until = a.demoted_until
+    release_throttled(pool, a, count_throttle=False)
+    assert a.throttled == 1 and a.demoted_until == demoted_until and a.in_flight == 0
+
+
+def test_other_errors_do_not_demote():
+    a, b = CredentialSet("a"), CredentialSet("b")
+    pool = CredentialPool([a, b])
+    pool.lease("us-east-1").release(client_error("ValidationException"))
+    assert a.demoted_until == 0.0 and a.throttled == 0
+
+
+def test_all_demoted_picks_earliest_recovery():
+    a, b = CredentialSet("a"), CredentialSet("b")
+    pool = CredentialPool([a, b])
+    now = time.monotonic()
+    a.demoted_until, b.demoted_until = now + 60, now + 10
+    assert pool.lease("us-east-1").credential_set is b
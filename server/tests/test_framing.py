@@ -0,0 +1,60 @@
+"""MessagePack 帧：协商、长度前缀编码与流中的错误帧"""
+import asyncio
+import pytest
+from bedrock_integration.framing import (
+    MSGPACK_MEDIA_TYPE, accepts_msgpack, msgpack_stream, pack_frames, unpack_frames
+)
+from bedrock_integration.projection import lean_stream
+
+msgpack = pytest.importorskip("msgpack")
+
+
+async def collect(stream) -> bytes:
+    return b"".join([chunk async for chunk in stream])
+
+
+async def events(items, error=None):
+    for item in items:
+        yield item
+    if error is not None:
+        raise error
+
+
+def test_accept_header_negotiation():
+    assert accepts_msgpack(f"{MSGPACK_MEDIA_TYPE}, application/json")
+    assert not accepts_msgpack("application/json")
+    assert not accepts_msgpack(None)
+
+
+def test_frames_round_trip_with_binary_payload():
+    frames = [{"t": "hello"}, {"bytes": b"\x00\x01"}, {"end": {"stop": "end_turn"}}]
+    data = pack_frames(frames)
+    assert data[:4] == len(msgpack.packb(frames[0])).to_bytes(4, "big")
+    assert unpack_frames(data) == frames
+
+
+def test_raw_stream_ends_with_error_frame():
+    upstream = events([{"messageStart": {"role": "assistant"}}], RuntimeError("upstream failed"))
+    frames = unpack_frames(asyncio.run(collect(msgpack_stream(upstream))))
+    assert frames == [{"messageStart": {"role": "assistant"}}, {"error": "upstream failed"}]
+
+
+def test_lean_stream_packs_lean_frames():
+    upstream = events([
+        {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": "a"}}},
+        {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": "b"}}},
+        {"messageStop": {"stopReason": "end_turn"}},
+        {"metadata": {"usage": {"inputTokens": 1, "outputTokens": 2}}},
+    ])
+    frames = unpack_frames(asyncio.run(collect(lean_stream(upstream, window_ms=50, encode=pack_frames))))
+    assert frames[0] == {"t": "ab"}
+    assert frames[-1]["end"]["stop"] == "end_turn"
+
+
+def test_lean_stream_keeps_content_blocks_apart():
+    upstream = events([
+        {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": "a"}}},
+        {"contentBlockDelta": {"contentBlockIndex": 1, "delta": {"text": "b"}}},
+    ])
+    frames = unpack_frames(asyncio.run(collect(lean_stream(upstream, window_ms=50, encode=pack_frames))))
+    assert frames == [{"t": "a"}, {"t": "b"}]
@@ -0,0 +1,127 @@
+"""图片任务队列：状态流转、排队上限、取消与结果内存上限"""
+import asyncio
+import pytest
+from bedrock_integration.image_jobs import ImageJobQueue, JobQueueFull
+
+
+def image(data: str = "aaaa"):
+    async def run():
+        return {"image": data}
+    return run
+
+
+def blocked(gate: asyncio.Event, ran: list):
+    async def run():
+        ran.append(True)
+        await gate.wait()
+        return {"image": "done"}
+    return run
+
+
+def test_result_is_returned_once_then_released():
+    async def scenario():
+        queue = ImageJobQueue()
+        job = queue.submit(image("abcd"))
+        await job.wait(1)
+        return queue, job, queue.collect(job), queue.collect(job)
+
+    queue, job, first, second = asyncio.run(scenario())
+    assert first["status"] == "succeeded" and first["result"] == {"image": "abcd"}
+    assert second["status"] == "succeeded" and "result" not in second
+    assert queue.result_bytes == 0
+
+
+@pytest.mark.parametrize("outcome, message", [({"error": "content filtered"}, "content filtered"),
+                                              (RuntimeError("model down"), "model down")])
+def test_failures_are_reported(outcome, message):
+    async def run():
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def scenario():
+        queue = ImageJobQueue()
+        job = queue.submit(run)
+        await job.wait(1)
+        return queue, job
+
+    queue, job = asyncio.run(scenario())
+    assert job.to_dict()["status"] == "failed" and job.error == message
+    assert queue.failed == 1
+
+
+def test_submit_rejects_when_queue_is_full():
+    async def scenario():
+        queue = ImageJobQueue(concurrency=1, max_pending=2)
+        gate = asyncio.Event()
+        queue.submit(blocked(gate, []))
+        queue.submit(blocked(gate, []))
+        try:
+            queue.submit(image())
+        finally:
+            gate.set()
+            assert queue.rejected == 1
+
+    with pytest.raises(JobQueueFull):
+        asyncio.run(scenario())
+
+
+def test_concurrency_queues_and_cancel_skips_queued_job():
+    async def scenario():
+        queue = ImageJobQueue(concurrency=1)
+        gate, ran_first, ran_second = asyncio.Event(), [], []
+        first = queue.submit(blocked(gate, ran_first))
+        second = queue.submit(blocked(gate, ran_second))
+        await asyncio.sleep(0.01)
+        statuses = (first.status, second.status)
+        queue.cancel(second.id)
+        await asyncio.sleep(0)
+        gate.set()
+        await first.wait(1)
+        return statuses, first.status, second.status, ran_second, queue.get_stats()
+
+    statuses, first, second, ran_second, stats = asyncio.run(scenario())
+    assert statuses == ("running", "queued")
+    assert (first, second) == ("succeeded", "cancelled")
+    assert ran_second == []
+    assert stats["cancelled"] == 1
+
+
+def test_cancel_running_job_frees_its_slot():
+    async def scenario():
+        queue = ImageJobQueue(concurrency=1)
+        running = queue.submit(blocked(asyncio.Event(), []))
+        waiting = queue.submit(image())
+        await asyncio.sleep(0.01)
+        queue.cancel(running.id)
+        await waiting.wait(1)
+        return running.status, waiting.status
+
+    assert asyncio.run(scenario()) == ("cancelled", "succeeded")
+
+
+def test_result_bytes_limit_evicts_oldest_finished_job():
+    async def scenario():
+        queue = ImageJobQueue(max_result_bytes=6)
+        old = queue.submit(image("aaaa"))
+        await old.wait(1)
+        new = queue.submit(image("bbbb"))
+        await new.wait(1)
+        return queue, old, new
+
+    queue, old, new = asyncio.run(scenario())
+    assert queue.get(old.id) is None
+    assert queue.get(new.id) is new
+    assert queue.evicted == 1 and queue.result_bytes == 4
+
+
+def test_discard_removes_job_and_its_result():
+    async def scenario():
+        queue = ImageJobQueue()
+        job = queue.submit(image("abcd"))
+        await job.wait(1)
+        queue.discard(job)
+        return queue, job
+
+    queue, job = asyncio.run(scenario())
+    assert queue.get(job.id) is None and queue.result_bytes == 0
@@ -0,0 +1,57 @@
+"""multipart 上传：表单解析与 source.part 引用替换"""
+import asyncio
+import httpx
+import pytest
+from starlette.requests import Request
+from bedrock_integration.multipart import attach_media_parts, read_converse_form
+
+
+def form_request(data=None, files=None) -> Request:
+    encoded = httpx.Request("POST", "http://test/api/converse/v3/multipart", data=data, files=files)
+    body = encoded.read()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/converse/v3/multipart",
+        "headers": [(b"content-type", encoded.headers["content-type"].encode())],
+    }
+    return Request(scope, receive)
+
+
+def image_message(part: str) -> dict:
+    return {"role": "user", "content": [{"text": "hi"}, {"image": {"format": "png", "source": {"part": part}}}]}
+
+
+def test_read_form_returns_request_and_parts():
+    request = form_request(data={"request": '{"messages": []}'}, files={"img0": ("a.png", b"\x89PNG")})
+    request_json, parts = asyncio.run(read_converse_form(request))
+    assert request_json == '{"messages": []}'
+    assert parts == {"img0": b"\x89PNG"}
+
+
+def test_read_form_accepts_request_as_file():
+    request = form_request(files={"request": ("request.json", b'{"messages": []}')})
+    request_json, parts = asyncio.run(read_converse_form(request))
+    assert request_json == '{"messages": []}'
+    assert parts == {}
+
+
+def test_read_form_without_request_field_fails():
+    request = form_request(files={"img0": ("a.png", b"\x89PNG")})
+    with pytest.raises(ValueError, match="request"):
+        asyncio.run(read_converse_form(request))
+
+
+def test_attach_replaces_part_reference_with_bytes():
+    messages = [image_message("img0")]
+    attach_media_parts(messages, {"img0": b"\x89PNG"})
+    assert messages[0]["content"][1]["image"]["source"] == {"bytes": b"\x89PNG"}
+
+
+def test_attach_missing_part_fails():
+    with pytest.raises(ValueError, match="img1"):
+        attach_media_parts([image_message("img1")], {"img0": b"\x89PNG"})
@@ -0,0 +1,51 @@
+"""lean 投影：增量合并只在同一模型、同一内容块内进行"""
+import asyncio
+import json
+from bedrock_integration.projection import TaggedProjection, lean_frames, lean_stream
+
+
+def delta(index: int, text: str, **extra) -> dict:
+    return {"contentBlockDelta": {"contentBlockIndex": index, "delta": {"text": text}}, **extra}
+
+
+async def events(items, error=None):
+    for item in items:
+        yield item
+    if error is not None:
+        raise error
+
+
+def frames(items, projection=None, error=None) -> list:
+    async def collect():
+        return [frame async for batch in lean_frames(events(items, error), 50, projection) for frame in batch]
+    return asyncio.run(collect())
+
+
+def test_deltas_of_one_block_are_merged():
+    assert frames([delta(0, "a"), delta(0, "b"), delta(0, "c")]) == [{"t": "abc"}]
+
+
+def test_deltas_of_different_blocks_are_not_merged():
+    reasoning = {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"reasoningContent": {"text": "r"}}}}
+    assert frames([reasoning, delta(1, "a"), delta(1, "b"), delta(2, "c")]) == [
+        {"r": "r"}, {"t": "ab"}, {"t": "c"}
+    ]
+
+
+def test_tagged_frames_merge_per_model():
+    items = [delta(0, "a", model="x"), delta(0, "b", model="x"), delta(0, "c", model="y")]
+    assert frames(items, TaggedProjection()) == [{"m": "x", "t": "ab"}, {"m": "y", "t": "c"}]
+
+
+def test_end_frame_is_added_without_metadata():
+    assert frames([delta(0, "a"), {"messageStop": {"stopReason": "end_turn"}}]) == [
+        {"t": "a"}, {"end": {"stop": "end_turn"}}
+    ]
+
+
+def test_upstream_error_becomes_error_frame():
+    async def collect():
+        return b"".join([chunk async for chunk in lean_stream(events([delta(0, "a")], RuntimeError("boom")), 50)])
+
+    lines = [json.loads(line) for line in asyncio.run(collect()).splitlines()]
+    assert lines == [{"t": "a"}, {"error": "boom"}]
@@ -0,0 +1,53 @@
+"""Prompt 缓存检查点：默认关闭、按请求开启与不修改保存的历史"""
+import copy
+import importlib
+from bedrock_integration import prompt_cache
+from bedrock_integration.prompt_cache import CACHE_POINT, PromptCachePolicy
+
+MODEL = "anthropic.claude-3-7-sonnet-20250219-v1:0"
+LONG_TEXT = "x" * 8000
+
+
+def command(model_id: str = MODEL) -> dict:
+    return {
+        "modelId": model_id,
+        "system": [{"text": LONG_TEXT}],
+        "messages": [{"role": "user", "content": [{"text": LONG_TEXT}]}],
+    }
+
+
+def test_caching_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("PROMPT_CACHE_ENABLED", raising=False)
+    module = importlib.reload(prompt_cache)
+    cmd = command()
+    module.PromptCachePolicy().apply(cmd)
+    assert cmd == command()
+
+
+def test_request_can_turn_caching_on_or_off():
+    on, off = command(), command()
+    PromptCachePolicy(enabled=False).apply(on, True)
+    PromptCachePolicy(enabled=True).apply(off, False)
+    assert on["system"][-1] == CACHE_POINT and on["messages"][0]["content"][-1] == CACHE_POINT
+    assert off == command()
+
+
+def test_history_is_not_modified():
+    cmd = command()
+    messages = cmd["messages"]
+    saved = copy.deepcopy(messages)
+    PromptCachePolicy(enabled=True).apply(cmd)
+    assert messages == saved and cmd["messages"] is not messages
+
+
+def test_unsupported_model_and_client_cache_points_are_left_alone():
+    policy = PromptCachePolicy(enabled=True)
+    unsupported = command("meta.llama3-70b-instruct-v1:0")
+    policy.apply(unsupported)
+    assert unsupported == command("meta.llama3-70b-instruct-v1:0") and policy.skipped_unsupported == 1
+
+    explicit = command()
+    explicit["messages"][0]["content"].append(CACHE_POINT)
+    expected = copy.deepcopy(explicit)
+    policy.apply(explicit)
+    assert explicit == expected
@@ -0,0 +1,79 @@
+"""可恢复流：按字节偏移量恢复、偏移量越界与落后订阅者的错误帧"""
+import asyncio
+import pytest
+from bedrock_integration.replay import ReplayableStream, StreamGone, StreamRegistry
+
+
+async def chunks(count: int, size: int = 10, pause: float = 0):
+    for index in range(count):
+        yield bytes([65 + index % 26]) * size
+        await asyncio.sleep(pause)
+
+
+async def read(stream, pause: float = 0) -> bytes:
+    data = b""
+    async for chunk in stream:
+        data += chunk
+        await asyncio.sleep(pause)
+    return data
+
+
+def test_resume_from_offset_returns_the_rest():
+    async def scenario():
+        registry = StreamRegistry()
+        stream = registry.start(chunks(5), "application/x-ndjson")
+        full = await read(stream.subscribe(0))
+        return full, await read(registry.resume(stream.stream_id, 23))
+
+    full, rest = asyncio.run(scenario())
+    assert len(full) == 50
+    assert rest == full[23:]
+
+
+def test_resume_unknown_stream_raises_key_error():
+    with pytest.raises(KeyError):
+        StreamRegistry().resume("missing", 0)
+
+
+def test_resume_outside_buffer_raises_stream_gone():
+    async def scenario():
+        registry = StreamRegistry()
+        stream = registry.start(chunks(5), "application/x-ndjson")
+        stream.buffer_bytes = 20
+        await stream._task
+        registry.resume(stream.stream_id, 0)
+
+    with pytest.raises(StreamGone):
+        asyncio.run(scenario())
+
+
+def test_lagging_subscriber_gets_error_frame_with_offset():
+    errors = []
+
+    def encode_error(message: str, offset: int) -> bytes:
+        errors.append(offset)
+        return f"Error: {message}".encode()
+
+    async def scenario():
+        registry = StreamRegistry()
+        stream = registry.start(chunks(40), "text/event-stream", encode_error)
+        stream.buffer_bytes = 30
+        data = await read(stream.subscribe(0), pause=0.01)
+        return registry, data
+
+    registry, data = asyncio.run(scenario())
+    assert errors, "lagging subscriber ended without an error frame"
+    received = data[:data.index(b"Error: ")]
+    assert errors == [len(received)]
+    assert b"fell behind" in data
+    assert registry.get_stats()["lagged"] == 1
+
+
+def test_subscriber_that_keeps_up_gets_no_error():
+    async def scenario():
+        stream = ReplayableStream("s1", chunks(10, pause=0.005), "text/event-stream", buffer_bytes=30,
+                                  encode_error=lambda message, offset: b"Error")
+        return await read(stream.subscribe(0))
+
+    data = asyncio.run(scenario())
+    assert len(data) == 100 and b"Error" not in data
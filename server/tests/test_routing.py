@@ -0,0 +1,77 @@
+"""跨区域故障转移：候选路由、首 token 前的故障转移与最终抛出的错误"""
+import asyncio
+import pytest
+from botocore.exceptions import ClientError
+from bedrock_integration import routing
+from bedrock_integration.credential_pool import CredentialPool
+from bedrock_integration.routing import BedrockRouter, Route, candidate_routes, primary_failure
+from fakes import FakeCredentialSet, client_error, make_events, throttle
+
+MODEL = "anthropic.claude-3-5-haiku-20241022-v1:0"
+PROFILE = f"us.{MODEL}"
+
+
+@pytest.fixture(autouse=True)
+def no_profiles(monkeypatch):
+    monkeypatch.setattr(routing, "inference_profiles", set())
+    monkeypatch.setattr(routing, "ROUTE_REGIONS", [])
+    monkeypatch.setattr(routing, "MAX_ALTERNATES", 2)
+
+
+async def collect(router: BedrockRouter, model_id: str, region: str, pool: CredentialPool) -> list:
+    command = {"modelId": model_id, "messages": [], "inferenceConfig": {"maxTokens": 100}}
+    return [event async for event in router.events(command, region, pool)]
+
+
+def test_plain_model_without_profile_has_no_alternate():
+    assert candidate_routes(MODEL, "us-east-1") == [Route("us-east-1", MODEL)]
+
+
+def test_plain_model_fails_over_to_registered_profile():
+    routing.register_inference_profiles([PROFILE, MODEL, "apac.other-model"])
+    assert routing.inference_profiles == {PROFILE, "apac.other-model"}
+    assert candidate_routes(MODEL, "us-east-1") == [Route("us-east-1", MODEL), Route("us-east-1", PROFILE)]
+    # 其他地理区域的推理配置不适用
+    assert candidate_routes(MODEL, "eu-west-1") == [Route("eu-west-1", MODEL)]
+
+
+def test_profile_fails_over_within_its_geography():
+    routes = candidate_routes(PROFILE, "us-west-2")
+    assert routes[0] == Route("us-west-2", PROFILE)
+    assert {route.region for route in routes[1:]} == {"us-east-1", "us-east-2"}
+
+
+def test_primary_failure_prefers_first_retryable_error():
+    validation, throttled, unavailable = (
+        client_error("ValidationException"), throttle(), client_error("ServiceUnavailableException"))
+    assert primary_failure([validation, throttled, unavailable]) is throttled
+    assert primary_failure([validation, RuntimeError("x")]) is validation
+
+
+def test_throttled_route_fails_over_before_first_token():
+    credential_set = FakeCredentialSet("a", {("us-west-2", PROFILE): throttle()})
+    router = BedrockRouter(hedge_after_ms=0, failover=True)
+    events = asyncio.run(collect(router, PROFILE, "us-west-2", CredentialPool([credential_set])))
+    assert events == make_events()
+    assert credential_set.requests == [("us-west-2", PROFILE), ("us-east-1", PROFILE)]
+    assert router.failovers == 1
+
+
+def test_all_routes_failing_raises_the_throttle_not_the_last_error():
+    credential_set = FakeCredentialSet("a", {
+        ("us-west-2", PROFILE): throttle(),
+        ("us-east-1", PROFILE): client_error("ValidationException"),
+    })
+    router = BedrockRouter(hedge_after_ms=0, failover=True)
+    with pytest.raises(ClientError) as raised:
+        asyncio.run(collect(router, PROFILE, "us-west-2", CredentialPool([credential_set])))
+    assert raised.value.response["Error"]["Code"] == "ThrottlingException"
+
+
+def test_non_retryable_error_does_not_fail_over():
+    credential_set = FakeCredentialSet("a", {("us-west-2", PROFILE): client_error("ValidationException")})
+    router = BedrockRouter(hedge_after_ms=0, failover=True)
+    with pytest.raises(ClientError, match="ValidationException"):
+        asyncio.run(collect(router, PROFILE, "us-west-2", CredentialPool([credential_set])))
+    assert credential_set.requests == [("us-west-2", PROFILE)]
+    assert router.failovers == 0
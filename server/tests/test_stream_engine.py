@@ -0,0 +1,92 @@
+"""Bedrock 异步流：读取线程排队超时（429）、上游错误与提前关闭"""
+import asyncio
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from bedrock_integration import stream_engine
+from bedrock_integration.stream_engine import BedrockStream, StreamCapacityExceeded
+from workload_pools import WorkloadPool
+from fakes import FakeEventStream, make_events, throttle
+
+
+class BlockingBedrock:
+    """converse_stream 在 release 之前一直占用读取线程"""
+
+    def __init__(self, events=None, error=None):
+        self.release = threading.Event()
+        self.events = events or make_events()
+        self.error = error
+        self.streams = []
+
+    def converse_stream(self, **command):
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        stream = FakeEventStream(self.events)
+        self.streams.append(stream)
+        return {"stream": stream}
+
+
+@pytest.fixture
+def one_reader(monkeypatch):
+    pool = WorkloadPool("chat_stream", 1)
+    monkeypatch.setattr(stream_engine, "get_pool", lambda name: pool)
+    return pool
+
+
+async def collect(stream: BedrockStream) -> list:
+    return [event async for event in stream.events()]
+
+
+def test_upstream_error_reaches_the_consumer():
+    client = BlockingBedrock(error=throttle())
+    client.release.set()
+    with pytest.raises(ClientError, match="ThrottlingException"):
+        asyncio.run(collect(BedrockStream(client, {})))
+
+
+def test_busy_readers_reject_after_queue_timeout(one_reader):
+    async def scenario():
+        busy = BlockingBedrock()
+        first = BedrockStream(busy, {})
+        first_events = asyncio.ensure_future(collect(first))
+        await asyncio.sleep(0.05)
+        try:
+            await collect(BedrockStream(BlockingBedrock(), {}, queue_timeout=0.1))
+        finally:
+            busy.release.set()
+            assert await first_events == make_events()
+
+    with pytest.raises(StreamCapacityExceeded) as raised:
+        asyncio.run(scenario())
+    assert raised.value.retry_after >= 1
+
+
+def test_rejected_stream_never_runs(one_reader):
+    async def scenario():
+        busy, queued = BlockingBedrock(), BlockingBedrock()
+        queued.release.set()
+        first_events = asyncio.ensure_future(collect(BedrockStream(busy, {})))
+        await asyncio.sleep(0.05)
+        with pytest.raises(StreamCapacityExceeded):
+            await collect(BedrockStream(queued, {}, queue_timeout=0.05))
+        busy.release.set()
+        await first_events
+        await asyncio.sleep(0.05)
+        return queued.streams
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_closing_early_closes_upstream():
+    async def scenario():
+        client = BlockingBedrock()
+        client.release.set()
+        stream = BedrockStream(client, {})
+        events = stream.events()
+        await events.__anext__()
+        await events.aclose()
+        await asyncio.sleep(0.05)
+        return client.streams[0]
+
+    assert asyncio.run(scenario()).closed
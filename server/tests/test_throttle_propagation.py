@@ -0,0 +1,74 @@
+"""限流在 路由 -> 准入控制 -> 凭证降级 之间的传递"""
+import asyncio
+import time
+import pytest
+from bedrock_integration import admission, routing
+from bedrock_integration.admission import AdmissionController, AdmissionRejected
+from bedrock_integration.credential_pool import CredentialPool
+from bedrock_integration.routing import BedrockRouter
+from fakes import FakeCredentialSet, make_events, throttle
+
+PROFILE = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
+REGION = "us-west-2"
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setattr(admission, "backoff_delay", lambda attempt: 0)
+    monkeypatch.setattr(routing, "ROUTE_REGIONS", [])
+    monkeypatch.setattr(routing, "MAX_ALTERNATES", 2)
+
+
+def converse(controller: AdmissionController, router: BedrockRouter, pool: CredentialPool):
+    """与 main.model_events 相同的组合：准入控制包住带故障转移的路由"""
+    command = {"modelId": PROFILE, "messages": [], "inferenceConfig": {"maxTokens": 100}}
+
+    async def collect():
+        stream = controller.stream(PROFILE, REGION, 100, lambda: router.events(command, REGION, pool))
+        return [event async for event in stream]
+    return asyncio.run(collect())
+
+
+def always_throttled():
+    return {(region, PROFILE): throttle for region in ("us-west-2", "us-east-1", "us-east-2")}
+
+
+def test_failover_to_another_set_hides_the_throttle_from_admission():
+    a = FakeCredentialSet("a", always_throttled())
+    b = FakeCredentialSet("b", {})
+    controller, router = AdmissionController(max_retries=1), BedrockRouter(hedge_after_ms=0, failover=True)
+
+    events = converse(controller, router, CredentialPool([a, b], demote_seconds=30))
+
+    assert events == make_events()
+    assert a.throttled == 1 and a.demoted_until > time.monotonic()
+    assert b.requests == [("us-east-1", PROFILE)] and b.demoted_until == 0.0
+    assert router.failovers == 1
+    assert controller.limiter(PROFILE, REGION).throttled == 0
+
+
+def test_throttle_on_every_route_reaches_admission_and_counts_once_per_request():
+    a = FakeCredentialSet("a", always_throttled())
+    b = FakeCredentialSet("b", always_throttled())
+    controller, router = AdmissionController(max_retries=1), BedrockRouter(hedge_after_ms=0, failover=True)
+
+    with pytest.raises(AdmissionRejected, match="after 1 retries"):
+        converse(controller, router, CredentialPool([a, b], demote_seconds=30))
+
+    # 两次准入尝试，每次三条路由：a 在同一请求中被选中两次，只计一次限流
+    assert len(a.requests) + len(b.requests) == 6
+    assert (a.throttled, b.throttled) == (2, 2)
+    assert a.in_flight == 0 and b.in_flight == 0
+    limiter = controller.limiter(PROFILE, REGION)
+    assert (limiter.throttled, limiter.retries, limiter.in_flight) == (2, 1, 0)
+
+
+def test_single_set_is_never_demoted_by_a_throttled_request():
+    only = FakeCredentialSet("only", always_throttled())
+    controller, router = AdmissionController(max_retries=0), BedrockRouter(hedge_after_ms=0, failover=True)
+
+    with pytest.raises(AdmissionRejected):
+        converse(controller, router, CredentialPool([only], demote_seconds=30))
+
+    assert len(only.requests) == 3
+    assert only.throttled == 1 and only.demoted_until == 0.0
@@ -0,0 +1,158 @@
+"""WebSocket 会话：消息校验、流控窗口与多路流的错误处理"""
+import asyncio
+import json
+import pytest
+from bedrock_integration import websocket_session
+from bedrock_integration.websocket_session import StreamCredit, WebSocketSession, positive_int
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.outgoing: asyncio.Queue = asyncio.Queue()
+
+    async def receive(self) -> dict:
+        return await self.incoming.get()
+
+    async def send_text(self, text: str):
+        await self.outgoing.put(json.loads(text))
+
+    def client_sends(self, message):
+        if isinstance(message, bytes):
+            self.incoming.put_nowait({"type": "websocket.receive", "bytes": message})
+        else:
+            text = message if isinstance(message, str) else json.dumps(message)
+            self.incoming.put_nowait({"type": "websocket.receive", "text": text})
+
+    async def next(self, timeout: float = 1) -> dict:
+        return await asyncio.wait_for(self.outgoing.get(), timeout)
+
+
+async def numbers(request: dict):
+    for index in range(request.get("count", 3)):
+        yield {"type": "event", "n": index}
+
+
+async def failing(request: dict):
+    yield {"type": "event", "n": 0}
+    raise RuntimeError("model failed")
+
+
+async def endless(request: dict):
+    while True:
+        await asyncio.sleep(0.01)
+        yield {"type": "event"}
+
+
+def session_test(scenario, handlers=None):
+    """启动会话，执行 scenario(websocket)，最后断开连接"""
+    async def main():
+        websocket = FakeWebSocket()
+        session = WebSocketSession(websocket, handlers or {"converse": numbers, "fail": failing,
+                                                           "endless": endless})
+        runner = asyncio.ensure_future(session.run())
+        assert await websocket.next() == {"type": "ready"}
+        try:
+            return await scenario(websocket)
+        finally:
+            websocket.incoming.put_nowait({"type": "websocket.disconnect"})
+            await asyncio.wait_for(runner, 1)
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("value, expected", [
+    (3, 3), ("4", 4), (0, None), (-1, None), ("x", None), (None, None), (True, None), (float("inf"), None)
+])
+def test_positive_int(value, expected):
+    assert positive_int(value) == expected
+
+
+def test_grant_never_exceeds_the_window():
+    async def scenario():
+        credit = StreamCredit(2)
+        await credit.take()
+        credit.grant(10)
+        return credit.available
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_bad_messages_get_errors_and_keep_the_connection():
+    async def scenario(websocket):
+        websocket.client_sends("not json")
+        websocket.client_sends(b"\x00")
+        websocket.client_sends({"type": "ack", "id": "s1", "count": "lots"})
+        websocket.client_sends({"type": "ping"})
+        return [await websocket.next() for _ in range(4)]
+
+    replies = session_test(scenario)
+    assert [reply["type"] for reply in replies] == ["error", "error", "error", "pong"]
+    assert "positive integer" in replies[2]["error"]
+
+
+def test_stream_runs_to_done():
+    async def scenario(websocket):
+        websocket.client_sends({"type": "converse", "id": "s1", "request": {"count": 2}})
+        return [await websocket.next() for _ in range(3)]
+
+    assert session_test(scenario) == [
+        {"id": "s1", "type": "event", "n": 0}, {"id": "s1", "type": "event", "n": 1}, {"id": "s1", "type": "done"}
+    ]
+
+
+def test_window_pauses_stream_until_ack():
+    async def scenario(websocket):
+        websocket.client_sends({"type": "converse", "id": "s1", "request": {"count": 4}, "window": 2})
+        first = [await websocket.next() for _ in range(2)]
+        with pytest.raises(asyncio.TimeoutError):
+            await websocket.next(timeout=0.1)
+        websocket.client_sends({"type": "ack", "id": "s1", "count": 2})
+        rest = [await websocket.next() for _ in range(3)]
+        return first + rest
+
+    messages = session_test(scenario)
+    assert [message.get("n") for message in messages] == [0, 1, 2, 3, None]
+
+
+def test_invalid_window_is_rejected():
+    async def scenario(websocket):
+        websocket.client_sends({"type": "converse", "id": "s1", "window": 0})
+        return await websocket.next()
+
+    assert "window" in session_test(scenario)["error"]
+
+
+def test_handler_error_ends_only_that_stream():
+    async def scenario(websocket):
+        websocket.client_sends({"type": "fail", "id": "bad"})
+        replies = [await websocket.next() for _ in range(2)]
+        websocket.client_sends({"type": "converse", "id": "good", "request": {"count": 1}})
+        return replies + [await websocket.next() for _ in range(2)]
+
+    replies = session_test(scenario)
+    assert replies[1] == {"id": "bad", "type": "error", "error": "model failed"}
+    assert replies[-1] == {"id": "good", "type": "done"}
+
+
+def test_stream_limit_and_duplicate_ids(monkeypatch):
+    monkeypatch.setattr(websocket_session, "MAX_STREAMS", 1)
+
+    async def scenario(websocket):
+        websocket.client_sends({"type": "endless", "id": "s1"})
+        await websocket.next()
+        websocket.client_sends({"type": "endless", "id": "s1"})
+        websocket.client_sends({"type": "endless", "id": "s2"})
+        replies = []
+        while len(replies) < 2:
+            reply = await websocket.next()
+            if reply["type"] == "error":
+                replies.append(reply)
+        websocket.client_sends({"type": "cancel", "id": "s1"})
+        while (reply := await websocket.next())["type"] != "cancelled":
+            pass
+        return replies, reply
+
+    errors, cancelled = session_test(scenario)
+    assert "unique" in errors[0]["error"]
+    assert errors[1]["status"] == 429 and errors[1]["id"] == "s2"
+    assert cancelled == {"id": "s1", "type": "cancelled"}